@@ -1,14 +1,28 @@
+import csv
 from datetime import datetime
+from google.appengine.ext import ndb
+from google.appengine.ext import deferred
 from flask import request, jsonify
 from flask_restful import Resource
 from permissions import require_permissions
-from models.event_model import Event
-from models.point_model import PointRecord, PointCategory
+from utils import resolver
+from utils import payload_cache
+from utils.etags import not_modified, with_etag
+from models.user_model import UserData
+from models.event_model import Event, run_reset_event_summaries
+from models.point_model import PointRecord
+from models.summary_model import PointSummary
+from models.population_model import RecordPopulation
+from models.category_tree import CategoryTree
+from utils.pagination import get_page_args, fetch_page_async, DEFAULT_PAGE_SIZE
+
+# The largest attendance CSV that can be imported, in bytes
+MAX_IMPORT_SIZE = 1024 * 1024
 
 class EventAPI(Resource):
 
     def get(self, event):
-        event = Event.get_from_name(event)
+        event = resolver.event_from_name(event)
         if event is None:
             # TODO (phillip): this code is duplicated, maybe make some sort of default
             # handler that can be called for any resource that doesn't exist?
@@ -19,13 +33,13 @@ class EventAPI(Resource):
         out = {
             u'name': event.name,
             u'date': event.date.strftime('%m/%d/%Y'),
-            u'point-category': event.point_category.get().name,
+            u'point-category': CategoryTree.get().event_category_name(event),
         }
         return jsonify(**out)
 
     @require_permissions(['officer'], output_format='json')
     def delete(self, event):
-        event = Event.get_from_name(event)
+        event = resolver.event_from_name(event)
         if event is None:
             # TODO (phillip): this code is duplicated, maybe make some sort of default
             # handler that can be called for any resource that doesn't exist?
@@ -34,19 +48,12 @@ class EventAPI(Resource):
             return response
 
         event.delete()
+        payload_cache.bump(payload_cache.EVENTS)
 
     def put(self, event):
         data = request.form
 
-        new_event_name = data['name']
-        dup_event = Event.get_from_name(new_event_name)
-        # Don't allow duplicate events
-        if dup_event is not None and new_event_name.replace(" ", "") != event.replace(" ", ""):
-            response = jsonify(message="Duplicate resource")
-            response.status_code = 409
-            return response
-
-        event = Event.get_from_name(event)
+        event = resolver.event_from_name(event)
         if event is None:
             # TODO (phillip): this code is duplicated, maybe make some sort of default
             # handler that can be called for any resource that doesn't exist?
@@ -54,24 +61,35 @@ class EventAPI(Resource):
             response.status_code = 404
             return response
 
+        # Don't allow duplicate events
+        dup_event = resolver.event_from_name(data['name'])
+        if dup_event is not None and dup_event.key != event.key:
+            response = jsonify(message="Duplicate resource")
+            response.status_code = 409
+            return response
+
         # Get the point category by name
-        point_category = PointCategory.get_from_name(data['point-category'])
+        point_category = resolver.category_from_name(data['point-category'])
         if point_category is None:
             raise Exception("Unknonwn point category: " + data['point-category'])
 
-        records = PointRecord.query(PointRecord.event_name == event.name)
-        for record in records:
-            record.event_name = data['name']
-            record.put()
+        # The records reference the event by key, so renaming it doesn't touch
+        # them. If the event changed categories, the summaries of its users are
+        # reset in the background once the event is saved. This also covers an
+        # old category that was deleted.
+        category_changed = event.point_category != point_category.key
 
         event.name = data['name']
         event.date = datetime.strptime(data['date'], "%Y-%m-%d")
         event.point_category = point_category.key
         event.put()
+        payload_cache.bump(payload_cache.EVENTS)
+        if category_changed:
+            deferred.defer(run_reset_event_summaries, event.key)
 
         response = jsonify()
         response.status_code = 201
-        response.headers['location'] = "/api/events/" + event.name.replace(" ", "")
+        response.headers['location'] = "/api/events/" + event.slug
         return response
 
 
@@ -84,34 +102,80 @@ class EventListAPI(Resource):
             category (str): The category you want the events for. If category
                 is 'all', then this will return all events. Any sub_categories
                 will also be queried for events.
+            limit (int): The maximum number of events to return.
+            cursor (str): The `next_cursor` returned with the previous page.
         """
         category = request.args.get("category", "all")
+        limit, cursor = get_page_args()
+        key = EventListAPI.payload_key(category, limit, cursor)
+        response = not_modified(key)
+        if response is not None:
+            return response
+
+        out = EventListAPI.payload(category, limit, cursor, key)
+        if out is None:
+            response = jsonify(message="Category does not exist")
+            response.status_code = 404
+            return response
+
+        return with_etag(jsonify(**out), key)
+
+    @staticmethod
+    def payload_key(category, limit, cursor):
+        return payload_cache.payload_key(
+            "events", [payload_cache.EVENTS, payload_cache.CATEGORIES],
+            {"category": category, "limit": limit, "cursor": cursor})
+
+    @staticmethod
+    def payload(category="all", limit=DEFAULT_PAGE_SIZE, cursor=None, key=None):
+        """ Gets a page of the event list, from the cache if possible.
+
+        Returns None if the category doesn't exist. Pages use this to embed
+        the first page of the list.
+        """
+        key = key or EventListAPI.payload_key(category, limit, cursor)
+        return payload_cache.cached_payload(
+            key, lambda: EventListAPI.build_events(category, limit, cursor))
+
+    @staticmethod
+    def build_events(category, limit, cursor):
+        """ Builds a page of the event list, or returns None if the category
+        doesn't exist.
+        """
         if category == 'all':
             events = Event.query(ancestor=Event.root_key())
+            use_offset = False
         else:
-            category = PointCategory.get_from_name(category)
+            category = resolver.category_from_name(category)
             if category is None:
-                response = jsonify(message="Category does not exist")
-                response.status_code = 404
-                return response
+                return None
 
             keys = []
             keys.append(category.key)
             keys.extend(category.sub_categories)
 
             events = Event.query(Event.point_category.IN(keys), ancestor=Event.root_key())
+            use_offset = True
 
-        events = events.order(Event.date)
+        # Get the categories from the cached category tree while the query
+        # runs instead of getting each event's category one at a time
+        events_future = fetch_page_async(events.order(Event.date), limit, cursor,
+                                         use_offset=use_offset)
+        tree = CategoryTree.get()
+        event_list, next_cursor = events_future.get_result()
+
+        out = {'events': [], 'next_cursor': next_cursor}
+        for event in event_list:
+            if event.deleted:
+                continue
 
-        out = {'events': []}
-        for event in events:
             out['events'].append({
                 "name": event.name,
                 "date": event.date.strftime('%m/%d/%Y'),
-                "point-category": event.point_category.get().name,
+                "point-category": tree.event_category_name(event),
             })
 
-        return jsonify(**out)
+        return out
 
     @require_permissions(['officer'], output_format='json')
     def post(self):
@@ -119,14 +183,14 @@ class EventListAPI(Resource):
         data = request.form
 
         # Don't allow duplicate events
-        event = Event.get_from_name(data['name'])
+        event = resolver.event_from_name(data['name'])
         if event is not None:
             response = jsonify(message="Duplicate resource")
             response.status_code = 409
             return response
 
         # Get the point category by name
-        point_category = PointCategory.get_from_name(data['point-category'])
+        point_category = resolver.category_from_name(data['point-category'])
         if point_category is None:
             raise Exception("Unknonwn point category: " + data['point-category'])
 
@@ -135,12 +199,169 @@ class EventListAPI(Resource):
         new_event.name = data['name']
         new_event.point_category = point_category.key
         new_event.put()
+        payload_cache.bump(payload_cache.EVENTS)
 
-        # Make sure there are point records for this event
-        new_event.populate_records()
+        # Make sure there are point records for this event. Only the first
+        # batch is created before responding; the progress of the rest can be
+        # followed at the population url.
+        population = new_event.populate_records()
 
-        response = jsonify()
+        response = jsonify(population=population.to_dict())
         response.status_code = 201
-        response.headers['location'] = "/api/events/" + new_event.name.replace(" ", "")
+        response.headers['location'] = "/api/events/" + new_event.slug
         return response
 
+
+class EventPopulationAPI(Resource):
+
+    @require_permissions(['officer'], output_format='json')
+    def get(self, event):
+        """ Gets the progress of creating the point records for an event. """
+        event = resolver.event_from_name(event)
+        if event is None:
+            response = jsonify(message="Resource does not exist")
+            response.status_code = 404
+            return response
+
+        population = RecordPopulation.key_for(event.key).get()
+        if population is None:
+            response = jsonify(message="Resource does not exist")
+            response.status_code = 404
+            return response
+
+        return jsonify(**population.to_dict())
+
+
+def parse_attendance(lines):
+    """ Parses the rows of an attendance CSV one line at a time.
+
+    Each row has a username or a full name and the points earned. A first
+    row without valid points is treated as a header.
+
+    Args:
+        lines (iterable): The lines of the CSV.
+
+    Returns:
+        A list of (row number, username, points earned, error) tuples. The
+        error is None if the row is valid.
+    """
+    rows = []
+    for row_number, row in enumerate(csv.reader(lines), 1):
+        try:
+            row = [value.decode('utf-8').strip() for value in row]
+        except UnicodeDecodeError:
+            username = row[0].decode('utf-8', 'replace').replace(" ", "")
+            rows.append((row_number, username, None, "The row is not valid UTF-8"))
+            continue
+
+        if not any(row):
+            continue
+
+        if len(row) < 2:
+            rows.append((row_number, row[0], None, "Expected a username or name and points"))
+            continue
+
+        # The username is the user's full name without spaces
+        username = row[0].replace(" ", "")
+        try:
+            points_earned = float(row[1])
+        except ValueError:
+            if row_number != 1:
+                rows.append((row_number, username, None, "Invalid points: " + row[1]))
+            continue
+
+        rows.append((row_number, username, points_earned, None))
+    return rows
+
+
+class EventAttendanceAPI(Resource):
+
+    @require_permissions(['officer'], output_format='json')
+    def post(self, event):
+        """ Sets the points earned for an event from an attendance CSV.
+
+        The body is a CSV with a username or full name and the points earned
+        on each row. It is parsed as it is read, the users are looked up with
+        batch gets and the records are written with one batch put, so the
+        cost of an import doesn't grow with the number of requests.
+
+        If a user is in the CSV more than once, their last row wins. Like the
+        PointRecordBatchAPI, each changed record is written in a transaction
+        with its user's summary, and the transactions run concurrently.
+
+        Returns:
+            A report with the result of every row.
+        """
+        event = resolver.event_from_name(event)
+        if event is None:
+            response = jsonify(message="Resource does not exist")
+            response.status_code = 404
+            return response
+
+        if request.content_length is None:
+            response = jsonify(message="The CSV's length is required")
+            response.status_code = 411
+            return response
+
+        if request.content_length > MAX_IMPORT_SIZE:
+            response = jsonify(message="The CSV must be at most {0} bytes".format(MAX_IMPORT_SIZE))
+            response.status_code = 413
+            return response
+
+        category_name = CategoryTree.get().event_category_name(event)
+        if category_name is None:
+            response = jsonify(message="The point category of " + event.name + " no longer exists")
+            response.status_code = 409
+            return response
+
+        rows = parse_attendance(request.stream)
+        users_by_name = UserData.get_multi_from_usernames(
+            [username for _, username, _, error in rows if error is None])
+
+        # The last row for each user wins
+        last_rows = {}
+        for row_number, username, _, error in rows:
+            if error is None and username in users_by_name:
+                last_rows[username] = row_number
+
+        user_keys = [users_by_name[username].key for username in last_rows]
+        record_keys = [PointRecord.key_for(k, event.key) for k in user_keys]
+        records = dict(zip(user_keys, ndb.get_multi(record_keys)))
+
+        report = []
+        updates = {}
+        for row_number, username, points_earned, error in rows:
+            result = {"row": row_number, "username": username}
+            report.append(result)
+            if error is not None:
+                result.update(status="error", message=error)
+                continue
+
+            user_data = users_by_name.get(username)
+            if user_data is None:
+                result.update(status="error", message="I don't know that person")
+                continue
+
+            if last_rows[username] != row_number:
+                result.update(status="replaced",
+                              message="Replaced by row {0}".format(last_rows[username]))
+                continue
+
+            record = records[user_data.key]
+            if record is None:
+                result['status'] = "created"
+            elif record.points_earned == points_earned:
+                result['status'] = "unchanged"
+                continue
+            else:
+                result['status'] = "updated"
+
+            updates[user_data.key] = {event.key: (category_name, points_earned)}
+
+        futures = [PointSummary.set_user_points_async(user_key, user_updates)
+                   for user_key, user_updates in updates.iteritems()]
+        ndb.Future.wait_all(futures)
+        for f in futures:
+            f.check_success()
+
+        return jsonify(rows=report)
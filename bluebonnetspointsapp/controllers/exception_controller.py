@@ -2,14 +2,15 @@
 from flask import request, jsonify
 from flask_restful import Resource
 from permissions import require_permissions
-from models.user_model import UserData
+from utils import resolver
 from models.point_model import PointException
+from models.summary_model import PointSummary
 
 class ExceptionAPI(Resource):
 
     @require_permissions(['self', 'officer'], output_format='json', logic='or')
     def get(self, user_id, index):
-        user = UserData.get_user_from_id(user_id)
+        user = resolver.user_from_id(user_id)
         if not user:
             raise Exception("I don't know that person")
 
@@ -29,7 +30,7 @@ class ExceptionAPI(Resource):
     # TODO (phillip): delete needs to be idempotent
     @require_permissions(['other', 'officer'], output_format='json')
     def delete(self, user_id, index):
-        user = UserData.get_user_from_id(user_id)
+        user = resolver.user_from_id(user_id)
         if not user:
             raise Exception("I don't know that person")
 
@@ -39,14 +40,14 @@ class ExceptionAPI(Resource):
             return response
 
         del user.point_exceptions[index]
-        user.put()
+        PointSummary.put_user(user)
 
 
 class ExceptionListAPI(Resource):
 
     @require_permissions(['self', 'officer'], output_format='json', logic='or')
     def get(self, user_id):
-        user = UserData.get_user_from_id(user_id)
+        user = resolver.user_from_id(user_id)
         data = {
             "point_exceptions": [{
                 "point_category": exc.point_category,
@@ -58,7 +59,7 @@ class ExceptionListAPI(Resource):
 
     @require_permissions(['other', 'officer'], output_format='json')
     def post(self, user_id):
-        user = UserData.get_user_from_id(user_id)
+        user = resolver.user_from_id(user_id)
         if not user:
             raise Exception("I don't know that person")
 
@@ -76,7 +77,7 @@ class ExceptionListAPI(Resource):
             user.point_exceptions.append(p)
         else:
             p.points_needed = data.get('points_needed', type=int)
-        user.put()
+        PointSummary.put_user(user)
 
         response = jsonify()
         response.status_code = 201
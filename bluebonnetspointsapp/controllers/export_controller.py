@@ -0,0 +1,177 @@
+import csv
+import json
+import StringIO
+
+from flask import request, Response, stream_with_context
+from flask_restful import Resource
+from google.appengine.ext import ndb
+from permissions import require_permissions
+from models.user_model import UserData
+from models.point_model import PointRecord
+from models.summary_model import PointSummary
+from models.category_tree import CategoryTree
+
+# The number of entities read from the datastore at a time
+EXPORT_BATCH_SIZE = 200
+
+FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+
+def _csv_line(values):
+    out = StringIO.StringIO()
+    csv.writer(out).writerow([
+        v.encode('utf-8') if isinstance(v, unicode) else v for v in values
+    ])
+    return out.getvalue()
+
+
+def export_response(name, header, rows):
+    """ Streams rows as a CSV or JSON lines download.
+
+    Args:
+        name (str): The name of the downloaded file, without an extension.
+        header (list): The name of each column.
+        rows (iterable): The rows as lists of values. This should be a
+            generator so that the rows are never all held in memory.
+
+    URL Args:
+        format (str): 'csv' or 'jsonl'.
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in FORMATS:
+        raise Exception(fmt + " is not a valid format value")
+
+    def generate():
+        if fmt == "csv":
+            yield _csv_line(header)
+            for row in rows:
+                yield _csv_line(row)
+        else:
+            for row in rows:
+                yield json.dumps(dict(zip(header, row))) + "\n"
+
+    # The rows are read while the response is streamed, after the request
+    # would otherwise have ended, so they need the request's context. The
+    # python27 runtime buffers the whole response before sending it anyway,
+    # but only one page of entities is held in memory at a time.
+    response = Response(stream_with_context(generate()), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="{0}.{1}"'.format(name, fmt)
+    return response
+
+
+def _pages(query):
+    """ Yields the pages of a query, following cursors.
+
+    Entities are kept out of the request's context cache, which would
+    otherwise hold everything that was exported.
+    """
+    cursor = None
+    more = True
+    while more:
+        results, cursor, more = query.fetch_page(
+            EXPORT_BATCH_SIZE, start_cursor=cursor, use_cache=False)
+        yield results
+
+
+class PointRecordExportAPI(Resource):
+
+    @require_permissions(['officer'], output_format='json')
+    def get(self):
+        """ Downloads every point record.
+
+        Each page of records is joined with its users and events by a single
+        batch get, and the categories come from the cached category tree.
+        """
+        tree = CategoryTree.get()
+
+        def rows():
+            for records in _pages(PointRecord.query()):
+                records = [r for r in records if r.user_data and r.event]
+                keys = list({r.user_data for r in records} | {r.event for r in records})
+                entities = dict(zip(keys, ndb.get_multi(keys, use_cache=False)))
+                for record in records:
+                    user_data = entities[record.user_data]
+                    event = entities[record.event]
+                    if user_data is None or event is None or event.deleted:
+                        continue
+
+                    category = tree.by_key.get(event.point_category)
+                    yield [
+                        user_data.username,
+                        event.name,
+                        event.date.strftime('%Y-%m-%d'),
+                        category.name if category is not None else None,
+                        record.points_earned,
+                    ]
+
+        header = ["username", "event_name", "date", "point_category", "points_earned"]
+        return export_response("point-records", header, rows())
+
+
+class StandingsExportAPI(Resource):
+
+    @require_permissions(['officer'], output_format='json')
+    def get(self):
+        """ Downloads how many points every member has received and needs.
+
+        The points come from each user's PointSummary, so only one page of
+        users and their summaries is in memory at a time.
+
+        URL Args:
+            filter (str): Which users to include. Can be 'active', 'inactive'
+                or 'both'.
+        """
+        user_filter = request.args.get("filter", "active")
+        if user_filter not in ["active", "inactive", "both"]:
+            raise Exception(user_filter + " is not a valid filter value")
+
+        if user_filter == "active":
+            q = UserData.query().filter(UserData.active == True)
+        elif user_filter == "inactive":
+            q = UserData.query().filter(UserData.active == False)
+        else:
+            q = UserData.query()
+        q = q.order(UserData.first_name)
+
+        # Each category gets a received and a required column. A top level
+        # category is followed by its sub-categories.
+        tree = CategoryTree.get()
+        columns = []
+        for cat in sorted(tree.top_level, key=lambda c: c.name):
+            columns.append((cat.name, None))
+            for sub in tree.children(cat):
+                columns.append((sub.name, cat.name))
+
+        def rows():
+            for users in _pages(q):
+                keys = [PointSummary.key_for(u.key) for u in users]
+                summaries = ndb.get_multi(keys, use_cache=False)
+
+                # Compute any missing summaries concurrently. They aren't
+                # saved, since this is a read.
+                missing = [PointSummary.compute_async(u)
+                           for u, s in zip(users, summaries) if s is None]
+                rebuilt = iter([f.get_result() for f in missing])
+                summaries = [s if s is not None else next(rebuilt) for s in summaries]
+
+                for u, summary in zip(users, summaries):
+                    row = [u.user_id, u.username, u.first_name, u.last_name, u.active]
+                    for name, parent in columns:
+                        if parent is None:
+                            points = summary.categories.get(name, {})
+                        else:
+                            points = summary.categories.get(parent, {}).get(
+                                u'sub_categories', {}).get(name, {})
+                        row.append(points.get(u'received', 0))
+                        row.append(points.get(u'required', 0))
+                    yield row
+
+        header = ["user_id", "username", "fname", "lname", "active"]
+        for name, _ in columns:
+            header.append(name + " received")
+            header.append(name + " required")
+        return export_response("standings", header, rows())
@@ -1,13 +1,16 @@
 from flask import request, jsonify
 from flask_restful import Resource
-from permissions import require_permissions
+from google.appengine.ext import ndb
+from permissions import require_permissions, check_perms
+from utils import resolver
+from utils import payload_cache
 from models.user_model import UserData
 
 class PermissionAPI(Resource):
 
     @require_permissions(['other', 'officer'], output_format='json')
     def delete(self, user_id, perm):
-        user = UserData.get_user_from_id(user_id)
+        user = resolver.user_from_id(user_id)
         if perm not in user.user_permissions:
             response = jsonify(message="Resource does not exist")
             response.status_code = 404
@@ -15,13 +18,14 @@ class PermissionAPI(Resource):
 
         user.user_permissions.remove(perm)
         user.put()
+        payload_cache.bump(payload_cache.USERS)
 
 
 class PermissionListAPI(Resource):
 
     @require_permissions(['officer'], output_format='json')
     def get(self, user_id):
-        user = UserData.get_user_from_id(user_id)
+        user = resolver.user_from_id(user_id)
         data = {
             u'permissions': user.user_permissions,
         }
@@ -30,7 +34,7 @@ class PermissionListAPI(Resource):
 
     @require_permissions(['officer'], output_format='json')
     def post(self, user_id):
-        user = UserData.get_user_from_id(user_id)
+        user = resolver.user_from_id(user_id)
         data = request.form
         perm = data['permission']
         if perm not in user.user_permissions:
@@ -39,9 +43,82 @@ class PermissionListAPI(Resource):
             # admin privileges but it would fool my permissions system
             user.user_permissions.append(perm)
         user.put()
+        payload_cache.bump(payload_cache.USERS)
 
         response = jsonify()
         response.status_code = 201
         response.headers['location'] = "/api/users/" + user.user_id + \
                                        "/permissions/" + perm
         return response
+
+
+def bad_request(message):
+    response = jsonify(message=message)
+    response.status_code = 400
+    return response
+
+
+class PermissionBatchAPI(Resource):
+
+    @require_permissions(['officer'], output_format='json')
+    def put(self):
+        """ Grants and revokes permissions for many users at once.
+
+        The body is a JSON object with a list of `operations`, each with a
+        `user_id`, a `permission` and an `action` of 'grant' or 'revoke'.
+        The operations are applied in order. Like PermissionAPI's delete, an
+        officer can't revoke their own permissions.
+
+        The users are read with one batch get and the users whose permissions
+        changed are written with one batch put. Nothing is written if any
+        operation is invalid.
+        """
+        data = request.get_json(force=True)
+        operations = data.get('operations') if isinstance(data, dict) else None
+        if not isinstance(operations, list):
+            return bad_request("Expected a list of operations")
+
+        for op in operations:
+            if not isinstance(op, dict):
+                return bad_request("Each operation must be an object")
+            if not op.get('user_id'):
+                return bad_request("The user_id was empty")
+            if op.get('action') not in ['grant', 'revoke']:
+                return bad_request("The action must be 'grant' or 'revoke'")
+            if not op.get('permission'):
+                return bad_request("The permission was empty")
+
+        user_ids = list({op['user_id'] for op in operations})
+        found = ndb.get_multi([ndb.Key(UserData, uid) for uid in user_ids])
+        users_by_id = dict(zip(user_ids, found))
+        missing = [uid for uid, user in users_by_id.iteritems() if user is None]
+        if missing:
+            response = jsonify(message="Resource does not exist", user_ids=missing)
+            response.status_code = 404
+            return response
+
+        current_user = resolver.current_user_data()
+        for op in operations:
+            user = users_by_id[op['user_id']]
+            if op['action'] == 'revoke' and not check_perms(current_user, 'other', user):
+                response = jsonify(message="Don't have permission", perms=['other'])
+                response.status_code = 403
+                return response
+
+        before = {uid: list(user.user_permissions) for uid, user in users_by_id.iteritems()}
+        for op in operations:
+            user = users_by_id[op['user_id']]
+            perm = op['permission']
+            if op['action'] == 'grant' and perm not in user.user_permissions:
+                user.user_permissions.append(perm)
+            elif op['action'] == 'revoke' and perm in user.user_permissions:
+                user.user_permissions.remove(perm)
+
+        # Users whose operations cancel out aren't written
+        changed = [u for uid, u in users_by_id.iteritems()
+                   if u.user_permissions != before[uid]]
+        ndb.put_multi(changed)
+        if changed:
+            payload_cache.bump(payload_cache.USERS)
+
+        return jsonify(updated=len(changed))
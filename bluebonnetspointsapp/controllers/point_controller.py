@@ -1,22 +1,41 @@
+import logging
+
+from google.appengine.ext import ndb
+from google.appengine.ext import deferred
 from flask import request, jsonify
 from flask_restful import Resource
 from permissions import require_permissions
+from utils import resolver
+from utils import payload_cache
+from utils.etags import not_modified, with_etag
 from models.user_model import UserData
 from models.event_model import Event
 from models.point_model import PointRecord, PointCategory, PointException
+from models.summary_model import PointSummary
+from models.category_tree import CategoryTree
+from utils.point_summaries import run_update_requirements
+from utils.pagination import get_page_args, fetch_page
+from utils.field_plans import FieldPlan
+
+# The fields of a point record that are needed to build the PointRecordAPI's
+# response. The rest come from the record's user and event.
+RECORD_FIELDS = FieldPlan([
+    ('user_data', PointRecord.user_data),
+    ('event', PointRecord.event),
+    ('points_earned', PointRecord.points_earned),
+])
 
 class PointCategoryAPI(Resource):
 
     def get(self, name):
-        category = PointCategory.get_from_name(name)
+        category = resolver.category_from_name(name)
         if category is None:
             response = jsonify(message="Resource does not exist")
             response.status_code = 404
             return response
 
-        sub_categories = []
-        for cat in category.sub_categories:
-            sub_categories.append(cat.get().name)
+        tree = CategoryTree.get()
+        sub_categories = [sub.name for sub in tree.children(category)]
 
         data = {
             "sub_categories": sub_categories,
@@ -25,26 +44,35 @@ class PointCategoryAPI(Resource):
         return jsonify(**data)
 
     def delete(self, name):
-        category = PointCategory.get_from_name(name)
+        category = resolver.category_from_name(name)
         if category is None:
             response = jsonify(message="Resource does not exist")
             response.status_code = 404
             return response
 
+        # Events can't be left without a category
+        q = Event.query(Event.point_category == category.key, ancestor=Event.root_key())
+        if q.get(keys_only=True) is not None:
+            response = jsonify(message="The point category is used by events")
+            response.status_code = 409
+            return response
+
         category.key.delete();
+        deferred.defer(run_update_requirements)
 
     def patch(self, name):
         data = request.form
         baby_requirement = data.get('baby_requirement', None)
         member_requirement = data.get('member_requirement', None)
 
-        category = PointCategory.get_from_name(name)
+        category = resolver.category_from_name(name)
         if baby_requirement is not None:
             category.baby_requirement = int(baby_requirement)
 
         if member_requirement is not None:
             category.member_requirement = int(member_requirement)
         category.put()
+        deferred.defer(run_update_requirements)
 
         # TODO (phillip): A put request (and really any other request that creates or
         # updates an object) should return the new representation of that
@@ -55,41 +83,132 @@ class PointCategoryAPI(Resource):
         return response
 
 
+def bad_request(message):
+    response = jsonify(message=message)
+    response.status_code = 400
+    return response
+
+
+class PointRecordBatchAPI(Resource):
+
+    @require_permissions(['officer'], output_format='json')
+    def put(self):
+        """ Sets the points earned for many point records at once.
+
+        The body is a JSON object with a list of `updates`, each with a
+        `username`, `event_name` and `points-earned` like the PointRecordAPI's
+        put. If a record is updated more than once, the last update wins and
+        the record is only written once. Records that don't exist are
+        created.
+
+        Every update is checked before anything is written. A malformed
+        update is a 400 naming its index, and unknown users and events are a
+        404 listing all of them. Every user's records and summary are written
+        with one transaction, and the transactions of different users run
+        concurrently.
+        """
+        data = request.get_json(force=True)
+        updates = data.get('updates') if isinstance(data, dict) else None
+        if not isinstance(updates, list):
+            return bad_request("Expected a list of updates")
+
+        # Coalesce the updates to each record, keeping the last one
+        latest = {}
+        for i, update in enumerate(updates):
+            if not isinstance(update, dict):
+                return bad_request("Update %d must be an object" % i)
+            for field in ['username', 'event_name']:
+                if not isinstance(update.get(field), basestring) or not update[field]:
+                    return bad_request("Update %d has no %s" % (i, field))
+            try:
+                points_earned = float(update.get('points-earned'))
+            except (TypeError, ValueError):
+                return bad_request("Update %d has invalid points-earned" % i)
+            latest[(update['username'], update['event_name'])] = points_earned
+
+        users_by_name = UserData.get_multi_from_usernames(
+            [username for username, _ in latest])
+        event_names = {event_name for _, event_name in latest}
+        events_by_name = {name: resolver.event_from_name(name) for name in event_names}
+
+        missing_users = sorted({username for username, _ in latest
+                                if username not in users_by_name})
+        missing_events = sorted(name for name, event in events_by_name.iteritems()
+                                if event is None)
+        if missing_users or missing_events:
+            response = jsonify(message="Resource does not exist",
+                               usernames=missing_users, event_names=missing_events)
+            response.status_code = 404
+            return response
+
+        tree = CategoryTree.get()
+        by_user = {}
+        for (username, event_name), points_earned in latest.iteritems():
+            user_data = users_by_name[username]
+            event = events_by_name[event_name]
+
+            category_name = tree.event_category_name(event)
+            if category_name is None:
+                response = jsonify(message="The point category of " + event.name + " no longer exists")
+                response.status_code = 409
+                return response
+            by_user.setdefault(user_data.key, {})[event.key] = (category_name, points_earned)
+
+        futures = [PointSummary.set_user_points_async(user_key, user_updates)
+                   for user_key, user_updates in by_user.iteritems()]
+        updated = sum(f.get_result() for f in futures)
+
+        return jsonify(updated=updated)
+
+
 class PointCategoryListAPI(Resource):
 
     @require_permissions(['officer'], output_format='json')
     def get(self):
-        point_categories = PointCategory.query(ancestor=PointCategory.root_key())
+        key = PointCategoryListAPI.payload_key()
+        response = not_modified(key)
+        if response is not None:
+            return response
+
+        out = PointCategoryListAPI.payload(key)
+        return with_etag(jsonify(**out), key)
+
+    @staticmethod
+    def payload_key():
+        return payload_cache.payload_key("categories", [payload_cache.CATEGORIES], {})
+
+    @staticmethod
+    def payload(key=None):
+        """ Gets the category list, from the cache if possible.
+
+        Pages use this to embed the list.
+        """
+        key = key or PointCategoryListAPI.payload_key()
+        return payload_cache.cached_payload(key, PointCategoryListAPI.build_categories)
+
+    @staticmethod
+    def build_categories():
+        """ Builds the category list. """
+        tree = CategoryTree.get()
         out = {}
-        for p in point_categories:
-            if p.parent is None:
-                out[p.name] = {
-                    "name": p.name,
-                    "baby_requirement": p.baby_requirement,
-                    "member_requirement": p.member_requirement,
-                    "sub_categories": [],
+        for p in tree.top_level:
+            out[p.name] = {
+                "name": p.name,
+                "baby_requirement": p.baby_requirement,
+                "member_requirement": p.member_requirement,
+                "sub_categories": [],
+            }
+            for sub in tree.children(p):
+                sub_cat = {
+                    "name": sub.name,
+                    "baby_requirement": sub.baby_requirement,
+                    "member_requirement": sub.member_requirement,
                 }
-                invalid_keys = []
-                for key in p.sub_categories:
-                    sub = key.get()
-
-                    # The key in sub_categories is no longer valid
-                    if sub is None:
-                        invalid_keys.append(key)
-                    else:
-                        sub_cat = {
-                            "name": sub.name,
-                            "baby_requirement": sub.baby_requirement,
-                            "member_requirement": sub.member_requirement,
-                        }
-                        out[p.name]['sub_categories'].append(sub_cat)
-
-                for key in invalid_keys:
-                    p.sub_categories.remove(key)
-                if invalid_keys:
-                    p.put()
+                out[p.name]['sub_categories'].append(sub_cat)
 
-        return jsonify(**out)
+        # The tree skips keys in sub_categories that are no longer valid, and
+        # the integrity sweep removes them
+        return out
 
     @require_permissions(['officer'], output_format='json')
     def post(self):
@@ -107,17 +226,24 @@ class PointCategoryListAPI(Resource):
         # Therefore, we should wait until the end of the function to call a
         # put if possible.
 
-        # Check to see if the category already exists
-        for category in PointCategory.query():
-            if category.name == data['name']:
-                new_category = category
-                new_key = new_category.key
-
-                parent = new_category.parent
-                if parent is not None:
-                    # Update old parent sub categories
-                    parent.sub_categories.remove(new_key)
-                    parent.put()
+        # Check to see if the category already exists. Categories are
+        # identified by their slug, so a different name with the same slug is
+        # not allowed.
+        category = resolver.category_from_name(data['name'])
+        if category is not None:
+            if category.name != data['name']:
+                response = jsonify(message="Duplicate resource")
+                response.status_code = 409
+                return response
+
+            new_category = category
+            new_key = new_category.key
+
+            parent = new_category.parent
+            if parent is not None:
+                # Update old parent sub categories
+                parent.sub_categories.remove(new_key)
+                parent.put()
 
         # If the category doesn't exist, create a new one
         if not new_category:
@@ -130,76 +256,131 @@ class PointCategoryListAPI(Resource):
         # TODO (phillip): Should I really also be checking for "none"? Is there a
         # better way?
         if parent is not None and parent != "none":
-            parent = PointCategory.get_from_name(parent)
+            parent = resolver.category_from_name(parent)
             parent.sub_categories.append(new_key)
             parent.put()
 
+        deferred.defer(run_update_requirements)
+
         response = jsonify()
         response.status_code = 201
-        response.headers['location'] = "/api/point-categories/" + new_category.name.replace(" ", "")
+        response.headers['location'] = "/api/point-categories/" + new_category.slug
         return response
 
 class PointRecordAPI(Resource):
 
-    # TODO (phillip): write tests for this method
     def get(self):
+        """ Gets a page of point records.
+
+        The pages are in key order, and only the records within each page
+        are sorted by username. Clients that show a list sorted by username
+        need to get every page first and sort the whole list.
+
+        URL Args:
+            event_name (str): Only get the records for this event.
+            username (str): Only get the records for this user.
+            limit (int): The maximum number of records to return.
+            cursor (str): The `next_cursor` returned with the previous page.
+        """
         event_name = request.args.get("event_name", "all")
         username = request.args.get("username", "all")
+        limit, cursor = get_page_args()
 
-        records = PointRecord.query()
         # TODO (phillip): probably shouldn't make these special cases?
+        event = None
         if event_name != "all":
-            records = records.filter(PointRecord.event_name == event_name)
+            event = resolver.event_from_name(event_name)
+            if event is None:
+                return jsonify(records=[], next_cursor=None)
 
+        # The records are fetched with projection queries, so only the
+        # properties in RECORD_FIELDS are read
+        next_cursor = None
+        fixed = {}
         if username != "all":
-            records = records.filter(PointRecord.username == username)
-
-        records = records.order(PointRecord.username)
+            user_data = resolver.user_from_username(username)
+            if user_data is None:
+                return jsonify(records=[], next_cursor=None)
+
+            if event is not None:
+                record = PointRecord.key_for(user_data.key, event.key).get()
+                records = [record] if record is not None else []
+            else:
+                # Every record is a child of its user, so this is strongly consistent
+                q = PointRecord.query(ancestor=user_data.key)
+                records, next_cursor = fetch_page(
+                    q, limit, cursor, projection=RECORD_FIELDS.projection())
+        elif event is not None:
+            q = PointRecord.query(PointRecord.event == event.key)
+            fixed['event'] = event.key
+            records, next_cursor = fetch_page(
+                q, limit, cursor, projection=RECORD_FIELDS.projection(fixed))
+        else:
+            records, next_cursor = fetch_page(
+                PointRecord.query(), limit, cursor,
+                projection=RECORD_FIELDS.projection())
+
+        # Join the records with their users and events by key with a single
+        # batch get. The categories come from the cached category tree.
+        rows = [(r.key, RECORD_FIELDS.serialize(r, fixed)) for r in records]
+        rows = [(k, row) for k, row in rows if row['user_data'] and row['event']]
+        keys = list({row['user_data'] for _, row in rows} |
+                    {row['event'] for _, row in rows})
+        entities = dict(zip(keys, ndb.get_multi(keys)))
+        tree = CategoryTree.get()
+
+        out = {'records': [], 'next_cursor': next_cursor}
+        for record_key, row in rows:
+            event = entities[row['event']]
+            user_data = entities[row['user_data']]
+            if event is not None and event.deleted:
+                # The event's records are being deleted
+                continue
 
-        out = {'records': []}
-        for record in records:
-            event = Event.get_from_name(record.event_name)
-            if event is None:
-                logging.error("Tried to get a point record with an invalid event name: " + record.event_name)
-                record.key.delete()
+            if event is None or user_data is None:
+                # The integrity sweep deletes records like this
+                logging.warning("Skipped a point record with an invalid event or user: " + str(record_key))
                 continue
 
-            point_cat = event.point_category.get().name
             out['records'].append({
-                'event_name': record.event_name,
-                'username': record.username,
-                'points-earned': record.points_earned,
-                'point-category': point_cat,
+                'event_name': event.name,
+                'username': user_data.username,
+                'points-earned': row['points_earned'],
+                'point-category': tree.event_category_name(event),
             })
 
+        out['records'].sort(key=lambda r: r['username'])
         return jsonify(**out)
 
     @require_permissions(['officer'], output_format='json')
     def put(self):
         data = request.form
 
-        user_data = UserData.get_from_username(data['username'])
+        user_data = resolver.user_from_username(data['username'])
         if not user_data:
             raise Exception("I don't know that person")
 
-        event = Event.get_from_name(data['event_name'])
+        event = resolver.event_from_name(data['event_name'])
         if not event:
             raise Exception("I don't know that event")
 
-        point_record = PointRecord.query(PointRecord.event_name == event.name,
-                                         PointRecord.username == user_data.username).get()
+        record_key = PointRecord.key_for(user_data.key, event.key)
+        point_record = record_key.get()
         # TODO (phillip): this might allow me to not create new records every time a
         # new event or user is created because a record will be created when
         # the client tries to modify a record that should exist
         # Create a point record if one does not exist
         if not point_record:
-            # TODO (phillip): does this work with the user key as the ancestor?
-            point_record = PointRecord(parent=user_data.key)
+            point_record = PointRecord.for_user_and_event(user_data.key, event.key)
+
+        category_name = CategoryTree.get().event_category_name(event)
+        if category_name is None:
+            response = jsonify(message="The point category of " + event.name + " no longer exists")
+            response.status_code = 409
+            return response
 
-        point_record.event_name = event.name
-        point_record.username = user_data.username
-        point_record.points_earned = float(data['points-earned'])
-        point_record.put()
+        PointSummary.set_record_points(point_record, user_data.key, category_name,
+                                       float(data['points-earned']))
 
         # TODO (phillip): A put request (and really any other request that creates or
         # updates an object) should return the new representation of that
@@ -0,0 +1,115 @@
+from flask import request, jsonify
+from flask_restful import Resource
+from permissions import require_permissions
+from models.user_model import UserData
+from models.event_model import Event
+from models.point_model import PointRecord
+from models.category_tree import CategoryTree
+
+class StandingsAPI(Resource):
+
+    @require_permissions(['officer'], output_format='json')
+    def get(self):
+        """ Gets how many points every member has received and needs.
+
+        The standings are computed in one pass with a single query each for
+        the users, categories, events and records, so the cost grows with the
+        number of records rather than users times records.
+
+        URL Args:
+            filter (str): Which users to include. Can be 'active', 'inactive'
+                or 'both'.
+            sort (str): 'name' to sort by first name or 'deficit' to put the
+                users who need the most points first.
+        """
+        user_filter = request.args.get("filter", "active")
+        if user_filter not in ["active", "inactive", "both"]:
+            raise Exception(user_filter + " is not a valid filter value")
+
+        sort = request.args.get("sort", "name")
+        if sort not in ["name", "deficit"]:
+            raise Exception(sort + " is not a valid sort value")
+
+        if user_filter == "active":
+            q = UserData.query().filter(UserData.active == True)
+        elif user_filter == "inactive":
+            q = UserData.query().filter(UserData.active == False)
+        else:
+            q = UserData.query()
+        users = q.order(UserData.first_name).fetch()
+
+        # Order the categories so each top level category is followed by its
+        # sub-categories. Each category gets a column in the matrix.
+        tree = CategoryTree.get()
+        columns = []
+        parents = []
+        for cat in sorted(tree.top_level, key=lambda c: c.name):
+            parent_index = len(columns)
+            columns.append(cat)
+            parents.append(None)
+            for sub in tree.children(cat):
+                columns.append(sub)
+                parents.append(parent_index)
+        column_index = {cat.key: i for i, cat in enumerate(columns)}
+        top_level = [i for i, p in enumerate(parents) if p is None]
+
+        # Map each event to the column its points are counted in
+        event_columns = {}
+        for event in Event.query(ancestor=Event.root_key()):
+            if not event.deleted and event.point_category in column_index:
+                event_columns[event.key] = column_index[event.point_category]
+
+        # Accumulate the points for every record into a row per user. Only the
+        # index rows of the properties that are needed are read (see the
+        # PointRecord projection indexes in index.yaml).
+        rows = {u.key: [0] * len(columns) for u in users}
+        projection = [PointRecord.user_data, PointRecord.event, PointRecord.points_earned]
+        for record in PointRecord.query().iter(projection=projection):
+            row = rows.get(record.user_data)
+            col = event_columns.get(record.event)
+            if row is None or col is None or not record.points_earned:
+                continue
+
+            row[col] += record.points_earned
+            if parents[col] is not None:
+                row[parents[col]] += record.points_earned
+
+        base_required = {
+            baby: [tree.requirement(cat, baby) for cat in columns]
+            for baby in [True, False]
+        }
+
+        standings = []
+        for u in users:
+            received = rows[u.key]
+            required = list(base_required[u.is_baby()])
+            point_exceptions = {exc.point_category: exc.points_needed for exc in u.point_exceptions}
+            for i, cat in enumerate(columns):
+                if cat.name in point_exceptions:
+                    required[i] = point_exceptions[cat.name]
+
+            remaining = [max(0, req - rec) for req, rec in zip(required, received)]
+            standings.append({
+                "user_id": u.user_id,
+                "username": u.username,
+                "fname": u.first_name,
+                "lname": u.last_name,
+                "active": u.active,
+                "received": received,
+                "required": required,
+                "remaining": remaining,
+                "deficit": sum(remaining[i] for i in top_level),
+            })
+
+        if sort == "deficit":
+            standings.sort(key=lambda s: s['deficit'], reverse=True)
+
+        out = {
+            "categories": [{
+                "name": cat.name,
+                "level": 1 if parents[i] is None else 2,
+                "parent": None if parents[i] is None else columns[parents[i]].name,
+            } for i, cat in enumerate(columns)],
+            "standings": standings,
+        }
+        return jsonify(**out)
@@ -1,19 +1,33 @@
 from flask import request, jsonify
 from flask_restful import Resource
 from permissions import require_permissions
-from models.user_model import UserData
+from utils import resolver
+from utils import payload_cache
+from utils.etags import make_etag, not_modified, with_etag
+from models.user_model import UserData, UniqueUsername
 from models.event_model import Event
-from models.point_model import PointRecord, PointCategory
+from models.summary_model import PointSummary
+from models.population_model import RecordPopulation
+from models.category_tree import CategoryTree
+from utils.pagination import get_page_args, fetch_page, DEFAULT_PAGE_SIZE
+from utils.field_plans import FieldPlan
+from datetime import datetime, time
 from google.appengine.api import users
-from google.appengine.ext import deferred
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
 
 # TODO (phillip): possibly allow for using username in place of user_id
 class UserAPI(Resource):
 
     @require_permissions(['self', 'officer'], output_format='json', logic='or')
     def get(self, user_id):
-        user = UserData.get_user_from_id(user_id)
-        data = {
+        user = resolver.user_from_id(user_id)
+        return jsonify(**UserAPI.serialize(user))
+
+    @staticmethod
+    def serialize(user):
+        """ Builds the representation of a user returned by `get`. """
+        return {
             "active": user.active,
             "classification": user.classification,
             "grad_year": user.graduation_year,
@@ -28,8 +42,6 @@ class UserAPI(Resource):
             } for exc in user.point_exceptions],
         }
 
-        return jsonify(**data)
-
     @require_permissions(['self', 'officer'], output_format='json', logic='or')
     def put(self, user_id):
         """ Updates the user profile information
@@ -38,11 +50,12 @@ class UserAPI(Resource):
         exceptions in this method because the method does not update the point
         exceptions.
         """
-        user = UserData.get_user_from_id(user_id)
+        user = resolver.user_from_id(user_id)
         if not user:
             raise Exception("I don't know that person")
 
         data = request.form
+        old_username = user.username
         user.first_name = data['fname']
         user.last_name = data['lname']
         if data['active'] == "true":
@@ -52,7 +65,13 @@ class UserAPI(Resource):
         user.classification = data['classification']
         user.graduation_semester = data['grad_semester']
         user.graduation_year = data.get('grad_year', type=int)
-        user.put()
+
+        # Don't allow duplicate usernames
+        if not user.put_with_username(old_username):
+            response = jsonify(message="Duplicate resource")
+            response.status_code = 409
+            return response
+        payload_cache.bump(payload_cache.USERS)
 
         # TODO (phillip): A put request (and really any other request that creates or
         # updates an object) should return the new representation of that
@@ -72,177 +91,192 @@ class UserAPI(Resource):
 # point and how many community points the user has.
 class UserPointsAPI(Resource):
 
-    @staticmethod
-    def reshape_categories(cat_info):
-        """ Reshape flat list of catory information to include structure.
-
-        Args:
-            cat_info (dict): A flat dictionary of all categories, their point
-                requirements, and their points earned.
+    @require_permissions(['self', 'officer'], output_format='json', logic='or')
+    def get(self, user_id):
+        """ Gets the points a user has received and needs in each category.
 
-        Returns:
-            A structured dictionary with each category, its sub-categoires,
-            points required, and points earned.
+        The points are served from the user's PointSummary, which is kept up
+        to date whenever points or requirements change. Its ETag is based on
+        when the summary was last saved. A summary that hasn't been saved yet
+        is computed instead, and gets an ETag from its body.
         """
-        out = {}
-
-        # TODO (phillip): this code is probably duplicated from the PointCategoryListAPI
-        point_categories = PointCategory.query(ancestor=PointCategory.root_key())
-        for cat in point_categories:
-            if cat.parent is None:
-                out[cat.name] = {
-                    "required": cat_info['categories'][cat.name]['required'],
-                    "received": cat_info['categories'][cat.name]['received'],
-                    "level": 1,
-                    "sub_categories": {},
-                }
-
-                invalid_keys = []
-                for key in cat.sub_categories:
-                    sub = key.get()
-
-                    # The key in sub_categories is no longer valid
-                    if sub is None:
-                        invalid_keys.append(key)
-                    else:
-                        sub_cat = {
-                            "required": cat_info['categories'][sub.name]['required'],
-                            "received": cat_info['categories'][sub.name]['received'],
-                            "level": 2,
-                        }
-                        out[cat.name]['sub_categories'][sub.name] = sub_cat
-
-                for key in invalid_keys:
-                    cat.sub_categories.remove(key)
-                if invalid_keys:
-                    cat.put()
-
-        return out
+        summary = PointSummary.get_for_user_async(ndb.Key(UserData, user_id)).get_result()
+        if summary is None:
+            response = jsonify(message="Resource does not exist")
+            response.status_code = 404
+            return response
+
+        if summary.updated is None:
+            return jsonify(**summary.categories)
+
+        etag = make_etag("points", summary.key.urlsafe(), summary.updated)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        return with_etag(jsonify(**summary.categories), etag)
+
+class UserDashboardAPI(Resource):
 
     @require_permissions(['self', 'officer'], output_format='json', logic='or')
     def get(self, user_id):
-        output = {
-            u'categories': {}
-        }
+        """ Gets everything the dashboard shows for a user in one response.
 
-        user = UserData.get_user_from_id(user_id)
-
-        point_exceptions = {exc.point_category: exc.points_needed for exc in user.point_exceptions}
-        categories = PointCategory.query(ancestor=PointCategory.root_key())
-        for cat in categories:
-            # TODO (phillip): Write tests to test the behavior when calculating requirement for
-            # a category with children having a higher requirement. (i.e. max(self, children))
-
-            # TODO (phillip): remove some of the ugly repeated code below
-            # Add each category and the required number of points
-            if user.is_baby():
-                requirement = cat.baby_requirement
-                if requirement is None:
-                    requirement = 0
-
-                sub_req_list = []
-                for sub in cat.sub_categories:
-                    req = sub.get().member_requirement
-                    if req is None:
-                        sub_req_list.append(0)
-                    else:
-                        sub_req_list.append(req)
-                sub_req = sum(sub_req_list)
-                requirement = max(requirement, sub_req)
-            else:
-                requirement = cat.member_requirement
-                if requirement is None:
-                    requirement = 0
-
-                # TODO (phillip): add test when one of the requirements is None
-                sub_req_list = []
-                for sub in cat.sub_categories:
-                    req = sub.get().member_requirement
-                    if req is None:
-                        sub_req_list.append(0)
-                    else:
-                        sub_req_list.append(req)
-                sub_req = sum(sub_req_list)
-                requirement = max(requirement, sub_req)
-
-            if cat.name in point_exceptions:
-                requirement = point_exceptions[cat.name]
-
-            output['categories'][cat.name] = {
-                u'required': requirement,
-            }
+        This is the user's points in each category (see UserPointsAPI) and
+        the upcoming events, ordered by date.
 
-
-            output['categories'][cat.name]['received'] = 0
-            if cat.parent is not None:
-                output['categories'][cat.name]['level'] = 2
-            else:
-                output['categories'][cat.name]['level'] = 1
-
-        # NOTE: At this point I am assuming each category has been added to
-        # the output. If this is not true, the following code will fail
-        # miserably.
-        records = PointRecord.query()
-        #username = user.username
-        records = records.filter(PointRecord.username == user.username)
-        for record in records:
-            event = Event.get_from_name(record.event_name)
-            if event is None:
-                logging.error("Uknown event " + record.event_name + " requested for point record: " + str(record))
-                record.key.delete()
+        URL Args:
+            limit (int): The maximum number of events to return.
+        """
+        limit, _ = get_page_args()
+        today = datetime.combine(datetime.utcnow().date(), time())
+        events_query = Event.query(Event.date >= today, ancestor=Event.root_key())
+
+        # The summary and the events are fetched at the same time, and the
+        # categories come from the cached category tree
+        summary_future = PointSummary.get_for_user_async(ndb.Key(UserData, user_id))
+        events_future = events_query.order(Event.date).fetch_async(limit)
+        tree = CategoryTree.get()
+
+        summary = summary_future.get_result()
+        if summary is None:
+            response = jsonify(message="Resource does not exist")
+            response.status_code = 404
+            return response
+
+        events = []
+        for event in events_future.get_result():
+            if event.deleted:
                 continue
 
-            category = event.point_category.get()
-            if record.points_earned is None:
-                record.points_earned = 0
-                record.put()
-            output['categories'][category.name]['received'] += record.points_earned
+            events.append({
+                "name": event.name,
+                "date": event.date.strftime('%m/%d/%Y'),
+                "point-category": tree.event_category_name(event),
+            })
+
+        return jsonify(categories=summary.categories, events=events)
 
-            # Make sure to also count the points for the parent category
-            if category.parent is not None:
-                output['categories'][category.parent.name]['received'] += record.points_earned
-                output['categories'][category.name]['level'] = 2
+class UserPopulationAPI(Resource):
 
-        output = self.reshape_categories(output)
+    @require_permissions(['self', 'officer'], output_format='json', logic='or')
+    def get(self, user_id):
+        """ Gets the progress of creating the point records for a user. """
+        population = RecordPopulation.key_for(ndb.Key(UserData, user_id)).get()
+        if population is None:
+            response = jsonify(message="Resource does not exist")
+            response.status_code = 404
+            return response
 
-        return jsonify(**output)
+        return jsonify(**population.to_dict())
 
 # TODO (phillip): I need to return the proper error response when a request does not
 # contain the proper data. See http://stackoverflow.com/questions/3050518/what-http-status-response-code-should-i-use-if-the-request-is-missing-a-required
 
+# The fields returned for each user by the UserListAPI for each view
+USER_LIST_VIEWS = {
+    # The members page only needs scalar fields, so it is served with a
+    # projection query
+    "members": FieldPlan([
+        ("fname", UserData.first_name),
+        ("lname", UserData.last_name),
+        ("active", UserData.active),
+        ("grad_year", UserData.graduation_year),
+        ("grad_semester", UserData.graduation_semester),
+        ("classification", UserData.classification),
+        ("user_id", UserData.user_id),
+    ]),
+    "permissions": FieldPlan([
+        ("fname", UserData.first_name),
+        ("lname", UserData.last_name),
+        ("permissions", UserData.user_permissions),
+        ("user_id", UserData.user_id),
+    ]),
+    "all": FieldPlan([
+        ("fname", UserData.first_name),
+        ("lname", UserData.last_name),
+        ("active", UserData.active),
+        ("grad_year", UserData.graduation_year),
+        ("grad_semester", UserData.graduation_semester),
+        ("classification", UserData.classification),
+        ("permissions", UserData.user_permissions),
+        ("user_id", UserData.user_id),
+    ]),
+}
+
 class UserListAPI(Resource):
 
     @require_permissions(['officer'], output_format='json')
     def get(self):
+        """ Gets a page of users ordered by first name.
+
+        URL Args:
+            filter (str): Which users to include. Can be 'active', 'inactive'
+                or 'both'.
+            view (str): Which fields to return for each user. Can be
+                'members', 'permissions' or 'all'.
+            limit (int): The maximum number of users to return.
+            cursor (str): The `next_cursor` returned with the previous page.
+        """
         user_filter = request.args.get("filter", "both")
         if user_filter not in ["active", "inactive", "both"]:
             raise Exception(user_filter + " is not a valid filter value")
 
+        view = request.args.get("view", "all")
+        if view not in USER_LIST_VIEWS:
+            raise Exception(view + " is not a valid view value")
+
+        limit, cursor = get_page_args()
+        key = UserListAPI.payload_key(user_filter, view, limit, cursor)
+        response = not_modified(key)
+        if response is not None:
+            return response
+
+        data = UserListAPI.payload(user_filter, view, limit, cursor, key)
+        return with_etag(jsonify(**data), key)
+
+    @staticmethod
+    def payload_key(user_filter, view, limit, cursor):
+        return payload_cache.payload_key(
+            "users", [payload_cache.USERS],
+            {"filter": user_filter, "view": view, "limit": limit, "cursor": cursor})
+
+    @staticmethod
+    def payload(user_filter, view, limit=DEFAULT_PAGE_SIZE, cursor=None, key=None):
+        """ Gets a page of the user list, from the cache if possible.
+
+        Pages use this to embed the first page of the list, so it is only
+        serialized once and is shared with the API.
+        """
+        key = key or UserListAPI.payload_key(user_filter, view, limit, cursor)
+        return payload_cache.cached_payload(
+            key, lambda: UserListAPI.build_users(user_filter, view, limit, cursor))
+
+    @staticmethod
+    def build_users(user_filter, view, limit, cursor):
+        """ Builds a page of the user list. """
+        plan = USER_LIST_VIEWS[view]
+        fixed = {}
         if user_filter == "active":
             q = UserData.query().filter(UserData.active == True)
+            fixed['active'] = True
         elif user_filter == "inactive":
             q = UserData.query().filter(UserData.active == False)
+            fixed['active'] = False
         else:
             q =  UserData.query()
 
         q = q.order(UserData.first_name)
+        user_list, next_cursor = fetch_page(q, limit, cursor,
+                                            projection=plan.projection(fixed))
 
-        data = {"users":[]}
-        for u in q:
-            # TODO (phillip): code to create a user json object is duplicated in multiple
-            # places. I should keep it in one spot (maybe UserData)
-            data['users'].append({
-                "fname": u.first_name,
-                "lname": u.last_name,
-                "active": u.active,
-                "grad_year": u.graduation_year,
-                "grad_semester": u.graduation_semester,
-                "classification": u.classification,
-                "permissions": u.user_permissions,
-                "user_id": u.user_id,
-            })
-
-        return jsonify(**data)
+        # TODO (phillip): code to create a user json object is duplicated in multiple
+        # places. I should keep it in one spot (maybe UserData)
+        data = {
+            "users": [plan.serialize(u, fixed) for u in user_list],
+            "next_cursor": next_cursor,
+        }
+        return data
 
     def post(self):
         """ Adds a new user
@@ -274,30 +308,191 @@ class UserListAPI(Resource):
         if data['lname'] == "":
             raise Exception("The first name was empty")
 
-        # TODO (phillip): A duplicate username should produce a better error than a 500
-        other_users = UserData.query()
-        other_user = None
-        for user in other_users:
-            if user.username == data['fname'] + data['lname']:
-                other_user = user
-        if other_user is not None:
-            raise Exception("There is already a user with that name.")
-
         user_data.last_name = data['lname']
         user_data.graduation_year = int(data['grad_year'])
         user_data.graduation_semester = data['grad_semester']
         user_data.classification = data['classification']
         user_data.active = True
         user_data.user_permissions = ['user']
-        user_data.put()
+
+        # TODO (phillip): A duplicate username should produce a better error than a 500
+        if not user_data.put_with_username():
+            raise Exception("There is already a user with that name.")
+        payload_cache.bump(payload_cache.USERS)
 
         # TODO (phillip): find a better way that doesn't require you to remember to add
         # this line every single time you want to create a UserData object.
         # Create the necessary point records
-        user_data.populate_records()
+        population = user_data.populate_records()
 
-        response = jsonify()
+        response = jsonify(population=population.to_dict())
         response.status_code = 201
         response.headers['location'] = '/api/users/' + str(user_data.user_id)
         return response
 
+
+
+# The roster fields that can be set, and the UserData properties they set
+ROSTER_FIELDS = [
+    ("active", "active"),
+    ("classification", "classification"),
+    ("grad_semester", "graduation_semester"),
+    ("grad_year", "graduation_year"),
+]
+
+
+def roster_values(row):
+    """ Gets the UserData properties a roster row sets.
+
+    Raises:
+        BadValueError: If a value is not valid for its property.
+    """
+    values = {}
+    for field, prop in ROSTER_FIELDS:
+        if field in row:
+            values[prop] = row[field]
+    if values.get("graduation_year") is not None:
+        try:
+            values["graduation_year"] = int(values["graduation_year"])
+        except ValueError:
+            raise datastore_errors.BadValueError("grad_year must be a number")
+    # Creating an entity validates the values without changing any user
+    UserData(**values)
+    return values
+
+
+class RosterAPI(Resource):
+
+    @require_permissions(['officer'], output_format='json')
+    def put(self):
+        """ Syncs the users with a roster.
+
+        The body is a JSON object with a list of `users`. Each user is matched
+        by `user_id`, or by `fname` and `lname` if there is no `user_id`, and
+        their `active`, `classification`, `grad_semester` and `grad_year` are
+        updated. Users that don't exist are created if they have a `user_id`,
+        which is the user id of their google account, an `fname` and an
+        `lname`. If `deactivate_missing` is true, active users that aren't in
+        the roster are made inactive.
+
+        The existing users are read with one query and their changes are
+        written with one batch put. Each new user is put in a transaction
+        that claims their username. The point records for all of the new
+        users are created by a single population.
+
+        Returns:
+            A report with the result of every row and the population of the
+            new users.
+        """
+        data = request.get_json(force=True)
+        rows = data.get('users') if isinstance(data, dict) else None
+        if not isinstance(rows, list):
+            raise Exception("Expected a list of users")
+
+        existing = UserData.query().fetch()
+        by_id = {u.user_id: u for u in existing if u.user_id}
+        by_username = {u.username: u for u in existing}
+
+        # The query is eventually consistent, so users that were just created
+        # are looked up by key before they are created again
+        missing_ids = [row['user_id'] for row in rows
+                       if isinstance(row, dict) and row.get('user_id')
+                       and row['user_id'] not in by_id]
+        for user_data in ndb.get_multi([ndb.Key(UserData, uid) for uid in missing_ids]):
+            if user_data is not None:
+                by_id[user_data.user_id] = user_data
+                by_username[user_data.username] = user_data
+
+        usernames = [(row.get('fname') or "") + (row.get('lname') or "")
+                     for row in rows if isinstance(row, dict)]
+        markers = ndb.get_multi([ndb.Key(UniqueUsername, u) for u in usernames if u])
+        taken = {m.key.id(): m.user for m in markers if m is not None}
+
+        report = []
+        seen = set()
+        to_put = []
+        created = []
+        for row_number, row in enumerate(rows, 1):
+            result = {"row": row_number}
+            report.append(result)
+            if not isinstance(row, dict):
+                result.update(status="error", message="Expected an object")
+                continue
+
+            user_id = row.get('user_id')
+            username = (row.get('fname') or "") + (row.get('lname') or "")
+            result['username'] = username
+            if user_id:
+                user_data = by_id.get(user_id)
+            else:
+                user_data = by_username.get(username)
+
+            try:
+                values = roster_values(row)
+            except datastore_errors.BadValueError as e:
+                result.update(status="error", message=str(e))
+                continue
+
+            if user_data is not None:
+                result['username'] = user_data.username
+                if user_data.key in seen:
+                    result.update(status="error", message="This user is already in the roster")
+                    continue
+                seen.add(user_data.key)
+
+                if all(getattr(user_data, prop) == value for prop, value in values.iteritems()):
+                    result['status'] = "unchanged"
+                    continue
+                user_data.populate(**values)
+                to_put.append(user_data)
+                result['status'] = "updated"
+                continue
+
+            if not user_id or not row.get('fname') or not row.get('lname'):
+                result.update(status="error",
+                              message="New users need a user_id, fname and lname")
+                continue
+
+            key = ndb.Key(UserData, user_id)
+            if username in by_username or taken.get(username, key) != key:
+                result.update(status="error", message="There is already a user with that name")
+                continue
+
+            values.setdefault("active", True)
+            user_data = UserData(key=key, user_id=user_id, first_name=row['fname'],
+                                 last_name=row['lname'], user_permissions=['user'], **values)
+            by_id[user_id] = user_data
+            by_username[username] = user_data
+            seen.add(user_data.key)
+            created.append((user_data, result))
+
+        if data.get('deactivate_missing'):
+            for user_data in existing:
+                if user_data.key not in seen and user_data.active:
+                    user_data.active = False
+                    to_put.append(user_data)
+                    report.append({"username": user_data.username, "status": "deactivated"})
+
+        ndb.put_multi(to_put)
+
+        # Another request may have claimed the username since it was checked
+        new_keys = []
+        for user_data, result in created:
+            if user_data._put_with_username(None):
+                new_keys.append(user_data.key)
+                result['status'] = "created"
+            else:
+                result.update(status="error", message="There is already a user with that name")
+
+        if to_put or new_keys:
+            payload_cache.bump(payload_cache.USERS)
+
+        population = None
+        if new_keys:
+            populations = UserData.populate_records_multi(new_keys)
+            population = {
+                "complete": all(p.complete for p in populations),
+                "created": sum(p.created for p in populations),
+            }
+
+        return jsonify(rows=report, population=population)
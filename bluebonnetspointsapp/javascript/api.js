@@ -3,14 +3,14 @@ UserList = (function() {
         console.log("Initializing UserList");
     };
 
-    var get_users = function(filter, callback) {
+    var get_users = function(filter, view, callback, first_page) {
         status_map = {true: 'Active', false: 'Inactive'};
 
         var params = {
-            filter: filter
+            filter: filter,
+            view: view
         };
-        var params_str = $.param(params);
-        $.get("/api/users?" + params_str, callback);
+        get_pages("/api/users", params, "users", callback, first_page);
     };
 
     return {
@@ -24,8 +24,8 @@ EventList = (function() {
         console.log("Initializing EventList");
     };
 
-    var get_events = function(callback) {
-        $.get("/api/events", callback);
+    var get_events = function(callback, first_page) {
+        get_pages("/api/events", {}, "events", callback, first_page);
     };
 
     return {
@@ -51,3 +51,127 @@ PointCategories = (function() {
         get_point_categories: get_point_categories,
     };
 })();
+
+Standings = (function() {
+    var init = function() {
+        console.log("Initializing Standings");
+    };
+
+    var get_standings = function(filter, sort, callback) {
+        var params = {
+            filter: filter,
+            sort: sort,
+        };
+        var params_str = $.param(params);
+        $.get("/api/standings?" + params_str, callback);
+    };
+
+    return {
+        init: init,
+        get_standings: get_standings,
+    };
+})();
+
+PointRecords = (function() {
+    // How long to wait after the last change before saving
+    var SAVE_DELAY = 500;
+
+    var pending = {};
+    var timer = null;
+    var on_save = null;
+    var on_fail = null;
+
+    var init = function(success, fail) {
+        console.log("Initializing PointRecords");
+        on_save = success;
+        on_fail = fail;
+    };
+
+    var save = function() {
+        var updates = $.map(pending, function(update) { return update; });
+        pending = {};
+        timer = null;
+        if (updates.length === 0) {
+            return;
+        }
+
+        $.ajax({
+            url: "/api/point-records/batch",
+            type: "PUT",
+            contentType: "application/json",
+            data: JSON.stringify({updates: updates}),
+        }).success(on_save).fail(on_fail);
+    };
+
+    // Queues a change to the points of a record. Changes are sent together
+    // once no changes have been made for SAVE_DELAY ms, and only the last
+    // change to each record is sent.
+    var update_points = function(username, event_name, points_earned) {
+        pending[username + "\n" + event_name] = {
+            'username': username,
+            'event_name': event_name,
+            'points-earned': points_earned,
+        };
+        clearTimeout(timer);
+        timer = setTimeout(save, SAVE_DELAY);
+    };
+
+    return {
+        init: init,
+        update_points: update_points,
+        save: save,
+    };
+})();
+
+Permissions = (function() {
+    // How long to wait after the last change before saving
+    var SAVE_DELAY = 500;
+
+    var pending = {};
+    var timer = null;
+    var on_save = null;
+    var on_fail = null;
+
+    var init = function(success, fail) {
+        console.log("Initializing Permissions");
+        on_save = success;
+        on_fail = fail;
+    };
+
+    var save = function() {
+        var operations = $.map(pending, function(op) { return op; });
+        pending = {};
+        timer = null;
+        if (operations.length === 0) {
+            return;
+        }
+
+        $.ajax({
+            url: "/api/permissions/batch",
+            type: "PUT",
+            contentType: "application/json",
+            data: JSON.stringify({operations: operations}),
+        }).success(on_save).fail(function(data) {
+            on_fail(data, operations);
+        });
+    };
+
+    // Queues a permission to be granted or revoked. Changes are sent together
+    // once no changes have been made for SAVE_DELAY ms, and only the last
+    // change to each user's permission is sent.
+    var set_permission = function(user_id, perm, granted) {
+        pending[user_id + "\n" + perm] = {
+            'user_id': user_id,
+            'permission': perm,
+            'action': granted ? 'grant' : 'revoke',
+        };
+        clearTimeout(timer);
+        timer = setTimeout(save, SAVE_DELAY);
+    };
+
+    return {
+        init: init,
+        set_permission: set_permission,
+        save: save,
+    };
+})();
@@ -2,3 +2,43 @@ var caps = function(string) {
     return string.charAt(0).toUpperCase() + string.slice(1);
 };
 
+
+// The number of times each url has been loaded with get_pages
+var page_loads = {};
+
+// Gets every page of a paginated list endpoint. `on_page` is called with the
+// data of each page as it arrives and the number of `key` items before it.
+// If the page embedded the first page of the list, pass it as `first_page`
+// so only the pages after it are requested.
+//
+// Loading a url again (e.g. with a different filter) abandons the previous
+// load of it, so pages from the previous load are ignored.
+var get_pages = function(url, params, key, on_page, first_page) {
+    var load = (page_loads[url] || 0) + 1;
+    page_loads[url] = load;
+
+    var count = 0;
+    var add_page = function(data) {
+        if (page_loads[url] !== load) {
+            return;
+        }
+        on_page(data, count);
+        count += data[key].length;
+        if (data.next_cursor) {
+            get_page(data.next_cursor);
+        }
+    };
+    var get_page = function(cursor) {
+        var page_params = $.extend({}, params);
+        if (cursor) {
+            page_params.cursor = cursor;
+        }
+        $.get(url + "?" + $.param(page_params), add_page);
+    };
+
+    if (first_page) {
+        add_page(first_page);
+    } else {
+        get_page(null);
+    }
+};
@@ -0,0 +1,138 @@
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from .point_model import PointCategory
+
+# The memcache key of the version of the point categories. It is incremented
+# whenever a point category is written, which tells every instance to rebuild
+# its cached tree.
+VERSION_KEY = "category_tree_version"
+
+# The tree cached in instance memory
+_cached_tree = None
+
+
+def category_requirement(category, sub_categories, baby=False):
+    """ Gets the points required for a category.
+
+    A category requires the larger of its own requirement and the sum of its
+    sub-categories' requirements.
+    """
+    def requirement(cat):
+        if baby:
+            req = cat.baby_requirement
+        else:
+            req = cat.member_requirement
+        return req or 0
+
+    # TODO (phillip): Write tests to test the behavior when calculating requirement for
+    # a category with children having a higher requirement. (i.e. max(self, children))
+    return max(requirement(category), sum(requirement(sub) for sub in sub_categories))
+
+
+def _new_version():
+    # The version is based on the time so that it is not reused if memcache
+    # evicts it
+    return int(time.time() * 1000000)
+
+
+def current_version():
+    version = memcache.get(VERSION_KEY)
+    if version is None:
+        version = _new_version()
+        if not memcache.add(VERSION_KEY, version):
+            version = memcache.get(VERSION_KEY)
+    return version
+
+
+class CategoryTree(object):
+    """ A snapshot of every PointCategory and how they are nested.
+
+    The tree is built with one query and is cached in instance memory, so
+    finding a category's parent or requirement doesn't need any datastore
+    calls. The categories in the tree are shared between requests and must
+    not be modified.
+    """
+
+    def __init__(self, categories, version=None):
+        self.version = version
+        self.categories = categories
+        self.by_key = {cat.key: cat for cat in categories}
+        self.by_name = {cat.name: cat for cat in categories}
+
+        self._children = {}
+        self._parents = {}
+        self._invalid_keys = {}
+        for cat in categories:
+            # Keys in sub_categories that are no longer valid are skipped
+            self._children[cat.key] = [self.by_key[k] for k in cat.sub_categories
+                                       if k in self.by_key]
+            self._invalid_keys[cat.key] = [k for k in cat.sub_categories
+                                           if k not in self.by_key]
+            for child in self._children[cat.key]:
+                self._parents[child.key] = cat
+
+        self.top_level = [cat for cat in categories if cat.key not in self._parents]
+
+        self._requirements = {
+            baby: {
+                cat.key: category_requirement(cat, self._children[cat.key], baby)
+                for cat in categories
+            } for baby in [True, False]
+        }
+
+    @staticmethod
+    def build(version=None):
+        keys = PointCategory.query(ancestor=PointCategory.root_key()).fetch(keys_only=True)
+        # The tree's categories are not shared with the context cache, since
+        # handlers may modify the categories they get
+        categories = [cat for cat in ndb.get_multi(keys, use_cache=False)
+                      if cat is not None]
+        return CategoryTree(categories, version)
+
+    @staticmethod
+    def get():
+        """ Gets the current tree, only rebuilding it if a category changed. """
+        global _cached_tree
+        version = current_version()
+        tree = _cached_tree
+        if tree is None or version is None or tree.version != version:
+            tree = CategoryTree.build(version)
+            _cached_tree = tree
+        return tree
+
+    @staticmethod
+    def invalidate():
+        """ Makes every instance rebuild its tree the next time it is used. """
+        global _cached_tree
+        _cached_tree = None
+        memcache.incr(VERSION_KEY, initial_value=_new_version())
+
+    def event_category_name(self, event):
+        """ Gets the name of an event's point category.
+
+        Returns None if the category no longer exists, which the integrity
+        sweep reports so that an officer can give the event a new category.
+        """
+        category = self.by_key.get(event.point_category)
+        if category is None:
+            logging.warning("Event " + str(event.key) + " has unknown point category " + str(event.point_category))
+            return None
+        return category.name
+
+    def parent(self, category):
+        return self._parents.get(category.key)
+
+    def children(self, category):
+        return self._children.get(category.key, [])
+
+    def invalid_keys(self, category):
+        """ Gets the keys in `category.sub_categories` that no longer exist. """
+        return self._invalid_keys.get(category.key, [])
+
+    def requirement(self, category, baby=False):
+        """ Gets the points required for a category, including its children. """
+        return self._requirements[baby][category.key]
@@ -1,34 +1,43 @@
+import logging
+
 from google.appengine.ext import ndb
+from google.appengine.ext import deferred
 from google.appengine.api import users
 import urlparse
-from .point_model import PointRecord
+from .point_model import PointRecord, name_to_slug
 
 # TODO: this only needs to be defined once
 DEFAULT_ROOT_KEY = "default_root_key"
 
+# The number of PointRecords deleted per batch when an event is deleted
+DELETE_BATCH_SIZE = 500
+
 # TODO (phillip): how should I handle timezones? Also, how should I handle dates without
 # times?
 class Event(ndb.Model):
     name = ndb.StringProperty()
+
+    # The name with spaces removed. This is used to look up events from urls
+    # and to make sure two events can't have the same slug.
+    slug = ndb.ComputedProperty(lambda self: name_to_slug(self.name))
+
     date = ndb.DateTimeProperty()
     point_category = ndb.KeyProperty(kind="PointCategory")
     # TODO (phillip): should I add an archived property?
 
+    # Set when the event is being deleted. The event is hidden everywhere
+    # while its records are deleted, and then the event itself is deleted.
+    deleted = ndb.BooleanProperty(default=False, indexed=False)
+
     def populate_records(self):
-        # need to import here since UserData must be initialized first
-        from .user_model import UserData
-        # Create point records for all users for this event
-        users = UserData.query()
-        for user in users:
-            if PointRecord.query(PointRecord.event_name == self.name,
-                                 PointRecord.username == user.username).get() is not None:
-                # There is already a record for this event and this user
-                continue
-
-            new_record = PointRecord()
-            new_record.username = user.username
-            new_record.event_name = self.name
-            new_record.put()
+        """ Creates point records for all users for this event.
+
+        Returns the RecordPopulation that tracks the progress of creating the
+        records, since large chapters are handled in deferred tasks.
+        """
+        # need to import here to avoid a circular import
+        from .population_model import RecordPopulation
+        return RecordPopulation.start(self.key)
 
     def delete(self):
         """ Deletes self from the DataStore.
@@ -39,19 +48,15 @@ class Event(ndb.Model):
         is most likely used by appengine itself so be very careful.
         """
 
-        # TODO (phillip): test the deletion of PointRecords
-        # Delete all PointRecords associated with this event
-        q = PointRecord.query(PointRecord.event_name == self.name)
-        for r in q:
-            r.key.delete()
-
-        # Delete the entity from the datastore.
-        self.key.delete()
+        # Hide the event right away, since deleting the records may take a
+        # number of deferred tasks
+        self.deleted = True
+        self.put()
+        run_delete_event_records(self.key)
 
     @property
     def point_records(self):
-        #return PointRecord.query().filter(PointRecord.event == self.key)
-        return PointRecord.query().filter(PointRecord.event_name == self.name)
+        return PointRecord.query().filter(PointRecord.event == self.key)
 
     @staticmethod
     def root_key():
@@ -69,10 +74,80 @@ class Event(ndb.Model):
         replaced with the proper characters (ex. %2F -> /)
         """
         name = urlparse.unquote(name)
-        q = Event.query(ancestor=Event.root_key())
-        for e in q:
-            if e.name.replace(" ", "") == name.replace(" ", ""):
-                return e
-
+        q = Event.query(Event.slug == name_to_slug(name), ancestor=Event.root_key())
+        for event in q:
+            if not event.deleted:
+                return event
         return None
 
+
+def run_delete_event_records(event_key, cursor=None, num_deleted=0):
+    """ Deletes one batch of an event's PointRecords.
+
+    The records are fetched with a projection of their points. The records
+    with points are deleted one at a time with `PointSummary.delete_record`,
+    which subtracts their points from the owner's summary in the same
+    transaction. The rest are deleted with one batch delete. The next batch
+    is deferred, and the event and its RecordPopulation are deleted with the
+    last batch.
+    """
+    # need to import here to avoid a circular import
+    from .summary_model import PointSummary
+    from .population_model import RecordPopulation
+    from .category_tree import CategoryTree
+
+    q = PointRecord.query(PointRecord.event == event_key)
+    records, cur, more = q.fetch_page(
+        DELETE_BATCH_SIZE, start_cursor=cursor,
+        projection=[PointRecord.user_data, PointRecord.points_earned])
+
+    # If the category no longer exists, delete_record deletes the summaries
+    # instead and they are rebuilt
+    category_name = None
+    event = event_key.get()
+    if event is not None and any(r.points_earned for r in records):
+        category_name = CategoryTree.get().event_category_name(event)
+
+    for r in records:
+        if r.points_earned:
+            PointSummary.delete_record(r, r.key.parent(), category_name)
+
+    zero_keys = [r.key for r in records if not r.points_earned]
+    event_keys = [] if more else [event_key, RecordPopulation.key_for(event_key)]
+    ndb.delete_multi(zero_keys + event_keys)
+    num_deleted += len(records)
+
+    if more:
+        deferred.defer(run_delete_event_records, event_key, cursor=cur,
+                       num_deleted=num_deleted)
+    else:
+        logging.debug(
+            'Deleted event %s and its %d point records', event_key, num_deleted)
+
+def run_reset_event_summaries(event_key, cursor=None, num_reset=0):
+    """ Deletes the PointSummary of every user with points for an event.
+
+    This is used when the event's points move to another category. The
+    summaries are rebuilt with the new category the next time they are
+    requested, or by the integrity sweep. The next batch is deferred.
+    """
+    # need to import here to avoid a circular import
+    from .summary_model import PointSummary
+
+    q = PointRecord.query(PointRecord.event == event_key)
+    records, cur, more = q.fetch_page(
+        DELETE_BATCH_SIZE, start_cursor=cursor,
+        projection=[PointRecord.user_data, PointRecord.points_earned])
+
+    summary_keys = [PointSummary.key_for(r.key.parent())
+                    for r in records if r.points_earned]
+    ndb.delete_multi(summary_keys)
+    num_reset += len(summary_keys)
+
+    if more:
+        deferred.defer(run_reset_event_summaries, event_key, cursor=cur,
+                       num_reset=num_reset)
+    else:
+        logging.debug(
+            'Reset %d point summaries for event %s', num_reset, event_key)
+
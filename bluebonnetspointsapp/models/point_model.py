@@ -5,10 +5,24 @@ import urlparse
 DEFAULT_ROOT_KEY = "default_root_key"
 
 
+def name_to_slug(name):
+    """ Normalizes a name so it can be used in urls and compared.
+
+    Spaces are removed in order to make urls look nicer.
+    """
+    if name is None:
+        return None
+    return name.replace(" ", "")
+
+
 class PointCategory(ndb.Model):
     # The name of the point type (Sisterhood, Philanthropy, etc.)
     name = ndb.StringProperty()
 
+    # The name with spaces removed. This is used to look up categories from
+    # urls and to make sure two categories can't have the same slug.
+    slug = ndb.ComputedProperty(lambda self: name_to_slug(self.name))
+
     # A list of the sub-categories for this point type
     sub_categories = ndb.KeyProperty(kind="PointCategory", repeated=True)
 
@@ -22,8 +36,25 @@ class PointCategory(ndb.Model):
 
     @property
     def parent(self):
-        return PointCategory.query().filter(
-            PointCategory.sub_categories.IN([self.key])).get()
+        # need to import here to avoid a circular import
+        from .category_tree import CategoryTree
+        parent = CategoryTree.get().parent(self)
+        if parent is None:
+            return None
+
+        # Get the parent from the datastore since the tree's copy is shared
+        return parent.key.get()
+
+    def _post_put_hook(self, future):
+        # need to import here to avoid a circular import
+        from .category_tree import CategoryTree
+        CategoryTree.invalidate()
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        # need to import here to avoid a circular import
+        from .category_tree import CategoryTree
+        CategoryTree.invalidate()
 
     @staticmethod
     def get_from_name(name):
@@ -32,15 +63,9 @@ class PointCategory(ndb.Model):
         The spaces in `name` are ignored in order to make urls look nicer
         without any spaces.
         """
-        # TODO (phillip): since this function ignores spaces in the PointCategory name,
-        # I should make sure we can't make duplicate point categories after
-        # spaces have been removed.
-        q = PointCategory.query(ancestor=PointCategory.root_key())
-        for p in q:
-            if p.name.replace(" ", "") == name.replace(" ", ""):
-                return p
-
-        return None
+        q = PointCategory.query(PointCategory.slug == name_to_slug(name),
+                                ancestor=PointCategory.root_key())
+        return q.get()
 
 
 class PointException(ndb.Model):
@@ -56,16 +81,19 @@ class PointException(ndb.Model):
     points_needed = ndb.IntegerProperty(indexed=False)
 
 
-# NOTE The UserData should be the parent entity of the PointRecord. This will
-# allow you to have strong consistency without too much of a burden of 1 write
-# per second in an entity group.
+# NOTE The UserData is the parent entity of the PointRecord. This will allow
+# you to have strong consistency without too much of a burden of 1 write per
+# second in an entity group.
 class PointRecord(ndb.Model):
-    # TODO (phillip): find a way to use keys instead of strings, but for now this should
-    # work just fine.
+    # The user and event are referenced by key so that renaming either of them
+    # doesn't require touching their records.
+    user_data = ndb.KeyProperty(kind="UserData")
+    event = ndb.KeyProperty(kind="Event")
+
+    # DEPRECATED: Records used to reference their user and event by name.
+    # These are only read to migrate old records (see utils/rekey_records.py)
     username = ndb.StringProperty()
     event_name = ndb.StringProperty()
-    #user_data = ndb.KeyProperty(kind="UserData")
-    #event = ndb.KeyProperty(kind="Event")
 
     # NOTE: I believe we can just get the point category associated with the
     # event and not worry about keeping track of the PointCategory for a
@@ -74,3 +102,18 @@ class PointRecord(ndb.Model):
 
     points_earned = ndb.FloatProperty()
 
+    @staticmethod
+    def key_for(user_key, event_key):
+        """ Builds the key of the record for a user and an event.
+
+        Every user has at most one record for each event, so the key can be
+        derived from the two without querying.
+        """
+        return ndb.Key(PointRecord, str(event_key.id()), parent=user_key)
+
+    @staticmethod
+    def for_user_and_event(user_key, event_key):
+        """ Creates a new record for a user and an event. """
+        return PointRecord(key=PointRecord.key_for(user_key, event_key),
+                           user_data=user_key, event=event_key)
+
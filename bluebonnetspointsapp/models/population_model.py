@@ -0,0 +1,162 @@
+import logging
+
+from google.appengine.ext import ndb
+from google.appengine.ext import deferred
+
+from .point_model import PointRecord
+from .event_model import Event
+from .user_model import UserData
+
+BATCH_SIZE = 100  # ideal batch size may vary based on entity size.
+
+
+class RecordPopulation(ndb.Model):
+    """ The progress of creating the PointRecords for a new event or user.
+
+    A population is stored as a child of the Event or UserData that the
+    records are being created for.
+    """
+
+    # The number of users or events that have been checked for records
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+
+    # The number of records that had to be created
+    created = ndb.IntegerProperty(default=0, indexed=False)
+
+    complete = ndb.BooleanProperty(default=False, indexed=False)
+
+    @staticmethod
+    def key_for(target_key):
+        return ndb.Key(RecordPopulation, "records", parent=target_key)
+
+    @staticmethod
+    def start(target_key):
+        """ Starts creating the PointRecords for an Event or UserData.
+
+        The first batch of records is created right away and the rest are
+        created in deferred tasks, so this returns quickly no matter how many
+        users or events there are.
+        """
+        population = RecordPopulation(key=RecordPopulation.key_for(target_key))
+        population.put()
+        run_populate_records(target_key)
+        return population.key.get()
+
+    @staticmethod
+    def start_for_users(user_keys):
+        """ Starts creating the PointRecords for many new users at once.
+
+        Each batch of events is read once and records are created for every
+        user in it, instead of starting a separate population for each user.
+        Each user still gets a RecordPopulation to track the progress.
+
+        Returns:
+            The populations of the users, in the same order as `user_keys`.
+        """
+        populations = [RecordPopulation(key=RecordPopulation.key_for(k)) for k in user_keys]
+        ndb.put_multi(populations)
+        run_populate_users(user_keys)
+        return ndb.get_multi([p.key for p in populations])
+
+    def to_dict(self):
+        return {
+            "processed": self.processed,
+            "created": self.created,
+            "complete": self.complete,
+        }
+
+
+def create_missing_records(user_event_pairs):
+    """ Creates a PointRecord for each (user, event) pair that doesn't have one.
+
+    Args:
+        user_event_pairs (list): (UserData key, Event key) tuples to create
+            records for.
+
+    Returns:
+        The records that were created.
+    """
+    keys = [PointRecord.key_for(u, e) for u, e in user_event_pairs]
+    records = ndb.get_multi(keys)
+
+    to_put = []
+    for record, (user_key, event_key) in zip(records, user_event_pairs):
+        if record is not None:
+            # There is already a record for this event and this user
+            continue
+
+        to_put.append(PointRecord.for_user_and_event(user_key, event_key))
+
+    ndb.put_multi(to_put)
+    return to_put
+
+
+def run_populate_records(target_key, cursor=None):
+    """ Creates PointRecords for one batch of users or events.
+
+    If `target_key` is an Event, records are created for that event and every
+    user. If it is a UserData, records are created for that user and every
+    event. Each batch defers the next one until all have been processed.
+    """
+    population_key = RecordPopulation.key_for(target_key)
+    target = target_key.get()
+    if target is None or getattr(target, 'deleted', False):
+        logging.warning('Cannot populate records for missing entity %s', target_key)
+        population_key.delete()
+        return
+
+    if target_key.kind() == Event._get_kind():
+        q = UserData.query()
+        others, cur, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        pairs = [(k, target_key) for k in others]
+    else:
+        q = Event.query(ancestor=Event.root_key())
+        others, cur, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+        pairs = [(target_key, e.key) for e in others if not e.deleted]
+
+    created = len(create_missing_records(pairs))
+
+    population = population_key.get() or RecordPopulation(key=population_key)
+    population.processed += len(others)
+    population.created += created
+    population.complete = not more
+    population.put()
+    logging.debug(
+        'Created %d records for %s after processing %d entities',
+        created, target_key, population.processed)
+
+    if more:
+        deferred.defer(run_populate_records, target_key, cursor=cur)
+
+
+def run_populate_users(user_keys, cursor=None):
+    """ Creates PointRecords for many users and one batch of events.
+
+    The batches are smaller when there are more users so that each batch
+    creates about BATCH_SIZE records. Each batch defers the next one until
+    every event has been processed.
+    """
+    batch_size = max(1, BATCH_SIZE // len(user_keys))
+    q = Event.query(ancestor=Event.root_key())
+    events, cur, more = q.fetch_page(batch_size, start_cursor=cursor)
+    pairs = [(u, e.key) for e in events if not e.deleted for u in user_keys]
+
+    created = {}
+    for record in create_missing_records(pairs):
+        created[record.user_data] = created.get(record.user_data, 0) + 1
+
+    population_keys = [RecordPopulation.key_for(k) for k in user_keys]
+    populations = []
+    for key, population in zip(population_keys, ndb.get_multi(population_keys)):
+        population = population or RecordPopulation(key=key)
+        population.processed += len(events)
+        population.created += created.get(key.parent(), 0)
+        population.complete = not more
+        populations.append(population)
+    ndb.put_multi(populations)
+    logging.debug(
+        'Created %d records for %d users after processing %d events',
+        sum(created.itervalues()), len(user_keys), len(events))
+
+    if more:
+        deferred.defer(run_populate_users, user_keys, cursor=cur)
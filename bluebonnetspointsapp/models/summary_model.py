@@ -0,0 +1,334 @@
+import logging
+
+from google.appengine.ext import ndb
+
+from .point_model import PointRecord
+from .category_tree import CategoryTree
+
+
+class PointSummary(ndb.Model):
+    """ A materialized view of the points a user has received and needs.
+
+    The summary is stored as a child of the user's UserData so that the
+    points endpoint can serve it with a single key get. Every endpoint that
+    changes points or requirements keeps it up to date, and it can always be
+    rebuilt from the PointRecords with `PointSummary.rebuild`. Missing
+    summaries are computed by the read endpoints without being saved, and
+    are saved by the integrity sweep.
+    """
+
+    # The points received directly in each category, keyed by category name.
+    # Points received in a sub-category are not counted for its parent here.
+    received = ndb.JsonProperty(indexed=False)
+
+    # The structured category dictionary returned by the UserPointsAPI
+    categories = ndb.JsonProperty(indexed=False)
+
+    # When the summary was last saved, which is used as its version
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    @staticmethod
+    def key_for(user_key):
+        return ndb.Key(PointSummary, "points", parent=user_key)
+
+    @staticmethod
+    def get_for_user(user):
+        """ Gets the summary for `user`, computing it if it doesn't exist yet. """
+        return PointSummary.get_for_user_async(user.key).get_result()
+
+    @staticmethod
+    @ndb.tasklet
+    def get_for_user_async(user_key):
+        """ Gets the summary for a user, computing it if it doesn't exist yet.
+
+        The user and their summary are fetched at the same time. A computed
+        summary is not saved, so this never writes. Returns a future for None
+        if the user doesn't exist.
+        """
+        summary, user = yield PointSummary.key_for(user_key).get_async(), user_key.get_async()
+        if user is None:
+            raise ndb.Return(None)
+
+        if summary is None:
+            summary = yield PointSummary.compute_async(user)
+        raise ndb.Return(summary)
+
+    @staticmethod
+    def rebuild(user):
+        """ Recomputes a user's summary from scratch and saves it. """
+        return PointSummary.rebuild_async(user).get_result()
+
+    @staticmethod
+    @ndb.transactional_tasklet(xg=True)
+    def rebuild_async(user, missing_only=False):
+        """ Recomputes a user's summary from scratch and saves it.
+
+        The records are read and the summary is saved in one transaction on
+        the user's entity group. A point write that commits while the
+        summary is being computed makes the transaction retry, instead of
+        being lost when the summary is saved.
+
+        Args:
+            user (UserData): The user to rebuild the summary of.
+            missing_only (bool): Only build the summary if it doesn't exist.
+        """
+        if missing_only:
+            summary = yield PointSummary.key_for(user.key).get_async()
+            if summary is not None:
+                raise ndb.Return(summary)
+
+        summary = yield PointSummary.compute_async(user)
+        yield summary.put_async()
+        raise ndb.Return(summary)
+
+    @staticmethod
+    @ndb.tasklet
+    def compute_async(user):
+        """ Computes a user's summary from scratch without saving it. """
+        # The records are queried while the category tree is loaded
+        received_future = PointSummary.compute_received_async(user.key)
+        tree = CategoryTree.get()
+
+        summary = PointSummary(key=PointSummary.key_for(user.key))
+        summary.received = yield received_future
+        summary.categories = PointSummary.build_categories(user, tree, summary.received)
+        raise ndb.Return(summary)
+
+    @staticmethod
+    def compute_received(user):
+        """ Adds up the points in each category from all of a user's records. """
+        return PointSummary.compute_received_async(user.key).get_result()
+
+    @staticmethod
+    @ndb.tasklet
+    def compute_received_async(user_key):
+        """ Adds up the points in each category from all of a user's records.
+
+        Each record is resolved by its own tasklet, so the event and category
+        lookups of every record are combined into batch gets by ndb's
+        autobatcher.
+        """
+        records = yield PointRecord.query(ancestor=user_key).fetch_async()
+        tree = CategoryTree.get()
+
+        @ndb.tasklet
+        def record_category(record):
+            """ Gets the name of the category a record's points count for. """
+            event = yield record.event.get_async()
+            if event is None:
+                # The integrity sweep deletes records like this
+                logging.warning("Skipped point record " + str(record.key) + " with unknown event " + str(record.event))
+                raise ndb.Return(None)
+
+            if event.deleted:
+                # The event's records are being deleted
+                raise ndb.Return(None)
+
+            category = tree.by_key.get(event.point_category)
+            if category is None and event.point_category is not None:
+                # The category was created after the tree was built
+                category = yield event.point_category.get_async()
+            if category is None:
+                # The integrity sweep reports events like this
+                logging.warning("Skipped point record " + str(record.key) + " for event " + str(event.key) + " with unknown point category")
+                raise ndb.Return(None)
+
+            raise ndb.Return(category.name)
+
+        records = [r for r in records if r.event]
+        names = yield [record_category(r) for r in records]
+
+        received = {}
+        for record, name in zip(records, names):
+            # Records without any points count as 0
+            if name is not None and record.points_earned is not None:
+                received[name] = received.get(name, 0) + record.points_earned
+        raise ndb.Return(received)
+
+    @staticmethod
+    def build_categories(user, tree, received):
+        """ Builds the structured category dictionary for a user.
+
+        Args:
+            user (UserData): The user the dictionary is for. This is used to
+                apply point exceptions and baby requirements.
+            tree (CategoryTree): The point categories.
+            received (dict): The points received directly in each category.
+
+        Returns:
+            A structured dictionary with each category, its sub-categories,
+            points required, and points received.
+        """
+        point_exceptions = {exc.point_category: exc.points_needed for exc in user.point_exceptions}
+
+        def category_output(cat, level):
+            required = tree.requirement(cat, user.is_baby())
+            if cat.name in point_exceptions:
+                required = point_exceptions[cat.name]
+
+            subs = tree.children(cat)
+            return {
+                u'required': required,
+                u'received': received.get(cat.name, 0) + sum(received.get(sub.name, 0) for sub in subs),
+                u'level': level,
+            }
+
+        out = {}
+        for cat in tree.top_level:
+            out[cat.name] = category_output(cat, 1)
+            out[cat.name][u'sub_categories'] = {
+                sub.name: category_output(sub, 2) for sub in tree.children(cat)
+            }
+
+        return out
+
+    def _add_points(self, category_name, delta):
+        """ Adds points to a category and its parent.
+
+        Returns False if the category is not part of this summary.
+        """
+        if category_name in self.categories:
+            self.categories[category_name][u'received'] += delta
+        else:
+            for parent in self.categories.itervalues():
+                if category_name in parent[u'sub_categories']:
+                    parent[u'sub_categories'][category_name][u'received'] += delta
+                    parent[u'received'] += delta
+                    break
+            else:
+                return False
+
+        self.received[category_name] = self.received.get(category_name, 0) + delta
+        return True
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def add_points(user_key, deltas):
+        """ Adds points to a user's summary.
+
+        Args:
+            user_key (ndb.Key): The key of the user that received the points.
+            deltas (dict): The change in points keyed by category name.
+        """
+        deltas = {name: delta for name, delta in deltas.iteritems() if delta}
+        if not deltas:
+            return
+
+        summary = PointSummary.key_for(user_key).get()
+        if summary is None:
+            # The summary will be built the next time it is requested
+            return
+
+        for name, delta in deltas.iteritems():
+            if not summary._add_points(name, delta):
+                # The summary doesn't know about this category, so it is out of
+                # date and needs to be rebuilt the next time it is requested
+                summary.key.delete()
+                return
+
+        summary.put()
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def set_record_points(record, user_key, category_name, points_earned):
+        """ Saves the points for a record and updates the owner's summary. """
+        old_points = 0
+        if record.key is not None:
+            stored = record.key.get()
+            if stored is not None and stored.points_earned is not None:
+                old_points = stored.points_earned
+
+        record.points_earned = points_earned
+        record.put()
+        PointSummary.add_points(user_key, {category_name: points_earned - old_points})
+
+    @staticmethod
+    @ndb.transactional_tasklet
+    def set_user_points_async(user_key, updates):
+        """ Saves the points for many of a user's records and updates their
+        summary.
+
+        A user's records and summary are in the user's entity group, so they
+        are read with one batch get and written with one batch put in a
+        single transaction. Records whose points haven't changed are not
+        written.
+
+        Args:
+            user_key (ndb.Key): The key of the user the records belong to.
+            updates (dict): (category name, points earned) tuples keyed by
+                the key of the record's event.
+
+        Returns:
+            A future for the number of records that were written.
+        """
+        event_keys = list(updates)
+        keys = [PointRecord.key_for(user_key, k) for k in event_keys]
+        entities = yield ndb.get_multi_async(keys + [PointSummary.key_for(user_key)])
+        summary = entities.pop()
+
+        to_put = []
+        deltas = {}
+        for event_key, record in zip(event_keys, entities):
+            category_name, points_earned = updates[event_key]
+            if record is None:
+                record = PointRecord.for_user_and_event(user_key, event_key)
+            elif record.points_earned == points_earned:
+                continue
+
+            old_points = record.points_earned or 0
+            record.points_earned = points_earned
+            to_put.append(record)
+            deltas[category_name] = deltas.get(category_name, 0) + points_earned - old_points
+
+        if summary is not None:
+            for name, delta in deltas.iteritems():
+                if delta and not summary._add_points(name, delta):
+                    # The summary doesn't know about this category, so it
+                    # needs to be rebuilt the next time it is requested
+                    yield summary.key.delete_async()
+                    summary = None
+                    break
+
+        if summary is not None and any(deltas.itervalues()):
+            to_put.append(summary)
+        yield ndb.put_multi_async(to_put)
+        raise ndb.Return(len([e for e in to_put if isinstance(e, PointRecord)]))
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def delete_record(record, user_key, category_name):
+        """ Deletes a record and removes its points from the owner's summary. """
+        stored = record.key.get()
+        if stored is None:
+            return
+
+        if stored.points_earned:
+            PointSummary.add_points(user_key, {category_name: -stored.points_earned})
+        record.key.delete()
+
+    @staticmethod
+    @ndb.transactional
+    def update_requirements(user, tree):
+        """ Recomputes the points required in a user's summary.
+
+        The points received are left alone, so this is cheap enough to run
+        for every user whenever a point category changes.
+        """
+        summary = PointSummary.key_for(user.key).get()
+        if summary is None:
+            return
+
+        summary.categories = PointSummary.build_categories(user, tree, summary.received)
+        summary.put()
+
+    @staticmethod
+    def put_user(user):
+        """ Puts `user` and updates their summary to match their exceptions. """
+        tree = CategoryTree.get()
+
+        @ndb.transactional
+        def txn():
+            user.put()
+            PointSummary.update_requirements(user, tree)
+
+        txn()
@@ -2,10 +2,18 @@ from google.appengine.ext import ndb
 from google.appengine.api import users
 import urlparse
 from .point_model import PointException, PointRecord
-from .event_model import Event
 
 DEFAULT_ROOT_KEY = "default_root_key"
 
+class UniqueUsername(ndb.Model):
+    """ Marks a username as taken by a user.
+
+    The username is the id of the entity, so checking if a username is taken
+    or finding the user with a username only takes a key get.
+    """
+    user = ndb.KeyProperty(kind="UserData", indexed=False)
+
+
 class UserData(ndb.Model):
     # Use a user_id instead of a UserProperty
     # https://cloud.google.com/appengine/docs/python/users/userobjects
@@ -23,6 +31,13 @@ class UserData(ndb.Model):
     first_name = ndb.StringProperty()
     last_name = ndb.StringProperty()
 
+    # The username is generated from the user's first and last name. Users
+    # are looked up by username through a UniqueUsername entity, which also
+    # keeps it unique (see `put_with_username`). Users stored before these
+    # entities existed are claimed by the schema migration.
+    username = ndb.ComputedProperty(
+        lambda self: (self.first_name or "") + (self.last_name or ""))
+
     # Current bluebonnets are active. Past members are inactive (but still
     # available in the datastore if they are needed again)
     active = ndb.BooleanProperty()
@@ -46,18 +61,25 @@ class UserData(ndb.Model):
     user_permissions = ndb.StringProperty(repeated=True)
 
     def populate_records(self):
-        # Create a PointRecord for every event with this user
-        events = Event.query()
-        for event in events:
-            if PointRecord.query(PointRecord.event_name == event.name,
-                                 PointRecord.username == self.username).get() is not None:
-                # There is already a record for this event and this user
-                continue
-
-            new_record = PointRecord()
-            new_record.username = self.username
-            new_record.event_name = event.name
-            new_record.put()
+        """ Creates a PointRecord for every event with this user
+
+        Returns the RecordPopulation that tracks the progress of creating the
+        records, since large numbers of events are handled in deferred tasks.
+        """
+        # need to import here to avoid a circular import
+        from .population_model import RecordPopulation
+        return RecordPopulation.start(self.key)
+
+    @staticmethod
+    def populate_records_multi(user_keys):
+        """ Creates a PointRecord for every event with each of the users
+
+        The records for all of the users are created by one population.
+        Returns the RecordPopulation of each user.
+        """
+        # need to import here to avoid a circular import
+        from .population_model import RecordPopulation
+        return RecordPopulation.start_for_users(user_keys)
 
     @staticmethod
     def get_from_url_segment(url_segment):
@@ -75,16 +97,10 @@ class UserData(ndb.Model):
 
         return user_data
 
-    # TODO (phillip): when creating users we need a way to ensure unique usernames that
-    # are generated using the user's first and last name
-    @property
-    def username(self):
-        return self.first_name + self.last_name
-
     @property
     def point_records(self):
         #return PointRecord.query().filter(PointRecord.user_data == self.key)
-        return PointRecord.query(ancestory=self.key).filter(PointRecord.username == self.username)
+        return PointRecord.query(ancestor=self.key)
 
     @staticmethod
     def get_current_user_data():
@@ -103,15 +119,75 @@ class UserData(ndb.Model):
 
     @staticmethod
     def get_from_username(username):
-        # TODO (phillip): this method sucks
-        # TODO (phillip): this is not strongly consistent because users are not stored in
-        # an entity group and we are not querying by key only.
-        q = UserData.query()
-        for u in q:
-            if u.username == username:
-                return u
-
-        return None
+        """ Gets the user with the given username or returns None
+
+        This looks up the UniqueUsername for `username`, which is strongly
+        consistent. Users stored before usernames were claimed are only found
+        once the schema migration (/admin/updateschema) has claimed them.
+        """
+        if not username:
+            return None
+
+        marker = ndb.Key(UniqueUsername, username).get()
+        if marker is None:
+            return None
+
+        user = marker.user.get()
+        if user is None or user.username != username:
+            return None
+        return user
+
+    @staticmethod
+    def get_multi_from_usernames(usernames):
+        """ Gets the users with the given usernames like `get_from_username`.
+
+        The UniqueUsernames and their users are each fetched with one batch
+        get. Returns a dict of the users keyed by username, which doesn't
+        include the usernames that don't exist.
+        """
+        usernames = list({u for u in usernames if u})
+        markers = ndb.get_multi([ndb.Key(UniqueUsername, u) for u in usernames])
+        user_keys = [m.user for m in markers if m is not None]
+        users_by_key = dict(zip(user_keys, ndb.get_multi(user_keys)))
+
+        found = {}
+        for username, marker in zip(usernames, markers):
+            user = users_by_key.get(marker.user) if marker is not None else None
+            if user is not None and user.username == username:
+                found[username] = user
+        return found
+
+    def put_with_username(self, old_username=None):
+        """ Puts the user and claims their username.
+
+        Args:
+            old_username (str): The user's previous username. If the username
+                has changed, the old username is released.
+
+        Returns:
+            False without putting anything if another user already has the
+            username, otherwise True.
+        """
+        other_user = UserData.get_from_username(self.username)
+        if other_user is not None and other_user.key != self.key:
+            return False
+
+        return self._put_with_username(old_username)
+
+    @ndb.transactional(xg=True)
+    def _put_with_username(self, old_username):
+        marker = ndb.Key(UniqueUsername, self.username).get()
+        if marker is not None and marker.user != self.key:
+            return False
+
+        ndb.put_multi([self, UniqueUsername(id=self.username, user=self.key)])
+
+        if old_username and old_username != self.username:
+            old_marker = ndb.Key(UniqueUsername, old_username).get()
+            if old_marker is not None and old_marker.user == self.key:
+                old_marker.key.delete()
+
+        return True
 
     @staticmethod
     def get_user_from_id(uid):
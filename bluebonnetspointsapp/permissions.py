@@ -3,7 +3,7 @@ from functools import wraps
 from flask import jsonify
 
 from utils.jinja import render_jinja_template
-from models.user_model import UserData
+from utils import resolver
 
 # TODO (phillip): document somewhere what permissions are allowed
 # Possible permissions:
@@ -20,7 +20,7 @@ def require_permissions(perms, logic='and', output_format='html'):
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            current_user = UserData.get_current_user_data()
+            current_user = resolver.current_user_data()
             if not current_user:
                 template_values = {
                     u'message': u"Not logged in",
@@ -37,7 +37,7 @@ def require_permissions(perms, logic='and', output_format='html'):
                 other_user_url_segment = None
 
             if other_user_url_segment:
-                other_user = UserData.get_from_url_segment(other_user_url_segment)
+                other_user = resolver.user_from_url_segment(other_user_url_segment)
             else:
                 other_user = None
 
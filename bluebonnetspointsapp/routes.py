@@ -9,12 +9,15 @@ from google.appengine.api import users
 from google.appengine.ext import deferred
 from datetime import datetime
 
-from models.user_model import UserData
 from models.point_model import PointException, PointCategory, PointRecord
-from models.event_model import Event
 from utils.jinja import render_jinja_template
-from permissions import require_permissions
+from permissions import require_permissions, check_perms
+from utils import resolver
+from utils.etags import add_etag
 from utils.update_schema import run_update_schema
+from utils.point_summaries import run_rebuild_point_summaries
+from utils.rekey_records import run_rekey_point_records
+from utils.integrity_sweep import run_integrity_sweep
 
 # Create the flask app
 app = Flask(__name__)
@@ -28,9 +31,9 @@ api = Api(app)
 def index():
     template_values = {
         'active_page': 'home',
-        'target_user': UserData.get_current_user_data(),
+        'target_user': resolver.current_user_data(),
     }
-    if UserData.get_current_user_data():
+    if resolver.current_user_data():
         return render_jinja_template("dashboard.html", template_values)
     else:
         return render_jinja_template("index.html", template_values)
@@ -41,9 +44,9 @@ def index():
 @require_permissions(['self', 'officer'], logic='or')
 def dashboard(user_url_segment=None):
     if user_url_segment is None:
-        target_user = UserData.get_current_user_data()
+        target_user = resolver.current_user_data()
     else:
-        target_user = UserData.get_from_url_segment(user_url_segment)
+        target_user = resolver.user_from_url_segment(user_url_segment)
     if target_user is None:
         template_values = {
             'target_user': user_url_segment,
@@ -55,7 +58,7 @@ def dashboard(user_url_segment=None):
 
     # If looking at the current user's profile, hilight the users name in the
     # nav bar
-    if target_user == UserData.get_current_user_data():
+    if target_user == resolver.current_user_data():
         return redirect('/'.format(target_user.username))
     else:
         active = None
@@ -76,19 +79,29 @@ def admin():
 @app.route('/members')
 @require_permissions(['officer'])
 def members():
+    # The first page of users is embedded in the page so that it doesn't
+    # need to be requested again
     template_values = {
         'active_page': 'members',
-        'users': UserData.query().order(UserData.first_name),
+        'initial_users': UserListAPI.payload("active", "members"),
     }
 
     return render_jinja_template("members.html", template_values)
 
+@app.route('/standings')
+@require_permissions(['officer'])
+def standings():
+    template_values = {
+        'active_page': 'standings',
+    }
+    return render_jinja_template("standings.html", template_values)
+
 @app.route('/permissions')
 @require_permissions(['officer'])
 def permissions():
     template_values = {
         'active_page': "permissions",
-        'users': UserData.query().order(UserData.first_name),
+        'initial_users': UserListAPI.payload("active", "permissions"),
     }
 
     return render_jinja_template("permissions.html", template_values)
@@ -98,7 +111,7 @@ def permissions():
 @app.route('/profile/<user_url_segment>')
 @require_permissions(['self', 'officer'], logic='or')
 def profile(user_url_segment):
-    target_user = UserData.get_from_url_segment(user_url_segment)
+    target_user = resolver.user_from_url_segment(user_url_segment)
     if target_user is None:
         template_values = {
             'target_user': user_url_segment,
@@ -110,7 +123,7 @@ def profile(user_url_segment):
 
     # If looking at the current user's profile, hilight the users name in the
     # nav bar
-    if target_user == UserData.get_current_user_data():
+    if target_user == resolver.current_user_data():
         active = 'profile'
     else:
         active = None
@@ -118,7 +131,10 @@ def profile(user_url_segment):
     template_values = {
         'active_page': active,
         'target_user': target_user,
+        'initial_user': UserAPI.serialize(target_user),
     }
+    if check_perms(resolver.current_user_data(), 'officer'):
+        template_values['initial_categories'] = PointCategoryListAPI.payload()
     return render_jinja_template("profile.html", template_values)
 
 @app.route('/login')
@@ -141,7 +157,7 @@ def postlogin():
     This takes care of making sure the user has properly setup their account.
     """
     next_url = request.args.get("next", "/")
-    user_data = UserData.get_current_user_data()
+    user_data = resolver.current_user_data()
     if not user_data:
         # Need to create a user account
         signup_url = url_for("signup", next=next_url)
@@ -161,6 +177,7 @@ def signup():
 def point_categories():
     template_values = {
         'active_page': 'point-categories',
+        'initial_categories': PointCategoryListAPI.payload(),
     }
     return render_jinja_template('point-categories.html', template_values)
 
@@ -169,13 +186,15 @@ def point_categories():
 def event_list():
     template_values = {
         'active_page': 'events',
+        'initial_events': EventListAPI.payload(),
+        'initial_categories': PointCategoryListAPI.payload(),
     }
     return render_jinja_template('events.html', template_values)
 
 # TODO (phillip): handle the case when the event does not exist
 @app.route('/events/<event>')
 def event(event):
-    event = Event.get_from_name(event)
+    event = resolver.event_from_name(event)
     template_values = {
         'target_event': event,
     }
@@ -202,25 +221,42 @@ def application_error(e):
 # *************************************************************************** #
 #                               REST API ENDPOINTS                            #
 # *************************************************************************** #
-from controllers.event_controller import EventAPI, EventListAPI
+from controllers.event_controller import EventAPI, EventListAPI, EventPopulationAPI, \
+    EventAttendanceAPI
 from controllers.exception_controller import ExceptionAPI, ExceptionListAPI
-from controllers.permission_controller import PermissionAPI, PermissionListAPI
-from controllers.point_controller import PointRecordAPI, PointCategoryAPI, PointCategoryListAPI
-from controllers.user_controller import UserAPI, UserListAPI, UserPointsAPI
+from controllers.permission_controller import PermissionAPI, PermissionListAPI, PermissionBatchAPI
+from controllers.point_controller import PointRecordAPI, PointCategoryAPI, PointCategoryListAPI, \
+    PointRecordBatchAPI
+from controllers.standings_controller import StandingsAPI
+from controllers.export_controller import PointRecordExportAPI, StandingsExportAPI
+from controllers.user_controller import UserAPI, UserListAPI, UserPointsAPI, UserPopulationAPI, \
+    UserDashboardAPI, RosterAPI
 
 api.add_resource(UserListAPI, '/api/users', endpoint='users')
+api.add_resource(RosterAPI, '/api/roster')
 api.add_resource(UserAPI, '/api/users/<string:user_id>', endpoint='user')
 api.add_resource(ExceptionListAPI, '/api/users/<string:user_id>/point-exceptions')
 api.add_resource(ExceptionAPI, '/api/users/<string:user_id>/point-exceptions/<int:index>')
 api.add_resource(PermissionListAPI, '/api/users/<string:user_id>/permissions')
 api.add_resource(PermissionAPI, '/api/users/<string:user_id>/permissions/<string:perm>')
+api.add_resource(PermissionBatchAPI, '/api/permissions/batch')
 api.add_resource(PointCategoryListAPI, '/api/point-categories')
 api.add_resource(PointCategoryAPI, '/api/point-categories/<string:name>')
 api.add_resource(EventListAPI, '/api/events')
 api.add_resource(EventAPI, '/api/events/<string:event>')
+api.add_resource(EventPopulationAPI, '/api/events/<string:event>/population')
+api.add_resource(EventAttendanceAPI, '/api/events/<string:event>/attendance')
 api.add_resource(PointRecordAPI, '/api/point-records')
+api.add_resource(PointRecordBatchAPI, '/api/point-records/batch')
 api.add_resource(UserPointsAPI, '/api/users/<string:user_id>/points')
+api.add_resource(UserPopulationAPI, '/api/users/<string:user_id>/population')
+api.add_resource(UserDashboardAPI, '/api/users/<string:user_id>/dashboard')
+api.add_resource(StandingsAPI, '/api/standings')
+api.add_resource(PointRecordExportAPI, '/api/export/point-records')
+api.add_resource(StandingsExportAPI, '/api/export/standings')
 
+# Let clients revalidate API responses with If-None-Match
+app.after_request(add_etag)
 
 # *************************************************************************** #
 #                               ADMIN                                         #
@@ -235,6 +271,28 @@ def updateschema():
     deferred.defer(run_update_schema)
     return 'Schema migration successfully initiated.'
 
+@app.route("/admin/rebuildsummaries")
+def rebuildsummaries():
+    """ Rebuilds every user's point summary in case it has drifted. """
+    deferred.defer(run_rebuild_point_summaries)
+    return 'Point summary rebuild successfully initiated.'
+
+@app.route("/admin/rekeyrecords")
+def rekeyrecords():
+    """ Moves every point record to a key built from its user and event. """
+    deferred.defer(run_rekey_point_records)
+    return 'Point record rekey successfully initiated.'
+
+@app.route("/admin/integritysweep")
+def integritysweep():
+    """ Fixes orphaned point records and invalid sub-categories.
+
+    This runs on a schedule (see cron.yaml) since the read endpoints skip bad
+    data instead of fixing it.
+    """
+    deferred.defer(run_integrity_sweep)
+    return 'Integrity sweep successfully initiated.'
+
 if __name__ == "__main__":
     logging.getLogger().setLevel(logging.debug)
 
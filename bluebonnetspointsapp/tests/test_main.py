@@ -1,17 +1,29 @@
 import unittest
 import urllib
+import csv
+import StringIO
 import json
 import mock
 import datetime
 
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore
 from google.appengine.ext import testbed
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
 from google.appengine.ext.ndb import Key
-#from google.appengine.ext import ndb
 
 import routes
-from models.user_model import UserData
+from models.user_model import UserData, UniqueUsername
 from models.point_model import PointRecord, PointCategory, PointException
 from models.event_model import Event
+from models.summary_model import PointSummary
+from models.population_model import RecordPopulation
+from models.category_tree import CategoryTree
+from utils.rekey_records import run_rekey_point_records
+from utils.update_schema import run_update_schema, claim_usernames
+from utils.integrity_sweep import run_integrity_sweep, find_uncategorized_events
+from utils import payload_cache
 
 
 def setup_datastore():
@@ -84,66 +96,59 @@ def setup_datastore():
     ]
     u.put()
 
+    user_keys = [Key(UserData, '100'), Key(UserData, '101'), Key(UserData, '200')]
+    ndb.put_multi(claim_usernames(ndb.get_multi(user_keys)))
+
     # Events
     e = Event(parent=Event.root_key())
     e.name = "My First Event"
     e.date = datetime.datetime(2016, 8, 3)
     e.point_category = philanthropy_key
-    e.put()
+    first_event_key = e.put()
 
     e = Event(parent=Event.root_key())
     e.name = "Habitat for Humanity"
     e.date = datetime.datetime(2016, 3, 4)
     e.point_category = philanthropy_key
-    e.put()
+    habitat_key = e.put()
 
     e = Event(parent=Event.root_key())
     e.name = "Sisterhood Event"
     e.date = datetime.datetime(2016, 8, 2)
     e.point_category = sisterhood_key
-    e.put()
+    sisterhood_event_key = e.put()
 
     e = Event(parent=Event.root_key())
     e.name = "Bloob Time Event"
     e.date = datetime.datetime(2016,9,1)
     e.point_category = bloob_time_key
-    e.put()
+    bloob_time_event_key = e.put()
 
     e = Event(parent=Event.root_key())
     e.name = "Mixers Event"
     e.date = datetime.datetime(2016,5,3)
     e.point_category = mixers_key
-    e.put()
+    mixers_event_key = e.put()
 
     # Point Records
-    p = PointRecord()
-    p.event_name = "Mixers Event"
-    p.username = "BillGates"
+    p = PointRecord.for_user_and_event(Key(UserData, '100'), mixers_event_key)
     p.points_earned = 2
     p.put()
 
-    p = PointRecord()
-    p.event_name = "Sisterhood Event"
-    p.username = "JakeSisko"
+    p = PointRecord.for_user_and_event(Key(UserData, '101'), sisterhood_event_key)
     p.points_earned = 1
     p.put()
 
-    p = PointRecord()
-    p.event_name = "Bloob Time Event"
-    p.username = "JakeSisko"
+    p = PointRecord.for_user_and_event(Key(UserData, '101'), bloob_time_event_key)
     p.points_earned = 3
     p.put()
 
     # TODO (phillip): use next two to test for multiple records of same category
-    p = PointRecord()
-    p.event_name = "Habitat for Humanity"
-    p.username = "BobJoe"
+    p = PointRecord.for_user_and_event(Key(UserData, '200'), habitat_key)
     p.points_earned = 2
     p.put()
 
-    p = PointRecord()
-    p.event_name = "My First Event"
-    p.username = "BobJoe"
+    p = PointRecord.for_user_and_event(Key(UserData, '200'), first_event_key)
     p.points_earned = 1
     p.put()
 
@@ -214,6 +219,26 @@ class MainTestCase(unittest.TestCase):
             'active_page': 'home'
         })
 
+    def test_homepage_gets_current_user_once(self):
+        loginUser(user_id='100')
+        with mock.patch.object(UserData, 'get_user_from_id',
+                               wraps=UserData.get_user_from_id) as get_user:
+            response = self.app.get("/")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, get_user.call_count)
+
+    def test_profile_resolves_users_once(self):
+        loginUser(user_id='200')
+        with mock.patch.object(UserData, 'get_from_username',
+                               wraps=UserData.get_from_username) as get_username:
+            with mock.patch.object(UserData, 'get_user_from_id',
+                                   wraps=UserData.get_user_from_id) as get_user:
+                response = self.app.get("/profile/BillGates")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, get_username.call_count)
+        # Once for the current user and once for the url segment
+        self.assertEqual(2, get_user.call_count)
+
     def test_members_page_off_limits_to_user(self):
         loginUser(user_id='100')
         response = self.app.get('/members')
@@ -227,6 +252,27 @@ class MainTestCase(unittest.TestCase):
         response = self.app.get('/members')
         self.assertEqual(200, response.status_code)
 
+    @mock.patch('routes.render_jinja_template')
+    def test_members_page_embeds_users(self, mock_jinja):
+        mock_jinja.return_value = "Hello"
+        loginUser(user_id='200')
+        self.app.get('/members')
+        template_values = mock_jinja.call_args[0][1]
+
+        response = self.app.get('/api/users?filter=active&view=members')
+        self.assertEqual(json.loads(response.data), template_values['initial_users'])
+
+    @mock.patch('routes.render_jinja_template')
+    def test_profile_page_embeds_user(self, mock_jinja):
+        mock_jinja.return_value = "Hello"
+        loginUser(user_id='100')
+        self.app.get('/profile/BillGates')
+        template_values = mock_jinja.call_args[0][1]
+
+        response = self.app.get('/api/users/100')
+        self.assertEqual(json.loads(response.data), template_values['initial_user'])
+        self.assertNotIn('initial_categories', template_values)
+
     def test_admin_page_off_limits(self):
         loginUser(user_id='100', is_admin=False)
         response = self.app.get('/admin')
@@ -297,10 +343,26 @@ class UsersAPITestCase(unittest.TestCase):
         # Used to debug 500 errors
         routes.app.config['TESTING'] = True
         self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
 
     def test_get_user_list_as_officer(self):
         self.maxDiff = None
-        loginUser(user_id="200")
+        self.loginUser(user_id="200")
         response = self.app.get('/api/users')
         self.assertEqual(200, response.status_code)
         expected = {
@@ -345,14 +407,14 @@ class UsersAPITestCase(unittest.TestCase):
             self.assertIn(u, expected['users'])
 
     def test_get_user_list_forbidden_not_logged_in(self):
-        loginUser('', '')
+        self.loginUser('', '')
         response = self.app.get('/api/users')
         self.assertEqual(403, response.status_code)
         data = json.loads(response.data)
         self.assertEqual("Not logged in", data['message'])
 
     def test_get_user_list_forbidden_not_officer(self):
-        loginUser(user_id="100")
+        self.loginUser(user_id="100")
         response = self.app.get('/api/users')
         self.assertEqual(403, response.status_code)
         data = json.loads(response.data)
@@ -360,7 +422,7 @@ class UsersAPITestCase(unittest.TestCase):
         self.assertEqual(['officer'], data['perms'])
 
     def test_post_user_list(self):
-        loginUser(user_id="300")
+        self.loginUser(user_id="300")
         post_data = {
             u'fname': u"James",
             u'lname': u"Kirk",
@@ -383,7 +445,7 @@ class UsersAPITestCase(unittest.TestCase):
 
     def test_post_user_list_bad_classification(self):
         routes.app.config['TESTING'] = False
-        loginUser(user_id="300")
+        self.loginUser(user_id="300")
         post_data = {
             "fname": "James",
             "lname": "Kirk",
@@ -396,7 +458,7 @@ class UsersAPITestCase(unittest.TestCase):
 
     def test_post_user_list_empty_first_name(self):
         routes.app.config['TESTING'] = False
-        loginUser(user_id="300")
+        self.loginUser(user_id="300")
         post_data = {
             "fname": "",
             "lname": "Kirk",
@@ -409,7 +471,7 @@ class UsersAPITestCase(unittest.TestCase):
 
     def test_post_user_list_empty_last_name(self):
         routes.app.config['TESTING'] = False
-        loginUser(user_id="300")
+        self.loginUser(user_id="300")
         post_data = {
             "fname": "James",
             "lname": "",
@@ -422,7 +484,7 @@ class UsersAPITestCase(unittest.TestCase):
 
     def test_post_user_list_string_year(self):
         routes.app.config['TESTING'] = False
-        loginUser(user_id="300")
+        self.loginUser(user_id="300")
         post_data = {
             "fname": "James",
             "lname": "Kirk",
@@ -435,7 +497,7 @@ class UsersAPITestCase(unittest.TestCase):
 
     def test_post_user_list_bad_semester(self):
         routes.app.config['TESTING'] = False
-        loginUser(user_id="300")
+        self.loginUser(user_id="300")
         post_data = {
             "fname": "James",
             "lname": "Kirk",
@@ -460,7 +522,7 @@ class UsersAPITestCase(unittest.TestCase):
 
     def test_post_user_list_duplicate_username(self):
         routes.app.config['TESTING'] = False
-        loginUser(user_id="300")
+        self.loginUser(user_id="300")
         post_data = {
             u'fname': u"Bill",
             u'lname': u"Gates",
@@ -472,7 +534,7 @@ class UsersAPITestCase(unittest.TestCase):
         self.assertEqual(500, response.status_code)
 
     def test_get_own_user(self):
-        loginUser(user_id="100")
+        self.loginUser(user_id="100")
         response = self.app.get('/api/users/100')
         self.assertEqual(200, response.status_code)
         data = json.loads(response.data)
@@ -495,14 +557,14 @@ class UsersAPITestCase(unittest.TestCase):
         self.assertEqual(expected, data)
 
     def test_get_other_user_fails(self):
-        loginUser(user_id="100")
+        self.loginUser(user_id="100")
         response = self.app.get('/api/users/200')
         self.assertEqual(403, response.status_code)
         data = json.loads(response.data)
         self.assertEqual("Don't have permission", data['message'])
 
     def test_get_other_user_as_officer(self):
-        loginUser(user_id="200")
+        self.loginUser(user_id="200")
         response = self.app.get('/api/users/100')
         self.assertEqual(200, response.status_code)
         data = json.loads(response.data)
@@ -525,7 +587,7 @@ class UsersAPITestCase(unittest.TestCase):
         self.assertEqual(expected, data)
 
     def test_put_current_user(self):
-        loginUser(user_id="100")
+        self.loginUser(user_id="100")
         put_data = {
             u'fname': u"James",
             u'lname': u"Kirk",
@@ -553,7 +615,7 @@ class UsersAPITestCase(unittest.TestCase):
         self.assertEqual(put_data, response_data)
 
     def test_put_other_user_as_officer(self):
-        loginUser(user_id="200")
+        self.loginUser(user_id="200")
         put_data = {
             u'fname': u"James",
             u'lname': u"Kirk",
@@ -581,7 +643,7 @@ class UsersAPITestCase(unittest.TestCase):
         self.assertEqual(put_data, response_data)
 
     def test_put_other_user_without_officer(self):
-        loginUser(user_id="101")
+        self.loginUser(user_id="101")
         put_data = {
             'fname': "James",
             'lname': "Kirk",
@@ -606,6 +668,127 @@ class UsersAPITestCase(unittest.TestCase):
         self.assertEqual(403, response.status_code)
 
 
+class UsernameTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def run_deferred_tasks(self):
+        while True:
+            tasks = self.taskqueue_stub.get_filtered_tasks()
+            if not tasks:
+                break
+            self.taskqueue_stub.FlushQueue('default')
+            for task in tasks:
+                deferred.run(task.payload)
+
+    def put_user(self, user_id, fname, lname):
+        put_data = {
+            u'fname': fname,
+            u'lname': lname,
+            u'active': u"true",
+            u'classification': u"junior",
+            u'grad_year': 2016,
+            u'grad_semester': u"spring",
+        }
+        return self.app.put("/api/users/" + user_id, data=put_data)
+
+    def test_get_from_username(self):
+        self.assertEqual(Key('UserData', '100'), UniqueUsername.get_by_id("BillGates").user)
+        self.assertEqual(Key('UserData', '100'), UserData.get_from_username("BillGates").key)
+
+    def test_migration_claims_unindexed_username(self):
+        # A user stored before the username property existed, so it isn't
+        # indexed and has no UniqueUsername
+        entity = datastore.Entity('UserData', name='300')
+        entity.update({'user_id': '300', 'first_name': u"James", 'last_name': u"Kirk"})
+        datastore.Put(entity)
+        self.assertIsNone(UserData.get_from_username("JamesKirk"))
+        self.assertEqual({}, UserData.get_multi_from_usernames(["JamesKirk"]))
+
+        run_update_schema()
+        self.run_deferred_tasks()
+
+        self.assertEqual(Key('UserData', '300'), UserData.get_from_username("JamesKirk").key)
+        found = UserData.get_multi_from_usernames(["JamesKirk", "BillGates"])
+        self.assertEqual({"JamesKirk": Key('UserData', '300'), "BillGates": Key('UserData', '100')},
+                         {name: user.key for name, user in found.items()})
+
+    def test_get_from_nonexistent_username(self):
+        self.assertIsNone(UserData.get_from_username("JamesKirk"))
+
+    def test_get_multi_from_usernames(self):
+        found = UserData.get_multi_from_usernames(["BillGates", "JakeSisko", "JamesKirk"])
+        self.assertEqual({"BillGates": Key('UserData', '100'), "JakeSisko": Key('UserData', '101')},
+                         {name: u.key for name, u in found.items()})
+
+    def test_claim_usernames_in_same_batch(self):
+        users = [UserData(id=uid, user_id=uid, first_name="James", last_name="Kirk")
+                 for uid in ['300', '301']]
+        ndb.put_multi(users)
+
+        markers = claim_usernames(users)
+        self.assertEqual([Key('UserData', '300')], [m.user for m in markers])
+
+    def test_post_user_claims_username(self):
+        self.loginUser(user_id="300")
+        post_data = {
+            u'fname': u"James",
+            u'lname': u"Kirk",
+            u'classification': u"senior",
+            u'grad_year': 2016,
+            u'grad_semester': u"spring",
+        }
+        response = self.app.post("/api/users", data=post_data)
+        self.assertEqual(201, response.status_code)
+
+        marker = UniqueUsername.get_by_id("JamesKirk")
+        self.assertEqual(Key('UserData', '300'), marker.user)
+        self.assertEqual(u"JamesKirk", UserData.get_from_username("JamesKirk").username)
+
+    def test_put_user_moves_username(self):
+        self.loginUser(user_id="100")
+        response = self.put_user("100", u"Jean", u"Picard")
+        self.assertEqual(204, response.status_code)
+
+        self.assertEqual(Key('UserData', '100'), UniqueUsername.get_by_id("JeanPicard").user)
+        self.assertEqual(Key('UserData', '100'), UserData.get_from_username("JeanPicard").key)
+        self.assertIsNone(UserData.get_from_username("BillGates"))
+
+        response = self.put_user("100", u"Bill", u"Gates")
+        self.assertEqual(204, response.status_code)
+        self.assertIsNone(UniqueUsername.get_by_id("JeanPicard"))
+
+    def test_put_user_duplicate_username(self):
+        self.loginUser(user_id="100")
+        response = self.put_user("100", u"Jake", u"Sisko")
+        self.assertEqual(409, response.status_code)
+
+        user = Key('UserData', '100').get(use_cache=False, use_memcache=False)
+        self.assertEqual(u"Bill", user.first_name)
+        self.assertEqual(Key('UserData', '101'), UniqueUsername.get_by_id("JakeSisko").user)
+
+
 class PointExceptionsAPITestCase(unittest.TestCase):
 
     def setUp(self):
@@ -938,6 +1121,74 @@ class PermissionsAPITestCase(unittest.TestCase):
         }
         self.assertEqual(expected, response_data)
 
+    def put_operations(self, operations):
+        return self.app.put("/api/permissions/batch",
+                            data=json.dumps({'operations': operations}),
+                            content_type='application/json')
+
+    def test_batch_permissions_as_officer(self):
+        self.loginUser(user_id="200")
+        response = self.put_operations([
+            {'user_id': "100", 'permission': "officer", 'action': "grant"},
+            {'user_id': "101", 'permission': "officer", 'action': "grant"},
+            {'user_id': "101", 'permission': "officer", 'action': "revoke"},
+            {'user_id': "100", 'permission': "user", 'action': "grant"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(1, json.loads(response.data)['updated'])
+
+        self.assertEqual(["user", "officer"], UserData.get_user_from_id("100").user_permissions)
+        self.assertEqual(["user"], UserData.get_user_from_id("101").user_permissions)
+
+    def test_batch_permissions_single_batch_write(self):
+        self.loginUser(user_id="200")
+        calls = []
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'count_datastore_calls',
+            lambda service, call, request, response: calls.append(call),
+            'datastore_v3')
+        try:
+            self.put_operations([
+                {'user_id': "100", 'permission': "officer", 'action': "grant"},
+                {'user_id': "101", 'permission': "officer", 'action': "grant"},
+            ])
+        finally:
+            apiproxy_stub_map.apiproxy.GetPreCallHooks().Clear()
+
+        self.assertEqual(1, calls.count('Put'))
+
+    def test_batch_permissions_unknown_user(self):
+        self.loginUser(user_id="200")
+        response = self.put_operations([
+            {'user_id': "100", 'permission': "officer", 'action': "grant"},
+            {'user_id': "999", 'permission': "officer", 'action': "grant"},
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(["user"], UserData.get_user_from_id("100").user_permissions)
+
+    def test_batch_permissions_revoke_self(self):
+        self.loginUser(user_id="200")
+        response = self.put_operations([
+            {'user_id': "100", 'permission': "officer", 'action': "grant"},
+            {'user_id': "200", 'permission': "officer", 'action': "revoke"},
+        ])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(["user"], UserData.get_user_from_id("100").user_permissions)
+
+    def test_batch_permissions_invalid_operations(self):
+        self.loginUser(user_id="200")
+        for operations in [["officer"], [{'user_id': "100", 'permission': "officer"}]]:
+            response = self.put_operations(operations)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(["user"], UserData.get_user_from_id("100").user_permissions)
+
+    def test_batch_permissions_as_user(self):
+        self.loginUser(user_id="100")
+        response = self.put_operations([
+            {'user_id': "100", 'permission': "officer", 'action': "grant"},
+        ])
+        self.assertEqual(response.status_code, 403)
+
 
 class PointCategoriesAPITestCase(unittest.TestCase):
 
@@ -950,6 +1201,7 @@ class PointCategoriesAPITestCase(unittest.TestCase):
         self.testbed.init_user_stub()
         self.testbed.init_memcache_stub()
         self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub()
         #ndb.get_context().clear_cache()
         setup_datastore()
         #pylint: disable=maybe-no-member
@@ -1110,9 +1362,31 @@ class PointCategoriesAPITestCase(unittest.TestCase):
         }
         self.assertEqual(expected, data)
 
+    def test_get_point_category_with_spaces(self):
+        response = self.app.get("/api/point-categories/Bloob%20Time")
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        expected = {
+            u'name': u"Bloob Time",
+            u'sub_categories': [],
+        }
+        self.assertEqual(expected, data)
+
+    def test_post_duplicate_point_category_with_diff_spaces(self):
+        self.loginUser(user_id="200")
+        post_data = {
+            u'name': u"BloobTime",
+            u'parent': None,
+        }
+        response = self.app.post("/api/point-categories", data=post_data)
+        self.assertEqual(response.status_code, 409)
+
+        response = self.app.get("/api/point-categories")
+        response_data = json.loads(response.data)
+        self.assertNotIn("BloobTime", response_data)
+
     # TODO (phillip):
-    #def test_get_point_category_with_spaces(self):
-    #def test_post_duplicate_point_category_with_diff_spaces(self):
     #def test_delete_point_category_as_officer(self):
     #def test_delete_point_category_as_user(self):
     #def test_delete_point_category_with_spaces(self):
@@ -1150,6 +1424,7 @@ class EventAPITestCase(unittest.TestCase):
 
         data = json.loads(response.data)
         expected = {
+            u'next_cursor': None,
             u'events': [
                 {
                     u'date': u"03/04/2016",
@@ -1187,6 +1462,7 @@ class EventAPITestCase(unittest.TestCase):
 
         data = json.loads(response.data)
         expected = {
+            u'next_cursor': None,
             u'events': [
                 {
                     u'date': u'05/03/2016',
@@ -1214,6 +1490,7 @@ class EventAPITestCase(unittest.TestCase):
 
         data = json.loads(response.data)
         expected = {
+            u'next_cursor': None,
             u'events': [
                 {
                     u'date': u"09/01/2016",
@@ -1296,6 +1573,30 @@ class EventAPITestCase(unittest.TestCase):
         response = self.app.post("/api/events", data=post_data)
         self.assertEqual(response.status_code, 409)
 
+    def test_post_event_duplicate_name_with_diff_spaces(self):
+        self.loginUser(user_id="200")
+        post_data = {
+            u'name': u"Sisterhood  Event",
+            u'date': u"2016-03-01",
+            u'point-category': "Bloob Time",
+        }
+        response = self.app.post("/api/events", data=post_data)
+        self.assertEqual(response.status_code, 409)
+
+    def test_put_event_duplicate_name(self):
+        self.loginUser(user_id="200")
+        put_data = {
+            u'name': u"SisterhoodEvent",
+            u'date': u"2016-09-01",
+            u'point-category': "Bloob Time",
+        }
+        response = self.app.put("/api/events/BloobTimeEvent", data=put_data)
+        self.assertEqual(response.status_code, 409)
+
+    def test_event_slug_is_stored(self):
+        event = Event.query(Event.slug == "BloobTimeEvent", ancestor=Event.root_key()).get()
+        self.assertEqual(u"Bloob Time Event", event.name)
+
     def test_post_event_bad_date(self):
         routes.app.config['TESTING'] = False
         self.loginUser(user_id="200")
@@ -1320,6 +1621,7 @@ class EventAPITestCase(unittest.TestCase):
         response = self.app.get("/api/events")
         response_data = json.loads(response.data)
         expected = {
+            u'next_cursor': None,
             u'events': [
                 {
                     u'date': u"03/04/2016",
@@ -1351,104 +1653,1203 @@ class EventAPITestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
 
 
-class PointRecordAPITestCase(unittest.TestCase):
+class CategoryTreeTestCase(unittest.TestCase):
 
     def setUp(self):
-        # Used to debug 500 errors
-        routes.app.config['TESTING'] = True
         self.app = routes.app.test_client()
-        #pylint: disable=maybe-no-member
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
 
-    def test_put_nonexistent_point_record(self):
-        loginUser(user_id="200")
-        put_data = {
-            u'username': u"BillGates",
-            u'event_name': u"Bloob Time Event",
-            u'points-earned': 2,
-        }
-        response = self.app.put("/api/point-records", data=put_data)
-        self.assertEqual(204, response.status_code)
+    def tearDown(self):
+        self.testbed.deactivate()
 
-        response = self.app.get("/api/point-records")
-        response_data = json.loads(response.data)
-        expected = {
-            u'event_name': "Bloob Time Event",
-            u'point-category': u'Bloob Time',
-            u'username': 'BillGates',
-            u'points-earned': 2.0,
-        }
-        self.assertIn(expected, response_data['records'])
+    def test_tree_links(self):
+        tree = CategoryTree.get()
+        sisterhood = tree.by_name["Sisterhood"]
+        bloob_time = tree.by_name["Bloob Time"]
+
+        self.assertEqual(sisterhood.key, tree.parent(bloob_time).key)
+        self.assertIsNone(tree.parent(sisterhood))
+        self.assertEqual([u"Bloob Time", u"Mixers"],
+                         [c.name for c in tree.children(sisterhood)])
+        self.assertEqual(set([u"Sisterhood", u"Philanthropy"]),
+                         set(c.name for c in tree.top_level))
+
+        # Sisterhood's own requirement is more than its sub-categories' (18)
+        self.assertEqual(20, tree.requirement(sisterhood))
+        self.assertEqual(10, tree.requirement(bloob_time))
+        self.assertEqual(0, tree.requirement(bloob_time, baby=True))
+
+    def test_tree_is_cached(self):
+        tree = CategoryTree.get()
+        self.assertIs(tree, CategoryTree.get())
+
+        bloob_time = PointCategory.get_from_name("Bloob Time")
+        with mock.patch.object(PointCategory, 'query') as query:
+            self.assertEqual(u"Sisterhood", bloob_time.parent.name)
+        self.assertFalse(query.called)
+
+    def test_tree_rebuilt_after_write(self):
+        tree = CategoryTree.get()
+
+        mixers = PointCategory.get_from_name("Mixers")
+        mixers.member_requirement = 15
+        mixers.put()
+
+        new_tree = CategoryTree.get()
+        self.assertIsNot(tree, new_tree)
+        self.assertEqual(25, new_tree.requirement(new_tree.by_name["Sisterhood"]))
+
+        mixers.key.delete()
+        self.assertNotIn(u"Mixers", CategoryTree.get().by_name)
+
+    def count_datastore_calls(self, url):
+        calls = []
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'count_datastore_calls',
+            lambda service, call, request, response: calls.append(call),
+            'datastore_v3')
+        response = self.app.get(url)
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Clear()
+        self.assertEqual(200, response.status_code)
+        return len(calls)
 
-    def test_put_existing_point_record(self):
-        loginUser(user_id="200")
-        put_data = {
-            u'username': u"BillGates",
-            u'event_name': u"Bloob Time Event",
-            u'points-earned': 2.0,
-        }
-        response = self.app.put("/api/point-records", data=put_data)
-        self.assertEqual(204, response.status_code)
+    def test_event_list_rpcs_do_not_grow_with_events(self):
+        # Build the category tree ahead of time
+        CategoryTree.get()
+        few_events = self.count_datastore_calls("/api/events")
+        few_category_events = self.count_datastore_calls("/api/events?category=Sisterhood")
 
-        put_data = {
-            u'username': u"BillGates",
-            u'event_name': u"Bloob Time Event",
-            u'points-earned': 4.0,
-        }
-        response = self.app.put("/api/point-records", data=put_data)
-        self.assertEqual(204, response.status_code)
+        mixers = PointCategory.get_from_name("Mixers")
+        for i in range(10):
+            e = Event(parent=Event.root_key())
+            e.name = "Extra Event " + str(i)
+            e.date = datetime.datetime(2016, 10, 1 + i)
+            e.point_category = mixers.key
+            e.put()
+        payload_cache.bump(payload_cache.EVENTS)
 
-        response = self.app.get("/api/point-records")
-        response_data = json.loads(response.data)
-        expected = {
-            u'event_name': "Bloob Time Event",
-            u'point-category': u'Bloob Time',
-            u'username': 'BillGates',
-            u'points-earned': 4.0,
-        }
-        self.assertIn(expected, response_data['records'])
+        self.assertEqual(few_events, self.count_datastore_calls("/api/events"))
+        self.assertEqual(few_category_events, self.count_datastore_calls(
+            "/api/events?category=Sisterhood"))
 
 
-class UserPointsAPITestCase(unittest.TestCase):
+class EventAttendanceAPITestCase(unittest.TestCase):
 
     def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
         self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
 
-    def test_get_points_with_exception(self):
-        loginUser(user_id="100")
-        response = self.app.get('/api/users/100/points')
-        self.assertEqual(response.status_code, 200)
+    def tearDown(self):
+        self.testbed.deactivate()
 
-        data = json.loads(response.data)
-        expected = {
-            u'required': 5,
-            u'received': 2,
-            u'level': 2
-        }
-        self.assertEqual(expected, data['Sisterhood']['sub_categories']['Mixers'])
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
 
-    def test_get_points_with_parent_category(self):
-        loginUser(user_id="101")
-        response = self.app.get('/api/users/101/points')
-        self.assertEqual(response.status_code, 200)
+    def import_csv(self, data):
+        return self.app.post("/api/events/BloobTimeEvent/attendance",
+                             data=data, content_type='text/csv')
 
-        data = json.loads(response.data)
-        expected_sisterhood = {
-            u'required': 20,
-            u'received': 4,
-            u'level': 1,
-            u'sub_categories': {
-                "Mixers": {
-                    "received": 0,
-                    "required": 8,
-                    "level": 2
-                },
-                u'Bloob Time': {
-                    u'required': 10,
-                    u'received': 3,
-                    u'level': 2,
-                }
-            }
-        }
+    def test_import_attendance_report(self):
+        self.loginUser(user_id="200")
+        response = self.import_csv(
+            "name,points\n"
+            "Bill Gates,4\n"
+            "JakeSisko,3\n"
+            "Nobody Here,2\n"
+            "Bob Joe,abc\n"
+            "BillGates,5\n")
+        self.assertEqual(200, response.status_code)
+
+        statuses = [(r['row'], r['status']) for r in json.loads(response.data)['rows']]
+        self.assertEqual([(2, "replaced"), (3, "unchanged"), (4, "error"),
+                          (5, "error"), (6, "created")], statuses)
+
+        event = Event.get_from_name("Bloob Time Event")
+        record = PointRecord.key_for(Key(UserData, '100'), event.key).get()
+        self.assertEqual(5.0, record.points_earned)
+
+    def test_import_attendance_updates_points(self):
+        self.loginUser(user_id="200")
+        PointSummary.rebuild(Key(UserData, '100').get())
+        self.import_csv("Bill Gates,4\n")
+
+        summary = PointSummary.key_for(Key(UserData, '100')).get(use_cache=False)
+        self.assertEqual(4, summary.received['Bloob Time'])
+        data = json.loads(self.app.get('/api/users/100/points').data)
+        self.assertEqual(4, data['Sisterhood']['sub_categories']['Bloob Time']['received'])
+
+    def test_import_attendance_invalid_utf8(self):
+        self.loginUser(user_id="200")
+        response = self.import_csv("Bill Gates,4\nJake\xff Sisko,3\n")
+        self.assertEqual(200, response.status_code)
+
+        rows = json.loads(response.data)['rows']
+        self.assertEqual([(1, "created"), (2, "error")], [(r['row'], r['status']) for r in rows])
+        self.assertEqual("The row is not valid UTF-8", rows[1]['message'])
+
+    @mock.patch('controllers.event_controller.MAX_IMPORT_SIZE', 10)
+    def test_import_attendance_too_large(self):
+        self.loginUser(user_id="200")
+        response = self.import_csv("Bill Gates,4\nJakeSisko,3\n")
+        self.assertEqual(413, response.status_code)
+
+    def test_import_attendance_as_user(self):
+        self.loginUser(user_id="100")
+        response = self.import_csv("Bill Gates,4\n")
+        self.assertEqual(403, response.status_code)
+
+
+class PayloadCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def test_event_list_is_cached(self):
+        response = self.app.get("/api/events")
+
+        calls = []
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'count_datastore_calls',
+            lambda service, call, request, response: calls.append(call),
+            'datastore_v3')
+        cached = self.app.get("/api/events")
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Clear()
+
+        self.assertEqual([], calls)
+        self.assertEqual(json.loads(response.data), json.loads(cached.data))
+
+    def test_post_event_invalidates_event_list(self):
+        self.loginUser(user_id="200")
+        self.app.get("/api/events")
+        post_data = {
+            u'name': u"Spring Fling 2016",
+            u'date': u"2016-03-01",
+            u'point-category': "Bloob Time",
+        }
+        self.app.post("/api/events", data=post_data)
+
+        data = json.loads(self.app.get("/api/events").data)
+        self.assertIn(u"Spring Fling 2016", [e['name'] for e in data['events']])
+
+    def test_patch_category_invalidates_category_list(self):
+        self.loginUser(user_id="200")
+        self.app.get("/api/point-categories")
+        self.app.patch("/api/point-categories/Philanthropy",
+                       data={"member_requirement": 15})
+
+        data = json.loads(self.app.get("/api/point-categories").data)
+        self.assertEqual(15, data['Philanthropy']['member_requirement'])
+
+    def test_put_user_invalidates_user_list(self):
+        self.loginUser(user_id="200")
+        self.app.get("/api/users")
+        put_data = {
+            u'fname': u"William",
+            u'lname': u"Gates",
+            u'active': u"true",
+            u'classification': u"senior",
+            u'grad_semester': u"fall",
+            u'grad_year': 2015,
+        }
+        response = self.app.put("/api/users/100", data=put_data)
+        self.assertEqual(204, response.status_code)
+
+        data = json.loads(self.app.get("/api/users").data)
+        self.assertIn(u"William", [u['fname'] for u in data['users']])
+        self.assertNotIn(u"Bill", [u['fname'] for u in data['users']])
+
+
+class ETagTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def revalidate(self, url):
+        """ Gets a url and then gets it again with its ETag.
+
+        Returns the ETag and the status code of the second request.
+        """
+        response = self.app.get(url)
+        self.assertEqual(200, response.status_code)
+        etag = response.headers['ETag']
+        response = self.app.get(url, headers={'If-None-Match': etag})
+        return etag, response.status_code
+
+    def test_event_list_not_modified(self):
+        etag, status = self.revalidate("/api/events")
+        self.assertEqual(304, status)
+
+        self.loginUser(user_id="200")
+        post_data = {
+            u'name': u"Spring Fling 2016",
+            u'date': u"2016-03-01",
+            u'point-category': "Bloob Time",
+        }
+        self.app.post("/api/events", data=post_data)
+        response = self.app.get("/api/events", headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers['ETag'])
+
+    def test_not_modified_skips_building_list(self):
+        self.loginUser(user_id="200")
+        response = self.app.get("/api/users")
+        with mock.patch('controllers.user_controller.UserListAPI.build_users') as build:
+            response = self.app.get("/api/users",
+                                    headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(304, response.status_code)
+        self.assertFalse(build.called)
+
+    def test_user_points_not_modified(self):
+        self.loginUser(user_id="200")
+        PointSummary.rebuild(Key(UserData, '101').get())
+        etag, status = self.revalidate("/api/users/101/points")
+        self.assertEqual(304, status)
+
+        put_data = {
+            u'username': u"JakeSisko",
+            u'event_name': u"My First Event",
+            u'points-earned': 3,
+        }
+        self.app.put("/api/point-records", data=put_data)
+        response = self.app.get("/api/users/101/points", headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+
+    def test_other_resources_not_modified(self):
+        self.loginUser(user_id="200")
+        _, status = self.revalidate("/api/events/BloobTimeEvent")
+        self.assertEqual(304, status)
+        _, status = self.revalidate("/api/users/100")
+        self.assertEqual(304, status)
+
+
+class EventDeleteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def run_deferred_tasks(self):
+        while True:
+            tasks = self.taskqueue_stub.get_filtered_tasks()
+            if not tasks:
+                break
+            self.taskqueue_stub.FlushQueue('default')
+            for task in tasks:
+                deferred.run(task.payload)
+
+    def test_delete_event_deletes_records(self):
+        self.loginUser(user_id="200")
+        event = Event.get_from_name("BloobTimeEvent")
+        response = self.app.delete("/api/events/BloobTimeEvent")
+        self.assertEqual(200, response.status_code)
+
+        self.assertIsNone(event.key.get(use_cache=False))
+        self.assertEqual(0, PointRecord.query(PointRecord.event == event.key).count())
+        self.assertEqual(4, PointRecord.query().count())
+
+    @mock.patch('models.event_model.DELETE_BATCH_SIZE', 1)
+    def test_delete_event_in_batches(self):
+        self.loginUser(user_id="200")
+        event = Event.get_from_name("MixersEvent")
+        event.populate_records()
+
+        response = self.app.delete("/api/events/MixersEvent")
+        self.assertEqual(200, response.status_code)
+
+        # The event is hidden while its records are deleted
+        self.assertTrue(event.key.get(use_cache=False).deleted)
+        response = self.app.get("/api/events/MixersEvent")
+        self.assertEqual(404, response.status_code)
+        response = self.app.get("/api/events")
+        names = [e['name'] for e in json.loads(response.data)['events']]
+        self.assertNotIn(u"Mixers Event", names)
+
+        self.run_deferred_tasks()
+
+        self.assertIsNone(event.key.get(use_cache=False))
+        self.assertIsNone(RecordPopulation.key_for(event.key).get(use_cache=False))
+        self.assertEqual(0, PointRecord.query(PointRecord.event == event.key).count())
+
+
+class RecordPopulationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def run_deferred_tasks(self):
+        while True:
+            tasks = self.taskqueue_stub.get_filtered_tasks()
+            if not tasks:
+                break
+            self.taskqueue_stub.FlushQueue('default')
+            for task in tasks:
+                deferred.run(task.payload)
+
+    def post_event(self):
+        post_data = {
+            u'name': u"Spring Fling 2016",
+            u'date': u"2016-03-01",
+            u'point-category': "Bloob Time",
+        }
+        response = self.app.post("/api/events", data=post_data)
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def test_post_event_creates_records(self):
+        self.loginUser(user_id="200")
+        response = self.post_event()
+        data = json.loads(response.data)
+        self.assertEqual({u'processed': 3, u'created': 3, u'complete': True},
+                         data['population'])
+
+        event = Event.get_from_name("SpringFling2016")
+        for user_id in ['100', '101', '200']:
+            record = PointRecord.key_for(Key('UserData', user_id), event.key).get()
+            self.assertEqual(event.key, record.event)
+
+        response = self.app.get("/api/events/SpringFling2016/population")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['complete'])
+
+    def test_populate_records_is_idempotent(self):
+        event = Event.get_from_name("MixersEvent")
+        population = event.populate_records()
+        # Bill Gates already has a record for this event
+        self.assertEqual(2, population.created)
+
+        population = event.populate_records()
+        self.assertEqual(0, population.created)
+        self.assertEqual(3, PointRecord.query(PointRecord.event == event.key).count())
+
+    def test_populate_user_records(self):
+        user = UserData.get_user_from_id('101')
+        population = user.populate_records()
+        # Jake Sisko already has records for two of the five events
+        self.assertEqual(5, population.processed)
+        self.assertEqual(3, population.created)
+        self.assertEqual(5, PointRecord.query(ancestor=user.key).count())
+
+    @mock.patch('models.population_model.BATCH_SIZE', 1)
+    def test_populate_records_in_batches(self):
+        self.loginUser(user_id="200")
+        response = self.post_event()
+        data = json.loads(response.data)
+        self.assertEqual(1, data['population']['processed'])
+        self.assertFalse(data['population']['complete'])
+
+        self.run_deferred_tasks()
+
+        event = Event.get_from_name("SpringFling2016")
+        population = RecordPopulation.key_for(event.key).get()
+        self.assertTrue(population.complete)
+        self.assertEqual(3, population.processed)
+        self.assertEqual(3, population.created)
+
+
+class PointRecordKeyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def run_deferred_tasks(self):
+        while True:
+            tasks = self.taskqueue_stub.get_filtered_tasks()
+            if not tasks:
+                break
+            self.taskqueue_stub.FlushQueue('default')
+            for task in tasks:
+                deferred.run(task.payload)
+
+    def test_put_point_record_uses_record_key(self):
+        self.loginUser(user_id="200")
+        put_data = {
+            u'username': u"BillGates",
+            u'event_name': u"Bloob Time Event",
+            u'points-earned': 2,
+        }
+        response = self.app.put("/api/point-records", data=put_data)
+        self.assertEqual(204, response.status_code)
+
+        event = Event.get_from_name("Bloob Time Event")
+        record = PointRecord.key_for(Key(UserData, '100'), event.key).get()
+        self.assertEqual(2.0, record.points_earned)
+        self.assertEqual(1, PointRecord.query(ancestor=Key(UserData, '100'))
+                            .filter(PointRecord.event == event.key).count())
+
+    def test_get_user_point_records(self):
+        response = self.app.get("/api/point-records?username=JakeSisko")
+        response_data = json.loads(response.data)
+        self.assertEqual(
+            set([u'Sisterhood Event', u'Bloob Time Event']),
+            set(r['event_name'] for r in response_data['records']))
+
+        response = self.app.get(
+            "/api/point-records?username=JakeSisko&event_name=Sisterhood%20Event")
+        response_data = json.loads(response.data)
+        expected = [{
+            u'event_name': u"Sisterhood Event",
+            u'point-category': u'Sisterhood',
+            u'username': u'JakeSisko',
+            u'points-earned': 1.0,
+        }]
+        self.assertEqual(expected, response_data['records'])
+
+    def test_get_point_records_batches_lookups(self):
+        # Build the category tree ahead of time
+        CategoryTree.get()
+
+        with mock.patch.object(Event, 'get_from_name') as get_from_name:
+            with mock.patch('google.appengine.ext.ndb.get_multi',
+                            wraps=ndb.get_multi) as get_multi:
+                response = self.app.get("/api/point-records")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(5, len(json.loads(response.data)['records']))
+        self.assertFalse(get_from_name.called)
+        self.assertEqual(1, get_multi.call_count)
+
+    def test_rename_event_keeps_records(self):
+        self.loginUser(user_id="200")
+        put_data = {
+            u'name': u"Sisterhood Social",
+            u'date': u"2016-08-02",
+            u'point-category': u"Sisterhood",
+        }
+        response = self.app.put("/api/events/SisterhoodEvent", data=put_data)
+        self.assertEqual(201, response.status_code)
+
+        response = self.app.get("/api/point-records?username=JakeSisko")
+        response_data = json.loads(response.data)
+        self.assertEqual(
+            set([u'Sisterhood Social', u'Bloob Time Event']),
+            set(r['event_name'] for r in response_data['records']))
+
+    def test_rename_user_keeps_records(self):
+        self.loginUser(user_id="101")
+        put_data = {
+            u'fname': u"Benjamin",
+            u'lname': u"Sisko",
+            u'active': u"true",
+            u'classification': u"junior",
+            u'grad_year': 2016,
+            u'grad_semester': u"spring",
+        }
+        response = self.app.put("/api/users/101", data=put_data)
+        self.assertEqual(204, response.status_code)
+
+        response = self.app.get("/api/point-records?username=BenjaminSisko")
+        response_data = json.loads(response.data)
+        self.assertEqual(2, len(response_data['records']))
+        for record in response_data['records']:
+            self.assertEqual(u'BenjaminSisko', record['username'])
+
+    def test_rekey_point_records(self):
+        legacy = PointRecord()
+        legacy.username = "BobJoe"
+        legacy.event_name = "Bloob Time Event"
+        legacy.points_earned = 4
+        legacy_key = legacy.put()
+
+        run_rekey_point_records()
+        self.run_deferred_tasks()
+
+        event = Event.get_from_name("Bloob Time Event")
+        record_key = PointRecord.key_for(Key(UserData, '200'), event.key)
+        record = record_key.get(use_cache=False)
+        self.assertEqual(4.0, record.points_earned)
+        self.assertEqual(Key(UserData, '200'), record.user_data)
+        self.assertEqual(event.key, record.event)
+        self.assertIsNone(legacy_key.get(use_cache=False))
+        self.assertEqual(6, PointRecord.query().count())
+
+        summary = PointSummary.key_for(Key(UserData, '200')).get(use_cache=False)
+        self.assertEqual(4, summary.received['Bloob Time'])
+
+
+class IntegritySweepTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        setup_datastore()
+
+        event = Event.get_from_name("Bloob Time Event")
+        self.missing_event = PointRecord.for_user_and_event(
+            Key(UserData, '101'), Key(Event, 'gone', parent=Event.root_key()))
+        self.missing_event.points_earned = 7
+        self.missing_event.put()
+        self.missing_user = PointRecord.for_user_and_event(Key(UserData, '999'), event.key)
+        self.missing_user.points_earned = 7
+        self.missing_user.put()
+        PointSummary(key=PointSummary.key_for(Key(UserData, '999'))).put()
+        self.no_points = PointRecord.for_user_and_event(Key(UserData, '100'), event.key)
+        self.no_points.points_earned = None
+        self.no_points.put()
+
+        sisterhood = PointCategory.get_from_name("Sisterhood")
+        sisterhood.sub_categories.append(Key(PointCategory, 12345, parent=PointCategory.root_key()))
+        sisterhood.put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def run_deferred_tasks(self):
+        while True:
+            tasks = self.taskqueue_stub.get_filtered_tasks()
+            if not tasks:
+                break
+            self.taskqueue_stub.FlushQueue('default')
+            for task in tasks:
+                deferred.run(task.payload)
+
+    def count_writes(self, f):
+        calls = []
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'count_datastore_calls',
+            lambda service, call, request, response: calls.append(call),
+            'datastore_v3')
+        try:
+            f()
+        finally:
+            apiproxy_stub_map.apiproxy.GetPreCallHooks().Clear()
+        return calls.count('Put') + calls.count('Delete')
+
+    def test_get_point_records_is_read_only(self):
+        self.loginUser(user_id="200")
+        responses = []
+        writes = self.count_writes(
+            lambda: responses.append(self.app.get('/api/point-records')))
+        self.assertEqual(0, writes)
+
+        records = json.loads(responses[0].data)['records']
+        self.assertEqual(6, len(records))
+        self.assertIsNotNone(self.missing_event.key.get(use_cache=False))
+        self.assertIsNotNone(self.missing_user.key.get(use_cache=False))
+
+    def test_get_points_skips_bad_records(self):
+        self.loginUser(user_id="101")
+        response = self.app.get('/api/users/101/points')
+        data = json.loads(response.data)
+        self.assertEqual(3, data['Sisterhood']['sub_categories']['Bloob Time']['received'])
+        self.assertIsNotNone(self.missing_event.key.get(use_cache=False))
+
+        self.loginUser(user_id="100")
+        self.app.get('/api/users/100/points')
+        self.assertIsNone(self.no_points.key.get(use_cache=False).points_earned)
+
+    def test_get_point_categories_is_read_only(self):
+        self.loginUser(user_id="200")
+        responses = []
+        writes = self.count_writes(
+            lambda: responses.append(self.app.get('/api/point-categories')))
+        self.assertEqual(0, writes)
+
+        data = json.loads(responses[0].data)
+        self.assertEqual(2, len(data['Sisterhood']['sub_categories']))
+        sisterhood = PointCategory.get_from_name("Sisterhood")
+        self.assertEqual(3, len(sisterhood.sub_categories))
+
+    def test_integrity_sweep(self):
+        run_integrity_sweep()
+        self.run_deferred_tasks()
+
+        self.assertIsNone(self.missing_event.key.get(use_cache=False))
+        self.assertIsNone(self.missing_user.key.get(use_cache=False))
+        self.assertIsNone(PointSummary.key_for(Key(UserData, '999')).get(use_cache=False))
+        self.assertIsNone(self.no_points.key.get(use_cache=False).points_earned)
+        self.assertEqual(6, PointRecord.query().count())
+
+        sisterhood = PointCategory.get_from_name("Sisterhood")
+        self.assertEqual(2, len(sisterhood.sub_categories))
+
+    def test_delete_category_used_by_event(self):
+        self.loginUser(user_id="200")
+        response = self.app.delete('/api/point-categories/BloobTime')
+        self.assertEqual(409, response.status_code)
+        self.assertIsNotNone(PointCategory.get_from_name("Bloob Time"))
+
+    def test_event_with_deleted_category(self):
+        self.loginUser(user_id="200")
+        # Categories deleted before events blocked the delete
+        PointCategory.get_from_name("Bloob Time").key.delete()
+
+        response = self.app.get('/api/users/101/points')
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.data)
+        self.assertEqual(1, data['Sisterhood']['received'])
+
+        for url in ['/api/users/101/dashboard', '/api/events',
+                    '/api/point-records?event_name=BloobTimeEvent']:
+            response = self.app.get(url)
+            self.assertEqual(200, response.status_code)
+
+        response = self.app.get('/api/events/BloobTimeEvent')
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(json.loads(response.data)['point-category'])
+
+        response = self.app.put("/api/point-records/batch", data=json.dumps({'updates': [
+            {'username': "JakeSisko", 'event_name': "Bloob Time Event", 'points-earned': 6},
+        ]}), content_type='application/json')
+        self.assertEqual(409, response.status_code)
+
+        uncategorized = [e.name for e in find_uncategorized_events()]
+        self.assertEqual(["Bloob Time Event"], uncategorized)
+
+    def test_integrity_sweep_builds_missing_summaries(self):
+        self.loginUser(user_id="200")
+        data = json.loads(self.app.get('/api/users/101/points').data)
+        self.assertIsNone(PointSummary.key_for(Key(UserData, '101')).get(use_cache=False))
+
+        run_integrity_sweep()
+        self.run_deferred_tasks()
+
+        summary = PointSummary.key_for(Key(UserData, '101')).get(use_cache=False)
+        self.assertEqual(data, summary.categories)
+        self.assertIsNone(PointSummary.key_for(Key(UserData, '999')).get(use_cache=False))
+
+    @mock.patch('utils.integrity_sweep.BATCH_SIZE', 2)
+    def test_integrity_sweep_in_batches(self):
+        run_integrity_sweep()
+        self.run_deferred_tasks()
+
+        self.assertIsNone(self.missing_event.key.get(use_cache=False))
+        self.assertIsNone(self.missing_user.key.get(use_cache=False))
+        self.assertEqual(6, PointRecord.query().count())
+
+
+class PaginationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def get_pages(self, url, key):
+        """ Gets every page from a list endpoint and returns the page sizes
+        and all of the items.
+        """
+        sizes = []
+        items = []
+        cursor = None
+        while True:
+            page_url = url
+            if cursor is not None:
+                page_url += "&cursor=" + urllib.quote(cursor)
+            response = self.app.get(page_url)
+            self.assertEqual(200, response.status_code)
+            data = json.loads(response.data)
+            sizes.append(len(data[key]))
+            items.extend(data[key])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return sizes, items
+
+    def test_get_user_list_pages(self):
+        self.loginUser(user_id="200")
+        sizes, users = self.get_pages("/api/users?limit=2", "users")
+        self.assertEqual([2, 1], sizes)
+        self.assertEqual([u"Bill", u"Bob", u"Jake"], [u['fname'] for u in users])
+
+    def test_get_category_event_pages(self):
+        sizes, events = self.get_pages("/api/events?category=Sisterhood&limit=2", "events")
+        self.assertEqual([2, 1], sizes)
+        self.assertEqual([u"Mixers Event", u"Sisterhood Event", u"Bloob Time Event"],
+                         [e['name'] for e in events])
+
+    def test_get_point_record_pages(self):
+        sizes, records = self.get_pages("/api/point-records?limit=2", "records")
+        self.assertEqual(5, len(records))
+        self.assertTrue(all(size <= 2 for size in sizes))
+
+    def test_get_user_list_views(self):
+        self.loginUser(user_id="200")
+        _, users = self.get_pages("/api/users?filter=active&view=members&limit=2", "users")
+        _, all_users = self.get_pages("/api/users?filter=active&limit=2", "users")
+        for user in all_users:
+            del user['permissions']
+        self.assertEqual(all_users, users)
+        self.assertTrue(all(u['active'] for u in users))
+
+        _, users = self.get_pages("/api/users?view=permissions", "users")
+        self.assertEqual(["fname", "lname", "permissions", "user_id"], sorted(users[0]))
+        self.assertIn([u"officer"], [u['permissions'] for u in users])
+
+        with self.assertRaises(Exception):
+            self.app.get("/api/users?view=everything")
+
+    def test_get_event_point_record_pages(self):
+        _, records = self.get_pages(
+            "/api/point-records?event_name=Bloob%20Time%20Event&limit=1", "records")
+        self.assertTrue(records)
+        self.assertTrue(all(r['event_name'] == u"Bloob Time Event" for r in records))
+        self.assertTrue(all(r['point-category'] == u"Bloob Time" for r in records))
+
+    def test_limit_is_capped(self):
+        self.loginUser(user_id="200")
+        response = self.app.get("/api/users?limit=0")
+        data = json.loads(response.data)
+        self.assertEqual(1, len(data['users']))
+        self.assertIsNotNone(data['next_cursor'])
+
+
+class PointRecordAPITestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        #pylint: disable=maybe-no-member
+
+    def test_put_nonexistent_point_record(self):
+        loginUser(user_id="200")
+        put_data = {
+            u'username': u"BillGates",
+            u'event_name': u"Bloob Time Event",
+            u'points-earned': 2,
+        }
+        response = self.app.put("/api/point-records", data=put_data)
+        self.assertEqual(204, response.status_code)
+
+        response = self.app.get("/api/point-records")
+        response_data = json.loads(response.data)
+        expected = {
+            u'event_name': "Bloob Time Event",
+            u'point-category': u'Bloob Time',
+            u'username': 'BillGates',
+            u'points-earned': 2.0,
+        }
+        self.assertIn(expected, response_data['records'])
+
+    def test_put_existing_point_record(self):
+        loginUser(user_id="200")
+        put_data = {
+            u'username': u"BillGates",
+            u'event_name': u"Bloob Time Event",
+            u'points-earned': 2.0,
+        }
+        response = self.app.put("/api/point-records", data=put_data)
+        self.assertEqual(204, response.status_code)
+
+        put_data = {
+            u'username': u"BillGates",
+            u'event_name': u"Bloob Time Event",
+            u'points-earned': 4.0,
+        }
+        response = self.app.put("/api/point-records", data=put_data)
+        self.assertEqual(204, response.status_code)
+
+        response = self.app.get("/api/point-records")
+        response_data = json.loads(response.data)
+        expected = {
+            u'event_name': "Bloob Time Event",
+            u'point-category': u'Bloob Time',
+            u'username': 'BillGates',
+            u'points-earned': 4.0,
+        }
+        self.assertIn(expected, response_data['records'])
+
+
+class PointRecordBatchAPITestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def put_updates(self, updates):
+        return self.app.put("/api/point-records/batch",
+                            data=json.dumps({'updates': updates}),
+                            content_type='application/json')
+
+    def test_batch_coalesces_updates(self):
+        self.loginUser(user_id="200")
+        PointSummary.rebuild(Key(UserData, '101').get())
+
+        response = self.put_updates([
+            {'username': "BillGates", 'event_name': "Bloob Time Event", 'points-earned': 2},
+            {'username': "JakeSisko", 'event_name': "Bloob Time Event", 'points-earned': 6},
+            {'username': "BillGates", 'event_name': "Bloob Time Event", 'points-earned': 5},
+        ])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, json.loads(response.data)['updated'])
+
+        bill = PointRecord.key_for(Key(UserData, '100'), Event.get_from_name("Bloob Time Event").key).get()
+        self.assertEqual(5.0, bill.points_earned)
+
+        data = json.loads(self.app.get('/api/users/101/points').data)
+        self.assertEqual(6, data['Sisterhood']['sub_categories']['Bloob Time']['received'])
+        summary = PointSummary.key_for(Key(UserData, '101')).get()
+        self.assertEqual(PointSummary.rebuild(summary.key.parent().get()).categories,
+                         summary.categories)
+
+    def test_batch_skips_unchanged_records(self):
+        self.loginUser(user_id="200")
+        response = self.put_updates([
+            {'username': "JakeSisko", 'event_name': "Bloob Time Event", 'points-earned': 3},
+        ])
+        self.assertEqual(0, json.loads(response.data)['updated'])
+
+    def test_batch_with_unknown_user_writes_nothing(self):
+        self.loginUser(user_id="200")
+        response = self.put_updates([
+            {'username': "BillGates", 'event_name': "Bloob Time Event", 'points-earned': 2},
+            {'username': "NotAUser", 'event_name': "Bloob Time Event", 'points-earned': 2},
+            {'username': "BillGates", 'event_name': "Not An Event", 'points-earned': 2},
+        ])
+        self.assertEqual(404, response.status_code)
+        data = json.loads(response.data)
+        self.assertEqual([u"NotAUser"], data['usernames'])
+        self.assertEqual([u"Not An Event"], data['event_names'])
+
+        bill = PointRecord.key_for(Key(UserData, '100'), Event.get_from_name("Bloob Time Event").key).get()
+        self.assertIsNone(bill)
+
+    def test_batch_with_malformed_update(self):
+        self.loginUser(user_id="200")
+        valid = {'username': "BillGates", 'event_name': "Bloob Time Event", 'points-earned': 2}
+        bad_updates = [
+            "BillGates",
+            {'event_name': "Bloob Time Event", 'points-earned': 2},
+            {'username': "BillGates", 'points-earned': 2},
+            {'username': "BillGates", 'event_name': "Bloob Time Event"},
+            {'username': "BillGates", 'event_name': "Bloob Time Event", 'points-earned': "lots"},
+        ]
+        for bad in bad_updates:
+            response = self.put_updates([valid, bad])
+            self.assertEqual(400, response.status_code)
+            self.assertIn("Update 1", json.loads(response.data)['message'])
+
+        response = self.app.put("/api/point-records/batch",
+                                data=json.dumps({'updates': valid}),
+                                content_type='application/json')
+        self.assertEqual(400, response.status_code)
+
+        bill = PointRecord.key_for(Key(UserData, '100'), Event.get_from_name("Bloob Time Event").key).get()
+        self.assertIsNone(bill)
+
+    def test_batch_forbidden_to_user(self):
+        self.loginUser(user_id="100")
+        response = self.put_updates([])
+        self.assertEqual(403, response.status_code)
+
+
+class RosterAPITestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def put_roster(self, users, deactivate_missing=False):
+        return self.app.put("/api/roster",
+                            data=json.dumps({'users': users,
+                                             'deactivate_missing': deactivate_missing}),
+                            content_type='application/json')
+
+    def test_roster_creates_and_updates_users(self):
+        self.loginUser(user_id="200")
+        response = self.put_roster([
+            {'user_id': "100", 'classification': "senior", 'grad_year': 2017},
+            {'fname': "Jake", 'lname': "Sisko", 'active': True},
+            {'user_id': "300", 'fname': "Kira", 'lname': "Nerys",
+             'classification': "freshman", 'grad_semester': "fall", 'grad_year': 2020},
+        ])
+        self.assertEqual(200, response.status_code)
+
+        data = json.loads(response.data)
+        statuses = [(r['row'], r['status']) for r in data['rows']]
+        self.assertEqual([(1, "updated"), (2, "unchanged"), (3, "created")], statuses)
+
+        bill = UserData.get_user_from_id("100")
+        self.assertEqual("senior", bill.classification)
+        self.assertEqual(2017, bill.graduation_year)
+
+        kira = UserData.get_from_username("KiraNerys")
+        self.assertEqual("300", kira.user_id)
+        self.assertTrue(kira.active)
+        self.assertEqual(['user'], kira.user_permissions)
+
+    def test_roster_populates_records_for_new_users(self):
+        self.loginUser(user_id="200")
+        response = self.put_roster([
+            {'user_id': "300", 'fname': "Kira", 'lname': "Nerys"},
+            {'user_id': "301", 'fname': "Julian", 'lname': "Bashir"},
+        ])
+
+        events = [e for e in Event.query(ancestor=Event.root_key()) if not e.deleted]
+        population = json.loads(response.data)['population']
+        self.assertTrue(population['complete'])
+        self.assertEqual(2 * len(events), population['created'])
+        for uid in ["300", "301"]:
+            self.assertEqual(len(events), PointRecord.query(ancestor=Key(UserData, uid)).count())
+
+    def test_roster_username_claimed_by_another_request(self):
+        self.loginUser(user_id="200")
+        put_with_username = UserData._put_with_username
+
+        def claimed_first(user_data, old_username):
+            # Another request claims the username after it was checked
+            UniqueUsername(id=user_data.username, user=Key(UserData, '999')).put()
+            return put_with_username(user_data, old_username)
+
+        with mock.patch.object(UserData, '_put_with_username', claimed_first):
+            response = self.put_roster([
+                {'user_id': "300", 'fname': "Kira", 'lname': "Nerys"},
+            ])
+
+        data = json.loads(response.data)
+        self.assertEqual("error", data['rows'][0]['status'])
+        self.assertIsNone(data['population'])
+        self.assertIsNone(UserData.get_user_from_id("300"))
+        self.assertEqual(Key(UserData, '999'), UniqueUsername.get_by_id("KiraNerys").user)
+
+    def test_roster_rejects_invalid_rows(self):
+        self.loginUser(user_id="200")
+        response = self.put_roster([
+            {'user_id': "300", 'fname': "Bill", 'lname': "Gates"},
+            {'user_id': "101", 'classification': "grad student"},
+            {'fname': "Kira"},
+            {'user_id': "100", 'active': False},
+            {'fname': "Bill", 'lname': "Gates", 'active': True},
+        ])
+        statuses = [r['status'] for r in json.loads(response.data)['rows']]
+        self.assertEqual(["error", "error", "error", "updated", "error"], statuses)
+
+        self.assertIsNone(UserData.get_user_from_id("300"))
+        self.assertEqual("senior", UserData.get_user_from_id("101").classification)
+        self.assertFalse(UserData.get_user_from_id("100").active)
+
+    def test_roster_deactivates_missing_users(self):
+        self.loginUser(user_id="200")
+        response = self.put_roster([{'user_id': "100"}], deactivate_missing=True)
+
+        deactivated = [r['username'] for r in json.loads(response.data)['rows']
+                       if r['status'] == "deactivated"]
+        self.assertEqual(["JakeSisko"], deactivated)
+        self.assertTrue(UserData.get_user_from_id("100").active)
+        self.assertFalse(UserData.get_user_from_id("101").active)
+
+    def test_roster_forbidden_to_user(self):
+        self.loginUser(user_id="100")
+        response = self.put_roster([])
+        self.assertEqual(403, response.status_code)
+
+
+class UserPointsAPITestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = routes.app.test_client()
+
+    def test_get_points_with_exception(self):
+        loginUser(user_id="100")
+        response = self.app.get('/api/users/100/points')
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        expected = {
+            u'required': 5,
+            u'received': 2,
+            u'level': 2
+        }
+        self.assertEqual(expected, data['Sisterhood']['sub_categories']['Mixers'])
+
+    def test_get_points_with_parent_category(self):
+        loginUser(user_id="101")
+        response = self.app.get('/api/users/101/points')
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        expected_sisterhood = {
+            u'required': 20,
+            u'received': 4,
+            u'level': 1,
+            u'sub_categories': {
+                "Mixers": {
+                    "received": 0,
+                    "required": 8,
+                    "level": 2
+                },
+                u'Bloob Time': {
+                    u'required': 10,
+                    u'received': 3,
+                    u'level': 2,
+                }
+            }
+        }
         self.assertEqual(expected_sisterhood, data['Sisterhood'])
 
     def test_get_points_with_multiple_records(self):
@@ -1470,6 +2871,430 @@ class UserPointsAPITestCase(unittest.TestCase):
     #def test_get_other_user_points_as_officer(self):
 
 
+class UserDashboardAPITestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def test_dashboard_matches_points(self):
+        self.loginUser(user_id="101")
+        response = self.app.get('/api/users/101/dashboard')
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.data)
+
+        points = json.loads(self.app.get('/api/users/101/points').data)
+        self.assertEqual(points, data['categories'])
+
+    def test_dashboard_only_has_upcoming_events(self):
+        upcoming = Event(parent=Event.root_key())
+        upcoming.name = "Upcoming Event"
+        upcoming.date = datetime.datetime.utcnow() + datetime.timedelta(days=7)
+        upcoming.point_category = PointCategory.get_from_name("Mixers").key
+        upcoming.put()
+
+        self.loginUser(user_id="101")
+        data = json.loads(self.app.get('/api/users/101/dashboard').data)
+        expected = [{
+            u'name': u"Upcoming Event",
+            u'date': upcoming.date.strftime('%m/%d/%Y'),
+            u'point-category': u"Mixers",
+        }]
+        self.assertEqual(expected, data['events'])
+
+    def test_dashboard_forbidden_for_other_user(self):
+        self.loginUser(user_id="100")
+        response = self.app.get('/api/users/101/dashboard')
+        self.assertEqual(403, response.status_code)
+
+
+class StandingsAPITestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def test_get_standings_as_user(self):
+        self.loginUser(user_id="100")
+        response = self.app.get('/api/standings')
+        self.assertEqual(response.status_code, 403)
+
+    def test_get_standings_categories(self):
+        self.loginUser(user_id="200")
+        response = self.app.get('/api/standings')
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        expected = [
+            {u'name': u'Philanthropy', u'level': 1, u'parent': None},
+            {u'name': u'Sisterhood', u'level': 1, u'parent': None},
+            {u'name': u'Bloob Time', u'level': 2, u'parent': u'Sisterhood'},
+            {u'name': u'Mixers', u'level': 2, u'parent': u'Sisterhood'},
+        ]
+        self.assertEqual(expected, data['categories'])
+
+    def test_get_active_standings(self):
+        self.loginUser(user_id="200")
+        response = self.app.get('/api/standings?filter=active')
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        self.assertEqual([u'Bill', u'Jake'], [s['fname'] for s in data['standings']])
+
+        jake = data['standings'][1]
+        self.assertEqual([0, 4, 3, 0], jake['received'])
+        self.assertEqual([12, 20, 10, 8], jake['required'])
+        self.assertEqual([12, 16, 7, 8], jake['remaining'])
+        self.assertEqual(28, jake['deficit'])
+
+    def test_get_standings_with_exception(self):
+        self.loginUser(user_id="200")
+        response = self.app.get('/api/standings')
+        data = json.loads(response.data)
+
+        bill = data['standings'][0]
+        self.assertEqual(u'Bill', bill['fname'])
+        self.assertEqual([12, 20, 10, 5], bill['required'])
+        self.assertEqual([12, 18, 10, 3], bill['remaining'])
+
+    def test_get_standings_sorted_by_deficit(self):
+        self.loginUser(user_id="200")
+        response = self.app.get('/api/standings?filter=both&sort=deficit')
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.data)
+        self.assertEqual([u'Bill', u'Bob', u'Jake'], [s['fname'] for s in data['standings']])
+        self.assertEqual([30, 29, 28], [s['deficit'] for s in data['standings']])
+
+
+class ExportAPITestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    @mock.patch('controllers.export_controller.EXPORT_BATCH_SIZE', 2)
+    def test_export_point_records_csv(self):
+        self.loginUser(user_id="200")
+        response = self.app.get('/api/export/point-records')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv', response.mimetype)
+
+        rows = list(csv.DictReader(StringIO.StringIO(response.data)))
+        self.assertEqual(5, len(rows))
+        jake = [r for r in rows if r['username'] == "JakeSisko" and
+                r['event_name'] == "Bloob Time Event"]
+        self.assertEqual(1, len(jake))
+        self.assertEqual("Bloob Time", jake[0]['point_category'])
+        self.assertEqual(3.0, float(jake[0]['points_earned']))
+
+    def test_export_point_records_jsonl(self):
+        self.loginUser(user_id="200")
+        response = self.app.get('/api/export/point-records?format=jsonl')
+        self.assertEqual(200, response.status_code)
+
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(5, len(rows))
+        self.assertEqual(9.0, sum(r['points_earned'] for r in rows))
+
+    def test_export_standings_matches_standings(self):
+        self.loginUser(user_id="200")
+        data = json.loads(self.app.get('/api/standings?filter=both').data)
+        response = self.app.get('/api/export/standings?filter=both&format=jsonl')
+        rows = [json.loads(line) for line in response.data.splitlines()]
+
+        self.assertEqual([s['username'] for s in data['standings']],
+                         [r['username'] for r in rows])
+        for standing, row in zip(data['standings'], rows):
+            for i, cat in enumerate(data['categories']):
+                self.assertEqual(standing['received'][i], row[cat['name'] + " received"])
+                self.assertEqual(standing['required'][i], row[cat['name'] + " required"])
+
+    def test_export_standings_does_not_save_summaries(self):
+        self.loginUser(user_id="200")
+        response = self.app.get('/api/export/standings?filter=both&format=jsonl')
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(3, len(rows))
+        self.assertEqual(0, PointSummary.query().count())
+
+    def test_export_forbidden_to_user(self):
+        self.loginUser(user_id="100")
+        response = self.app.get('/api/export/point-records')
+        self.assertEqual(403, response.status_code)
+
+
+class PointSummaryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Used to debug 500 errors
+        routes.app.config['TESTING'] = True
+        self.app = routes.app.test_client()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_user_stub()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        setup_datastore()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def loginUser(self, email='user@example.com', user_id='123', is_admin=False):
+        self.testbed.setup_env(
+            user_email=email,
+            user_id=user_id,
+            user_is_admin='1' if is_admin else '0',
+            overwrite=True)
+
+    def run_deferred_tasks(self):
+        while True:
+            tasks = self.taskqueue_stub.get_filtered_tasks()
+            if not tasks:
+                break
+            self.taskqueue_stub.FlushQueue('default')
+            for task in tasks:
+                deferred.run(task.payload)
+
+    def get_points(self, user_id):
+        response = self.app.get('/api/users/' + user_id + '/points')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def build_summary(self, user_id):
+        return PointSummary.rebuild(Key('UserData', user_id).get())
+
+    def test_get_points_does_not_save_summary(self):
+        self.loginUser(user_id="101")
+        for url in ['/api/users/101/points', '/api/users/101/dashboard']:
+            response = self.app.get(url)
+            self.assertEqual(200, response.status_code)
+        self.assertIsNone(PointSummary.key_for(Key('UserData', '101')).get(use_cache=False))
+
+        data = self.get_points("101")
+        self.assertEqual(self.build_summary("101").categories, data)
+
+    def test_put_point_record_updates_summary(self):
+        self.loginUser(user_id="200")
+        self.build_summary("101")
+
+        put_data = {
+            u'username': u"JakeSisko",
+            u'event_name': u"Mixers Event",
+            u'points-earned': 2,
+        }
+        response = self.app.put("/api/point-records", data=put_data)
+        self.assertEqual(204, response.status_code)
+
+        data = self.get_points("101")
+        self.assertEqual(2, data['Sisterhood']['sub_categories']['Mixers']['received'])
+        self.assertEqual(6, data['Sisterhood']['received'])
+
+        put_data[u'points-earned'] = 1
+        response = self.app.put("/api/point-records", data=put_data)
+        self.assertEqual(204, response.status_code)
+
+        data = self.get_points("101")
+        self.assertEqual(1, data['Sisterhood']['sub_categories']['Mixers']['received'])
+        self.assertEqual(5, data['Sisterhood']['received'])
+
+    def test_patch_point_category_updates_summary(self):
+        self.loginUser(user_id="200")
+        self.build_summary("200")
+
+        response = self.app.patch("/api/point-categories/Philanthropy",
+                                  data={'member_requirement': 15})
+        self.assertEqual(204, response.status_code)
+        self.run_deferred_tasks()
+
+        data = self.get_points("200")
+        self.assertEqual(15, data['Philanthropy']['required'])
+        self.assertEqual(3, data['Philanthropy']['received'])
+
+    def test_post_point_exception_updates_summary(self):
+        self.loginUser(user_id="200")
+        self.build_summary("101")
+
+        post_data = {
+            "point_category": "Philanthropy",
+            "points_needed": 4,
+        }
+        response = self.app.post("/api/users/101/point-exceptions", data=post_data)
+        self.assertEqual(201, response.status_code)
+
+        data = self.get_points("101")
+        self.assertEqual(4, data['Philanthropy']['required'])
+
+    def test_delete_event_updates_summary(self):
+        self.loginUser(user_id="200")
+        self.build_summary("101")
+
+        response = self.app.delete("/api/events/BloobTimeEvent")
+        self.assertEqual(200, response.status_code)
+
+        # The points are subtracted from the summary instead of deleting it
+        summary = PointSummary.key_for(Key('UserData', '101')).get(use_cache=False)
+        self.assertEqual(0, summary.received['Bloob Time'])
+
+        data = self.get_points("101")
+        self.assertEqual(0, data['Sisterhood']['sub_categories']['Bloob Time']['received'])
+        self.assertEqual(1, data['Sisterhood']['received'])
+
+    def test_change_event_category_resets_summary(self):
+        self.loginUser(user_id="200")
+        user_key = Key('UserData', '101')
+        PointSummary.rebuild(user_key.get())
+
+        put_data = {
+            u'name': u"Bloob Time Event",
+            u'date': u"2016-08-02",
+            u'point-category': u"Philanthropy",
+        }
+        response = self.app.put("/api/events/BloobTimeEvent", data=put_data)
+        self.assertEqual(201, response.status_code)
+        self.run_deferred_tasks()
+        self.assertIsNone(PointSummary.key_for(user_key).get(use_cache=False))
+
+        data = self.get_points("101")
+        self.assertEqual(3, data['Philanthropy']['received'])
+        self.assertEqual(0, data['Sisterhood']['sub_categories']['Bloob Time']['received'])
+
+    def test_change_event_from_deleted_category_resets_summary(self):
+        self.loginUser(user_id="200")
+        user_key = Key('UserData', '101')
+        PointSummary.rebuild(user_key.get())
+        PointCategory.get_from_name("Bloob Time").key.delete()
+
+        put_data = {
+            u'name': u"Bloob Time Event",
+            u'date': u"2016-08-02",
+            u'point-category': u"Philanthropy",
+        }
+        response = self.app.put("/api/events/BloobTimeEvent", data=put_data)
+        self.assertEqual(201, response.status_code)
+        self.run_deferred_tasks()
+
+        data = self.get_points("101")
+        self.assertEqual(3, data['Philanthropy']['received'])
+
+    def test_rebuild_matches_summary(self):
+        self.loginUser(user_id="200")
+        self.build_summary("101")
+        put_data = {
+            u'username': u"JakeSisko",
+            u'event_name': u"My First Event",
+            u'points-earned': 3,
+        }
+        self.app.put("/api/point-records", data=put_data)
+
+        user = UserData.get_user_from_id("101")
+        summary = PointSummary.key_for(user.key).get()
+        self.assertEqual(PointSummary.rebuild(user).categories, summary.categories)
+
+    def test_rebuild_batches_event_gets(self):
+        user = UserData.get_user_from_id("101")
+        CategoryTree.get()
+        ndb.get_context().clear_cache()
+
+        calls = []
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'count_datastore_calls',
+            lambda service, call, request, response: calls.append(call),
+            'datastore_v3')
+        summary = PointSummary.rebuild(user)
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Clear()
+
+        # Both of the user's events are fetched with a single get
+        self.assertEqual(1, calls.count('Get'))
+        self.assertEqual({u'Sisterhood': 1, u'Bloob Time': 3}, summary.received)
+
+    def test_get_points_for_unknown_user(self):
+        self.loginUser(user_id="200")
+        response = self.app.get('/api/users/999/points')
+        self.assertEqual(404, response.status_code)
+
+    def test_rebuild_retries_after_concurrent_write(self):
+        user = UserData.get_user_from_id("101")
+        event = Event.get_from_name("Bloob Time Event")
+        record = PointRecord.key_for(user.key, event.key).get()
+
+        @ndb.non_transactional
+        def write_points():
+            PointSummary.set_record_points(record, user.key, "Bloob Time", 9)
+
+        # The points are written after the rebuild has read the records but
+        # before it saves the summary
+        compute_received_async = PointSummary.compute_received_async
+        writes = []
+
+        @ndb.tasklet
+        def compute_then_write(user_key):
+            received = yield compute_received_async(user_key)
+            if not writes:
+                writes.append(True)
+                write_points()
+            raise ndb.Return(received)
+
+        with mock.patch.object(PointSummary, 'compute_received_async',
+                               staticmethod(compute_then_write)):
+            PointSummary.rebuild(user)
+
+        summary = PointSummary.key_for(user.key).get(use_cache=False)
+        self.assertEqual(9, summary.received['Bloob Time'])
+
+
 if __name__ == '__main__':
     setup_testbed()
     unittest.main()
@@ -0,0 +1,45 @@
+""" Conditional GET support for the API.
+
+Resources that know the version of what they return set its ETag and call
+`not_modified` before doing any work, so a client that already has that
+version only pays for a revalidation round trip. Every other API response
+gets an ETag hashed from its body by `add_etag`.
+"""
+
+import hashlib
+
+from flask import request, current_app
+
+
+def make_etag(*parts):
+    """ Builds an ETag from the values that identify a version of a resource. """
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+
+def not_modified(etag):
+    """ Gets a 304 response if the client already has `etag`, or None. """
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    return response
+
+
+def add_etag(response):
+    """ Adds an ETag to successful API GET responses that don't have one.
+
+    The response is turned into a 304 if it matches the request's
+    If-None-Match header. Streamed responses are skipped since hashing them
+    would read the whole body into memory.
+    """
+    if (request.method in ('GET', 'HEAD') and request.path.startswith('/api/')
+            and response.status_code == 200 and 'ETag' not in response.headers
+            and not response.is_streamed):
+        response.add_etag()
+        response.make_conditional(request)
+    return response
@@ -0,0 +1,51 @@
+class FieldPlan(object):
+    """ Maps the fields of a list response to the properties they come from.
+
+    If every property a plan needs can be projected, list endpoints run their
+    queries as projection queries. Only the index rows for those properties
+    are read, so the rest of each entity is never loaded or deserialized.
+    Every projection that is used needs a composite index in index.yaml.
+    """
+
+    def __init__(self, fields):
+        """
+        Args:
+            fields (list): (response field name, ndb property) tuples in the
+                order they should be read.
+        """
+        self.fields = fields
+
+    def projection(self, fixed=()):
+        """ Gets the properties to project, or None if a projection won't work.
+
+        Args:
+            fixed (iterable): The names of the properties with an equality
+                filter. Those can't be projected, and their values come from
+                the filter instead (see `serialize`).
+
+        Returns:
+            A list of properties, or None if a property is repeated or not
+            indexed. A projection on a repeated property returns an entity
+            for every value, and one on an unindexed property can't be run.
+        """
+        props = [p for _, p in self.fields if p._name not in fixed]
+        if not props or any(p._repeated or not p._indexed for p in props):
+            return None
+        return props
+
+    def serialize(self, entity, fixed=None):
+        """ Builds the response fields for an entity.
+
+        Args:
+            entity (ndb.Model): A full or projected entity.
+            fixed (dict): The values of the properties with an equality
+                filter, keyed by property name.
+        """
+        fixed = fixed or {}
+        out = {}
+        for name, prop in self.fields:
+            if prop._name in fixed:
+                out[name] = fixed[prop._name]
+            else:
+                out[name] = getattr(entity, prop._code_name)
+        return out
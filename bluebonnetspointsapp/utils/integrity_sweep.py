@@ -0,0 +1,86 @@
+import logging
+
+from google.appengine.ext import ndb
+from google.appengine.ext import deferred
+
+from models.point_model import PointRecord
+from models.event_model import Event
+from models.summary_model import PointSummary
+from models.category_tree import CategoryTree
+from utils.point_summaries import run_rebuild_point_summaries
+
+BATCH_SIZE = 100  # ideal batch size may vary based on entity size.
+
+# Read endpoints skip bad data instead of fixing it, so that they never
+# write. This sweep fixes the bad data in the background instead.
+
+def run_integrity_sweep(cursor=None, num_fixed=0):
+    """ Fixes the point records in one batch and defers the next batch.
+
+    Records whose user or event no longer exists are deleted. Records without
+    any points are left alone since they are counted as 0. Once every record
+    has been checked the point categories are swept, and the summaries that
+    the read endpoints computed without saving are built.
+    """
+    q = PointRecord.query()
+    records, cur, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+    checked = len(records)
+
+    # Records from before the rekey migration are left to the migration
+    records = [r for r in records if r.user_data and r.event]
+    keys = list({r.user_data for r in records} | {r.event for r in records})
+    entities = dict(zip(keys, ndb.get_multi(keys)))
+
+    orphans = [r.key for r in records
+               if entities[r.user_data] is None or entities[r.event] is None]
+
+    # The summaries of users that don't exist are orphans too
+    summary_keys = {PointSummary.key_for(r.user_data) for r in records
+                    if entities[r.user_data] is None}
+    ndb.delete_multi(orphans + list(summary_keys))
+    num_fixed += len(orphans)
+    logging.debug(
+        'Checked %d point records and fixed %d for a total of %d',
+        checked, len(orphans), num_fixed)
+
+    if more:
+        deferred.defer(run_integrity_sweep, cursor=cur, num_fixed=num_fixed)
+    else:
+        num_fixed += sweep_categories()
+        deferred.defer(run_rebuild_point_summaries, missing_only=True)
+        uncategorized = find_uncategorized_events()
+        logging.debug('IntegritySweep complete with %d fixes!', num_fixed)
+        if uncategorized:
+            # There is no way to tell which category these events belong in,
+            # so an officer has to pick one
+            logging.error(
+                'These events need a new point category: %s',
+                ', '.join(e.name for e in uncategorized))
+
+def sweep_categories():
+    """ Removes the sub-categories that no longer exist from every category.
+
+    Returns:
+        The number of categories that were fixed.
+    """
+    tree = CategoryTree.build()
+    to_put = []
+    for cat in tree.categories:
+        invalid_keys = tree.invalid_keys(cat)
+        if invalid_keys:
+            cat.sub_categories = [k for k in cat.sub_categories if k not in invalid_keys]
+            to_put.append(cat)
+
+    ndb.put_multi(to_put)
+    return len(to_put)
+
+def find_uncategorized_events():
+    """ Gets the events whose point category no longer exists.
+
+    The read endpoints show these events without a category and skip their
+    points, until an officer gives them a new category.
+    """
+    tree = CategoryTree.build()
+    events = Event.query(ancestor=Event.root_key()).fetch()
+    return [e for e in events
+            if not e.deleted and e.point_category not in tree.by_key]
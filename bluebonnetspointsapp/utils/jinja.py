@@ -1,7 +1,7 @@
 from flask import render_template, url_for, request
 from google.appengine.api import users
 
-from models.user_model import UserData
+from utils import resolver
 
 def render_jinja_template(name, context=None):
     """ Renders a jinja template witha given context
@@ -17,7 +17,7 @@ def render_jinja_template(name, context=None):
     from permissions import check_perms
 
     template_values = {
-        'user_data': UserData.get_current_user_data(),
+        'user_data': resolver.current_user_data(),
         'login_url': url_for('login', next=request.path),
         'logout_url': users.create_logout_url("/"),
         'check_perms': check_perms,
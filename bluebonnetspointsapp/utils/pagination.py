@@ -0,0 +1,58 @@
+from flask import request
+from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.api import datastore_errors
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def get_page_args():
+    """ Gets the page size and cursor from the `limit` and `cursor` url args. """
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = request.args.get("cursor", None) or None
+    return limit, cursor
+
+
+@ndb.tasklet
+def fetch_page_async(query, limit, cursor=None, use_offset=False, **options):
+    """ Fetches one page of a query.
+
+    Args:
+        query (ndb.Query): The query to fetch a page of.
+        limit (int): The maximum number of results in the page.
+        cursor (str): The `next_cursor` returned with the previous page, or
+            None for the first page.
+        use_offset (bool): Queries with an IN filter can't use datastore
+            cursors, so their cursor is the offset of the page instead.
+        options: Query options such as `projection` that are passed on to
+            the fetch.
+
+    Returns:
+        A future for a tuple of the results and the cursor of the next page.
+        The cursor is None if this is the last page.
+    """
+    try:
+        if use_offset:
+            offset = int(cursor) if cursor else 0
+        else:
+            start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    except (ValueError, datastore_errors.BadValueError):
+        raise Exception("Invalid cursor: " + cursor)
+
+    if use_offset:
+        results = yield query.fetch_async(limit + 1, offset=offset, **options)
+        next_cursor = str(offset + limit) if len(results) > limit else None
+        raise ndb.Return(results[:limit], next_cursor)
+
+    results, next_cursor, more = yield query.fetch_page_async(
+        limit, start_cursor=start_cursor, **options)
+    if more and next_cursor is not None:
+        raise ndb.Return(results, next_cursor.urlsafe())
+    raise ndb.Return(results, None)
+
+
+def fetch_page(query, limit, cursor=None, use_offset=False, **options):
+    """ Fetches one page of a query. See `fetch_page_async`. """
+    return fetch_page_async(query, limit, cursor, use_offset, **options).get_result()
@@ -0,0 +1,98 @@
+""" A memcache read-through cache for the JSON payloads of list endpoints.
+
+Each kind of entity has a generation in memcache, and the key of a cached
+payload includes the generations of every kind it was built from. Writing an
+entity bumps the generation of its kind, which invalidates every payload
+built from that kind at once without having to know their keys. The old
+payloads are never read again and are left to expire.
+
+A payload's key changes whenever the payload may have changed, so it is also
+used as the payload's ETag.
+"""
+
+import hashlib
+import json
+import time
+
+from google.appengine.api import memcache
+
+from models.category_tree import VERSION_KEY
+
+# How long a payload is cached if nothing invalidates it
+PAYLOAD_TTL = 60 * 60
+
+EVENTS = "events"
+USERS = "users"
+# The categories use the version of the category tree, which is bumped
+# whenever a point category is written
+CATEGORIES = "categories"
+
+
+def _generation_key(kind):
+    if kind == CATEGORIES:
+        return VERSION_KEY
+    return "payload_generation:" + kind
+
+
+def _new_generation():
+    # The generation is based on the time so that it is not reused if
+    # memcache evicts it
+    return int(time.time() * 1000000)
+
+
+def generations(kinds):
+    """ Gets the current generation of each kind with a single memcache call. """
+    keys = [_generation_key(kind) for kind in kinds]
+    found = memcache.get_multi(keys)
+    gens = []
+    for key in keys:
+        gen = found.get(key)
+        if gen is None:
+            gen = _new_generation()
+            if not memcache.add(key, gen):
+                gen = memcache.get(key)
+        gens.append(gen)
+    return gens
+
+
+def bump(kind):
+    """ Invalidates every cached payload built from `kind`. """
+    memcache.incr(_generation_key(kind), initial_value=_new_generation())
+
+
+def payload_key(name, kinds, args):
+    """ Gets the key of the current version of a payload.
+
+    The generations are read before the payload is built so that a write
+    made while it is being built invalidates it.
+
+    Args:
+        name (str): The name of the payload, e.g. the endpoint it is for.
+        kinds (list): The kinds of entities the payload is built from.
+        args (dict): Everything else the payload depends on, e.g. the
+            request's url args.
+    """
+    parts = [name, generations(kinds), sorted(args.items())]
+    return hashlib.sha1(json.dumps(parts)).hexdigest()
+
+
+def cached_payload(key, build):
+    """ Gets a payload from memcache, or builds and caches it.
+
+    Args:
+        key (str): The key from `payload_key`.
+        build (function): Builds the payload. It must return a JSON
+            serializable dict, or None if there is nothing to cache.
+
+    Returns:
+        The payload, or None if `build` returned None.
+    """
+    key = "payload:" + key
+    payload = memcache.get(key)
+    if payload is not None:
+        return json.loads(payload)
+
+    payload = build()
+    if payload is not None:
+        memcache.set(key, json.dumps(payload), time=PAYLOAD_TTL)
+    return payload
@@ -0,0 +1,61 @@
+import logging
+
+from google.appengine.ext import ndb
+from google.appengine.ext import deferred
+
+from models.user_model import UserData
+from models.summary_model import PointSummary
+from models.category_tree import CategoryTree
+
+BATCH_SIZE = 100  # ideal batch size may vary based on entity size.
+
+def run_rebuild_point_summaries(cursor=None, num_updated=0, missing_only=False):
+    """ Rebuilds every user's PointSummary from their PointRecords.
+
+    This fixes any drift between the summaries and the records they are
+    computed from. With `missing_only` only the summaries that don't exist
+    are built.
+    """
+    q = UserData.query()
+    user_list, cur, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+
+    # The summaries are rebuilt concurrently so their lookups share batches
+    futures = [PointSummary.rebuild_async(u, missing_only=missing_only)
+               for u in user_list]
+    ndb.Future.wait_all(futures)
+    for f in futures:
+        f.check_success()
+    num_updated += len(user_list)
+    logging.debug(
+        'Rebuilt %d point summaries for a total of %d',
+        len(user_list), num_updated)
+
+    if more:
+        deferred.defer(run_rebuild_point_summaries, cursor=cur,
+                       num_updated=num_updated, missing_only=missing_only)
+    else:
+        logging.debug(
+            'RebuildPointSummaries complete with %d updates!', num_updated)
+
+def run_update_requirements(cursor=None, num_updated=0):
+    """ Updates the required points in every user's PointSummary.
+
+    This should be deferred whenever a point category changes, so that none
+    of the batches run in the request.
+    """
+    tree = CategoryTree.get()
+    q = UserData.query()
+    user_list, cur, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+
+    for u in user_list:
+        PointSummary.update_requirements(u, tree)
+    num_updated += len(user_list)
+    logging.debug(
+        'Updated requirements for %d users for a total of %d',
+        len(user_list), num_updated)
+
+    if more:
+        deferred.defer(run_update_requirements, cursor=cur, num_updated=num_updated)
+    else:
+        logging.debug(
+            'UpdateRequirements complete with %d updates!', num_updated)
@@ -0,0 +1,73 @@
+import logging
+
+from google.appengine.ext import ndb
+from google.appengine.ext import deferred
+
+from models.user_model import UserData
+from models.event_model import Event
+from models.point_model import PointRecord
+from utils.point_summaries import run_rebuild_point_summaries
+
+BATCH_SIZE = 100  # ideal batch size may vary based on entity size.
+
+def run_rekey_point_records(cursor=None, num_updated=0):
+    """ Moves every PointRecord to the key built by `PointRecord.key_for`.
+
+    Records used to be created with random ids and no parent, and referenced
+    their user and event by name. Each record is copied to its new key under
+    its user with `user_data` and `event` keys, and the old entity is
+    deleted. The point summaries are rebuilt once every record has been
+    moved because they are computed from an ancestor query.
+    """
+    user_keys = {u.username: u.key for u in UserData.query()}
+    event_keys = {e.name: e.key for e in Event.query(ancestor=Event.root_key())
+                  if not e.deleted}
+
+    q = PointRecord.query()
+    record_list, cur, more = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+
+    moved = {}
+    old_keys = []
+    for r in record_list:
+        if r.user_data is not None and r.event is not None:
+            # The record has already been migrated
+            continue
+
+        if r.username not in user_keys or r.event_name not in event_keys:
+            logging.warning('Cannot rekey point record for unknown user or event: %s', r)
+            continue
+
+        new_key = PointRecord.key_for(user_keys[r.username], event_keys[r.event_name])
+
+        # Prefer a duplicate record that has points over one that doesn't
+        if new_key not in moved or moved[new_key].points_earned is None:
+            moved[new_key] = r
+        if r.key != new_key:
+            old_keys.append(r.key)
+
+    new_keys = moved.keys()
+    to_put = []
+    for new_key, existing in zip(new_keys, ndb.get_multi(new_keys)):
+        r = moved[new_key]
+        if existing is not None and existing.user_data is not None and (
+                existing.points_earned is not None or r.points_earned is None):
+            # The record has already been moved
+            continue
+
+        new_record = PointRecord.for_user_and_event(new_key.parent(), event_keys[r.event_name])
+        new_record.points_earned = r.points_earned
+        to_put.append(new_record)
+
+    ndb.put_multi(to_put)
+    ndb.delete_multi(old_keys)
+    num_updated += len(to_put)
+    logging.debug(
+        'Migrated %d point records for a total of %d',
+        len(to_put), num_updated)
+
+    if more:
+        deferred.defer(run_rekey_point_records, cursor=cur, num_updated=num_updated)
+    else:
+        logging.debug(
+            'RekeyPointRecords complete with %d updates!', num_updated)
+        deferred.defer(run_rebuild_point_summaries)
@@ -0,0 +1,90 @@
+""" Lookups that are memoized for the life of a request.
+
+A single request usually needs the same entities several times (e.g. the
+permissions decorator, the handler and the template all need the current
+user), so the entities are cached on `flask.g`. Every lookup of the same
+entity returns the same object, so changes made by a handler are seen by the
+template that is rendered afterwards.
+
+Outside of a request the lookups go straight to the datastore.
+"""
+
+import urlparse
+
+from flask import g, has_app_context
+from google.appengine.api import users
+from google.appengine.ext import ndb
+
+from models.user_model import UserData
+from models.event_model import Event
+from models.point_model import PointCategory, name_to_slug
+
+
+def _get_cache():
+    """ Gets the cache for the current request, or None outside of a request. """
+    if not has_app_context():
+        return None
+
+    cache = getattr(g, '_resolver_cache', None)
+    if cache is None:
+        cache = g._resolver_cache = {}
+    return cache
+
+
+def _resolve(cache_key, lookup):
+    """ Gets an entity from the request cache or calls `lookup` to get it.
+
+    Entities that don't exist are not cached since they may be created later
+    in the request.
+    """
+    cache = _get_cache()
+    if cache is None:
+        return lookup()
+
+    if cache_key in cache:
+        return cache[cache_key]
+
+    entity = lookup()
+    if entity is not None:
+        # Share one object per entity no matter how it was looked up
+        entity = cache.setdefault(entity.key, entity)
+        cache[cache_key] = entity
+    return entity
+
+
+def current_user_data():
+    """ Gets the current user's UserData or returns None. """
+    user = users.get_current_user()
+    if not user:
+        return None
+
+    return user_from_id(user.user_id())
+
+
+def user_from_id(user_id):
+    return _resolve(ndb.Key(UserData, user_id),
+                    lambda: UserData.get_user_from_id(user_id))
+
+
+def user_from_username(username):
+    return _resolve(('username', username),
+                    lambda: UserData.get_from_username(username))
+
+
+def user_from_url_segment(url_segment):
+    """ Gets a user from a url segment like `UserData.get_from_url_segment`. """
+    if url_segment == "me":
+        return current_user_data()
+
+    return _resolve(('url_segment', url_segment),
+                    lambda: user_from_id(url_segment) or user_from_username(url_segment))
+
+
+def event_from_name(name):
+    slug = name_to_slug(urlparse.unquote(name))
+    return _resolve(('event', slug), lambda: Event.get_from_name(name))
+
+
+def category_from_name(name):
+    slug = name_to_slug(name)
+    return _resolve(('category', slug), lambda: PointCategory.get_from_name(name))
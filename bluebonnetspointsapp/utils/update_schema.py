@@ -3,31 +3,64 @@ import logging
 from google.appengine.ext import ndb
 from google.appengine.ext import deferred
 
-from models.user_model import UserData
+from models.user_model import UserData, UniqueUsername
 from models.point_model import PointCategory
+from models.event_model import Event
 
 BATCH_SIZE = 100  # ideal batch size may vary based on entity size.
 
-def run_update_schema(cursor=None, num_updated=0):
-    q = UserData.query()
-    user_list, cur, _ = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
+# The models that are updated by the migration, in order. Putting an entity
+# again stores any new properties (such as the slug and username
+# ComputedProperties).
+SCHEMA_MODELS = [UserData, PointCategory, Event]
+
+def run_update_schema(cursor=None, num_updated=0, model_index=0):
+    model = SCHEMA_MODELS[model_index]
+    q = model.query()
+    entity_list, cur, _ = q.fetch_page(BATCH_SIZE, start_cursor=cursor)
 
     to_put = []
-    for u in user_list:
+    for e in entity_list:
         # In this example, the default values of 0 for num_votes and avg_rating
         # are acceptable, so we don't need this loop.  If we wanted to manually
         # manipulate property values, it might go something like this:
-        to_put.append(u)
+        to_put.append(e)
+
+    if model is UserData:
+        to_put.extend(claim_usernames(entity_list))
 
     if to_put:
         ndb.put_multi(to_put)
         num_updated += len(to_put)
         logging.debug(
-            'Put %d entities to Datastore for a total of %d',
-            len(to_put), num_updated)
-        deferred.defer(run_update_schema, cursor=cur, num_updated=num_updated)
+            'Put %d %s entities to Datastore for a total of %d',
+            len(to_put), model.__name__, num_updated)
+        deferred.defer(run_update_schema, cursor=cur, num_updated=num_updated,
+                       model_index=model_index)
+    elif model_index + 1 < len(SCHEMA_MODELS):
+        # Move on to the next model
+        deferred.defer(run_update_schema, num_updated=num_updated,
+                       model_index=model_index + 1)
     else:
         logging.debug(
             'UpdateSchema complete with %d updates!', num_updated)
 
+def claim_usernames(user_list):
+    """ Creates the UniqueUsername entities for users that don't have one. """
+    user_list = [u for u in user_list if u.username]
+    markers = ndb.get_multi([ndb.Key(UniqueUsername, u.username) for u in user_list])
+
+    to_put = []
+    # Usernames claimed earlier in this batch are taken like existing ones
+    claimed = {}
+    for u, marker in zip(user_list, markers):
+        owner = marker.user if marker is not None else claimed.get(u.username)
+        if owner is None:
+            to_put.append(UniqueUsername(id=u.username, user=u.key))
+            claimed[u.username] = u.key
+        elif owner != u.key:
+            logging.warning(
+                'Username %s of user %s is already taken by user %s',
+                u.username, u.key.id(), owner.id())
 
+    return to_put